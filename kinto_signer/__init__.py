@@ -1,13 +1,16 @@
 import pkg_resources
 import functools
+import warnings
 
 from kinto.core.events import ACTIONS, ResourceChanged
+from kinto.events import ServerFlushed
 from pyramid.exceptions import ConfigurationError
 from pyramid.settings import asbool
 
 from kinto_signer.signer import heartbeat
 from kinto_signer import utils
 from kinto_signer import listeners
+from kinto_signer.updater import DEFAULT_PAGE_SIZE, LocalUpdater
 
 #: Module version, as defined in PEP-0396.
 __version__ = pkg_resources.get_distribution(__package__).version
@@ -43,6 +46,39 @@ def _signer_dotted_location(settings, resource):
     return signer_dotted_location, prefix
 
 
+def _resource_setting(settings, resource, name, default=None,
+                      include_global=True):
+    """
+    Returns the value of the setting `name` for the specified `resource`,
+    looking up the collection-wide (``signer.<bid>_<cid>.<name>``), then the
+    bucket-wide (``signer.<bid>.<name>``) and finally the global setting,
+    unless `include_global` is false.
+    """
+    prefixes = ['signer.{bucket}_{collection}.'.format(**resource['source']),
+                'signer.{bucket}.'.format(**resource['source'])]
+    if include_global:
+        prefixes.append('signer.')
+    for prefix in prefixes:
+        if (prefix + name) in settings:
+            return settings[prefix + name]
+    return default
+
+
+def _tombstones_policy(settings, resource):
+    """
+    Returns the options of the destination tombstones purge for the specified
+    `resource` (see :class:`kinto_signer.updater.LocalUpdater`).
+    """
+    policy = {}
+    max_age = _resource_setting(settings, resource, "tombstones_max_age")
+    if max_age is not None:
+        policy['tombstones_max_age'] = int(max_age)
+    max_count = _resource_setting(settings, resource, "tombstones_max_count")
+    if max_count is not None:
+        policy['tombstones_max_count'] = int(max_count)
+    return policy
+
+
 def includeme(config):
     # Register heartbeat to check signer integration.
     config.registry.heartbeats['signer'] = heartbeat
@@ -54,6 +90,11 @@ def includeme(config):
     to_review_enabled = asbool(settings.get("signer.to_review_enabled", False))
     group_check_enabled = asbool(settings.get("signer.group_check_enabled",
                                               False))
+    page_size = int(settings.get("signer.page_size", DEFAULT_PAGE_SIZE))
+    max_parallel_signatures = int(settings.get(
+        "signer.max_parallel_signatures", 1))
+    sign_after_commit = asbool(settings.get("signer.sign_after_commit",
+                                            False))
 
     # Check source and destination resources are configured.
     raw_resources = settings.get('signer.resources')
@@ -61,6 +102,7 @@ def includeme(config):
         error_msg = "Please specify the kinto.signer.resources setting."
         raise ConfigurationError(error_msg)
     resources = utils.parse_resources(raw_resources)
+    resources_index = utils.index_resources(resources)
 
     # Load the signers associated to each resource.
     config.registry.signers = {}
@@ -70,6 +112,92 @@ def includeme(config):
         backend = signer_module.load_from_settings(settings, prefix)
         config.registry.signers[key] = backend
 
+    # Optional automatic signatures, debounced per resource. They are only
+    # enabled for the buckets or collections listed explicitly.
+    auto_sign_delays = {}
+    for key, resource in resources.items():
+        delay = _resource_setting(settings, resource, "auto_sign_delay",
+                                  include_global=False)
+        if delay is not None:
+            auto_sign_delays[key] = float(delay)
+    config.registry.signer_debouncer = utils.Debouncer()
+
+    # Optional profiling of the slow or sampled signatures.
+    profiler = None
+    profiling_dir = settings.get("signer.profiling_dir")
+    if profiling_dir is not None:
+        threshold = settings.get("signer.profiling_threshold")
+        profiler = utils.Profiler(
+            directory=profiling_dir,
+            threshold=float(threshold) if threshold is not None else None,
+            sample_rate=float(settings.get("signer.profiling_sample_rate",
+                                           0)))
+
+    # Optional tracking of the memory allocated by signatures.
+    memory_tracker = None
+    if asbool(settings.get("signer.memory_tracking_enabled", False)):
+        if utils.tracemalloc is None:
+            warnings.warn("Memory tracking requires tracemalloc (Python 3)")
+        else:
+            memory_tracker = utils.MemoryTracker(
+                top=int(settings.get("signer.memory_tracking_top", 5)))
+            if max_parallel_signatures > 1:
+                warnings.warn("Memory tracking is only exact with serial "
+                              "signatures (max_parallel_signatures = 1)")
+
+    # Optional measure of the storage and permission calls of the updaters.
+    config.registry.signer_storage = config.registry.storage
+    config.registry.signer_permission = config.registry.permission
+    if asbool(settings.get("signer.storage_instrumentation_enabled", False)):
+        statsd = config.registry.statsd
+        config.registry.signer_storage = utils.InstrumentedBackend(
+            config.registry.storage, name="storage", statsd=statsd)
+        config.registry.signer_permission = utils.InstrumentedBackend(
+            config.registry.permission, name="permission", statsd=statsd)
+
+    # Additional options of the updaters, by resource.
+    updaters_options = {}
+    for key, resource in resources.items():
+        options = _tombstones_policy(settings, resource)
+        options['profiler'] = profiler
+        options['memory_tracker'] = memory_tracker
+        options['changesets_enabled'] = asbool(_resource_setting(
+            settings, resource, "changesets_enabled", False))
+        options['snapshots_dir'] = _resource_setting(
+            settings, resource, "snapshots_dir")
+        options['snapshots_gzip'] = asbool(_resource_setting(
+            settings, resource, "snapshots_gzip", False))
+        updaters_options[key] = options
+    config.registry.signer_resources = resources
+
+    # Updaters of each resource, shared by the listeners.
+    config.registry.signer_updaters = {}
+    for key, resource in resources.items():
+        config.registry.signer_updaters[key] = LocalUpdater(
+            signer=config.registry.signers[key],
+            storage=config.registry.signer_storage,
+            permission=config.registry.signer_permission,
+            source=resource['source'],
+            destination=resource['destination'],
+            page_size=page_size,
+            statsd=config.registry.statsd,
+            **updaters_options[key])
+
+    # Destinations already created and configured by this process.
+    config.registry.signer_bootstrapped = set()
+
+    # Optionally, prevent concurrent signatures among nodes.
+    config.registry.signer_lock = None
+    if asbool(settings.get("signer.lock_enabled", False)):
+        config.registry.signer_lock = utils.CacheLock(
+            cache=config.registry.cache,
+            ttl=int(settings.get("signer.lock_ttl", 60)),
+            wait_timeout=float(settings.get("signer.lock_wait_timeout", 0)),
+            statsd=config.registry.statsd)
+
+    # Changesets of the destinations.
+    config.scan("kinto_signer.views")
+
     # Expose the capabilities in the root endpoint.
     message = "Digital signatures for integrity and authenticity of records."
     docs = "https://github.com/Kinto/kinto-signer#kinto-signer"
@@ -83,31 +211,34 @@ def includeme(config):
 
     config.add_subscriber(
         functools.partial(listeners.set_work_in_progress_status,
-                          resources=resources),
+                          resources_index=resources_index,
+                          auto_sign_delays=auto_sign_delays),
         ResourceChanged,
         for_resources=('record',))
 
     config.add_subscriber(
-        functools.partial(listeners.check_collection_status,
-                          resources=resources,
-                          to_review_enabled=to_review_enabled,
-                          group_check_enabled=group_check_enabled,
-                          editors_group=editors_group,
-                          reviewers_group=reviewers_group),
+        listeners.reset_bootstrapped_destinations,
         ResourceChanged,
-        for_actions=(ACTIONS.CREATE, ACTIONS.UPDATE),
-        for_resources=('collection',))
+        for_actions=(ACTIONS.UPDATE, ACTIONS.DELETE),
+        for_resources=('bucket', 'collection'))
 
     config.add_subscriber(
-        functools.partial(listeners.check_collection_tracking,
-                          resources=resources),
-        ResourceChanged,
-        for_actions=(ACTIONS.CREATE, ACTIONS.UPDATE),
-        for_resources=('collection',))
+        listeners.reset_bootstrapped_destinations,
+        ServerFlushed)
 
+    # The configured resources are looked up once for the status checks,
+    # the tracking checks and the signatures.
     config.add_subscriber(
-        functools.partial(listeners.sign_collection_data,
-                          resources=resources),
+        functools.partial(listeners.on_collection_changed,
+                          resources_index=resources_index,
+                          status_options=dict(
+                              to_review_enabled=to_review_enabled,
+                              group_check_enabled=group_check_enabled,
+                              editors_group=editors_group,
+                              reviewers_group=reviewers_group),
+                          signing_options=dict(
+                              max_parallel_signatures=max_parallel_signatures,
+                              sign_after_commit=sign_after_commit)),
         ResourceChanged,
         for_actions=(ACTIONS.CREATE, ACTIONS.UPDATE),
         for_resources=('collection',))
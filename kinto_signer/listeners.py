@@ -1,16 +1,31 @@
+from collections import OrderedDict, deque
+from contextlib import contextmanager
+
 import transaction
+from concurrent.futures import ThreadPoolExecutor
 from kinto.core import errors
 
 from kinto import logger
-from kinto.core.utils import instance_uri
+from kinto.events import ServerFlushed
+from kinto.core.utils import build_request, instance_uri
 from pyramid import httpexceptions
 
-from kinto_signer.updater import LocalUpdater
+from kinto_signer.updater import (_Counter, capture_resource_events,
+                                  collections_metadata)
 from kinto_signer.utils import STATUS
 
 
 _PLUGIN_USERID = "plugin:kinto-signer"
 
+_PENDING_SIGNATURES = "signer.pending_signatures"
+
+_SCHEDULED_SIGNATURES = "signer.scheduled_signatures"
+
+_HELD_LOCKS = "signer.held_locks"
+
+# Number of signatures computed once committed, if the destination changes.
+_SIGN_AFTER_COMMIT_ATTEMPTS = 3
+
 
 def raise_invalid(**kwargs):
     # A ``400`` error response does not natively rollback the transaction.
@@ -24,41 +39,56 @@ def raise_forbidden(**kwargs):
     raise errors.http_error(httpexceptions.HTTPForbidden(), **kwargs)
 
 
-def sign_collection_data(event, resources):
+def _sign_collection_data(event, configured, max_parallel_signatures,
+                          sign_after_commit):
     """
-    Listen to resource change events, to check if a new signature is
-    requested.
+    Check if a new signature is requested for the configured collections.
 
     When a source collection specified in settings is modified, and its
     new metadata ``status`` is set to ``"to-sign"``, then sign the data
     and update the destination.
-    """
-    payload = event.payload
 
-    for impacted in event.impacted_records:
-        new_collection = impacted['new']
+    If ``max_parallel_signatures`` is greater than one, the signatures
+    requested within the same request (e.g. batch) are collected and
+    executed together at the end of the transaction.
 
-        key = instance_uri(event.request, "collection",
-                           bucket_id=payload['bucket_id'],
-                           id=new_collection['id'])
-        resource = resources.get(key)
+    If ``sign_after_commit`` is enabled, the records are pushed to the
+    destination in the current transaction, but the signer is called once it
+    was committed.
 
-        # Only sign the configured resources.
-        if resource is None:
-            continue
+    The updaters of the resources are built once, at startup, and are
+    found in ``registry.signer_updaters``.
+    """
+    payload = event.payload
+    registry = event.request.registry
 
-        registry = event.request.registry
-        updater = LocalUpdater(signer=registry.signers[key],
-                               storage=registry.storage,
-                               permission=registry.permission,
-                               source=resource['source'],
-                               destination=resource['destination'])
+    # Only sign the configured resources.
+    for key, impacted in configured:
+        new_collection = impacted['new']
+        updater = registry.signer_updaters[key]
 
         new_status = new_collection.get("status")
         if new_status == STATUS.TO_SIGN:
+            # Save a read of the source collection record.
+            latest = _latest_collection_record(event.request,
+                                               payload['bucket_id'],
+                                               new_collection['id'])
+            if latest is not None:
+                cache = collections_metadata(event.request)
+                cache.setdefault(key, latest)
+
+            if sign_after_commit:
+                _push_and_sign_after_commit(event.request, key, updater)
+                continue
+
+            if max_parallel_signatures > 1:
+                _defer_signature(event.request, key, updater,
+                                 max_parallel_signatures)
+                continue
+
             # Run signature process (will set `last_reviewer` field).
             try:
-                updater.sign_and_update_destination(event.request)
+                _locked_signature(key, updater, event.request)
             except Exception:
                 logger.exception("Could not sign '{0}'".format(key))
                 event.request.response.status = 503
@@ -68,12 +98,274 @@ def sign_collection_data(event, resources):
             updater.update_source_editor(event.request)
 
 
-def check_collection_status(event, resources, group_check_enabled,
-                            to_review_enabled, editors_group, reviewers_group):
+def _latest_collection_record(request, bucket_id, collection_id):
+    """Return the latest version of the collection record among the resource
+    events of the request (``None`` if deleted).
+    """
+    latest = None
+    events = request.bound_data.get("resource_events", {})
+    for _, payload, impacted, _ in events.values():
+        if payload["resource_name"] != "collection" or \
+           payload.get("bucket_id") != bucket_id:
+            continue
+        for change in impacted:
+            record = change["new"]
+            if record["id"] != collection_id:
+                continue
+            if latest is None or \
+               record["last_modified"] > latest["last_modified"]:
+                latest = record
+    if latest is not None and latest.get("deleted"):
+        return None
+    return latest
+
+
+@contextmanager
+def _signing_lock(request, key):
+    """Hold the signing lock of the collection, if enabled in settings."""
+    lock = request.registry.signer_lock
+    if lock is None:
+        yield
+    else:
+        with lock.hold(key):
+            yield
+
+
+def _lock_until_completed(request, key):
+    """Acquire the signing lock of the collection, if enabled in settings,
+    until the current transaction is committed or aborted.
+
+    Releasing it earlier would let other nodes sign from the previous
+    committed state.
+
+    :returns: the function that releases the lock, or ``None`` if no lock
+        was acquired.
+    """
+    lock = request.registry.signer_lock
+    if lock is None:
+        return None
+    held = request.bound_data.setdefault(_HELD_LOCKS, set())
+    if key in held:
+        # Already held for the current transaction.
+        return None
+    token = lock.acquire(key)
+    held.add(key)
+
+    def _release(*args):
+        held.discard(key)
+        lock.release(key, token)
+
+    current = transaction.get()
+    current.addAfterCommitHook(_release)
+    # After-commit hooks are not called if the transaction is aborted.
+    current.join(_AbortHook(_release))
+    return _release
+
+
+class _AbortHook(object):
+    """Data manager that calls the specified function if the transaction is
+    aborted.
+    """
+    transaction_manager = transaction.manager
+
+    def __init__(self, func):
+        self.func = func
+
+    def abort(self, txn):
+        self.func()
+
+    def tpc_abort(self, txn):
+        self.func()
+
+    def tpc_begin(self, txn):
+        pass
+
+    def commit(self, txn):
+        pass
+
+    def tpc_vote(self, txn):
+        pass
+
+    def tpc_finish(self, txn):
+        pass
+
+    def sortKey(self):
+        return "kinto_signer.lock"
+
+
+def _locked_signature(key, updater, request):
+    _lock_until_completed(request, key)
+    return updater.sign_and_update_destination(request)
+
+
+def _push_and_sign_after_commit(request, key, updater):
+    with capture_resource_events(request, updater.timer('events')):
+        updater.create_destination(request)
+        changeset = updater.push_records_to_destination(request)
+
+    current = transaction.get()
+    current.addAfterCommitHook(_sign_committed,
+                               args=(request, key, updater, changeset))
+
+
+def _sign_committed(success, request, key, updater, changeset):
+    """Sign the destination once the records pushed were committed.
+
+    The records are read in a first transaction, the signer is called outside
+    of any transaction, and the signature is stored in a new transaction,
+    provided that the destination was not changed meanwhile (otherwise, the
+    signature is computed again). If the signature fails, the source status
+    is set back to ``work-in-progress``, since the destination records are not
+    signed.
+    """
+    if not success:
+        return
+
+    try:
+        with _signing_lock(request, key), updater.profile(), \
+                updater.track_memory() as memory:
+            for attempt in range(_SIGN_AFTER_COMMIT_ATTEMPTS):
+                with transaction.manager:
+                    records, timestamp = updater.get_destination_records()
+                    records = memory['records'] = _Counter(records)
+                    serialized = updater.serialize_records(records, timestamp)
+                signature = updater.sign_payload(serialized)
+                try:
+                    with transaction.manager:
+                        _store_committed_signature(request, updater,
+                                                   changeset, serialized,
+                                                   signature, timestamp)
+                    return
+                except _DestinationChanged:
+                    logger.info("Destination of '{0}' changed while "
+                                "signing".format(key))
+            raise _DestinationChanged(key)
+    except Exception:
+        logger.exception("Could not sign '{0}'".format(key))
+        with transaction.manager:
+            with capture_resource_events(request, updater.timer('events')):
+                updater.update_source_status(STATUS.WORK_IN_PROGRESS,
+                                             request)
+
+
+class _DestinationChanged(Exception):
+    """The destination records changed since they were signed."""
+
+
+def _store_committed_signature(request, updater, changeset, serialized,
+                               signature, timestamp):
+    if updater.get_destination_timestamp() != timestamp:
+        raise _DestinationChanged()
+    with capture_resource_events(request, updater.timer('events')):
+        # Writing the destination collection record waits for concurrent
+        # signatures to commit: check the timestamp again once written.
+        updater.store_signature(signature, request, timestamp)
+    if updater.get_destination_timestamp() != timestamp:
+        # Abort the transaction.
+        raise _DestinationChanged()
+    updater.store_changeset(changeset, timestamp)
+    updater.purge_destination_tombstones()
+    updater.write_snapshot_after_commit(serialized, signature, timestamp)
+
+
+def _defer_signature(request, key, updater, max_workers):
+    pending = request.bound_data.get(_PENDING_SIGNATURES)
+    if pending is None:
+        pending = request.bound_data[_PENDING_SIGNATURES] = OrderedDict()
+        # Events are notified in a before-commit hook: hooks registered
+        # meanwhile are run once every event listener was called.
+        current = transaction.get()
+        current.addBeforeCommitHook(_sign_pending_collections,
+                                    args=(request, max_workers))
+    pending[key] = updater
+
+
+def _sign_pending_collections(request, max_workers):
+    """Sign the collections collected by :func:`_sign_collection_data`.
+
+    Storage reads and writes, as well as the serialization of the records
+    read by pages, remain in the request thread (and transaction), whereas
+    the signer calls run concurrently. At most ``max_workers`` serialized
+    collections are held in memory at once.
+
+    The preparation of each collection in the request thread is profiled and
+    its memory tracked, if enabled, but not the signer calls.
+
+    If the signature of a collection fails, the other ones are still signed,
+    and its source status is set back to ``work-in-progress``, since its
+    destination records may have been pushed without being signed.
+    """
+    pending = request.bound_data.pop(_PENDING_SIGNATURES)
+
+    def _failed(key, updater):
+        logger.exception("Could not sign '{0}'".format(key))
+        request.response.status = 503
+        with capture_resource_events(request, updater.timer('events')):
+            updater.update_source_status(STATUS.WORK_IN_PROGRESS, request)
+
+    def _store(key, updater, changeset, serialized, timestamp, future):
+        try:
+            signature = future.result()
+            with capture_resource_events(request, updater.timer('events')):
+                updater.store_signature(signature, request, timestamp)
+            updater.store_changeset(changeset, timestamp)
+            updater.purge_destination_tombstones()
+            updater.write_snapshot_after_commit(serialized, signature,
+                                                timestamp)
+        except Exception:
+            _failed(key, updater)
+
+    releases = []
+    in_flight = deque()
+    try:
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for key, updater in pending.items():
+                # Wait for the oldest signature when every worker is busy.
+                if len(in_flight) == max_workers:
+                    _store(*in_flight.popleft())
+                try:
+                    releases.append(_lock_until_completed(request, key))
+                    with updater.profile(), \
+                            updater.track_memory() as memory:
+                        with capture_resource_events(request,
+                                                     updater.timer('events')):
+                            updater.create_destination(request)
+                            changeset = updater.push_records_to_destination(
+                                request)
+                        records, timestamp = updater.get_destination_records()
+                        records = memory['records'] = _Counter(records)
+                        serialized = updater.serialize_records(records,
+                                                               timestamp)
+                except Exception:
+                    _failed(key, updater)
+                    continue
+                future = executor.submit(updater.sign_payload, serialized)
+                in_flight.append((key, updater, changeset, serialized,
+                                  timestamp, future))
+
+            while in_flight:
+                _store(*in_flight.popleft())
+    except Exception:
+        # Neither the after-commit hooks nor the abort of the transaction
+        # follow the failure of a before-commit hook.
+        for release in releases:
+            if release is not None:
+                release()
+        raise
+
+
+def _check_collection_status(event, configured, group_check_enabled,
+                             to_review_enabled, editors_group,
+                             reviewers_group):
     """Make sure status changes are allowed.
     """
     payload = event.payload
 
+    current_user_id = event.request.prefixed_userid
+    if current_user_id == _PLUGIN_USERID:
+        # Ignore changes made by plugin.
+        return
+
     editors_group = instance_uri(event.request, "group",
                                  bucket_id=payload["bucket_id"],
                                  id=editors_group)
@@ -81,26 +373,14 @@ def check_collection_status(event, resources, group_check_enabled,
                                    bucket_id=payload["bucket_id"],
                                    id=reviewers_group)
 
-    current_user_id = event.request.prefixed_userid
-    if current_user_id == _PLUGIN_USERID:
-        # Ignore changes made by plugin.
-        return
-
     user_principals = event.request.effective_principals
 
-    for impacted in event.impacted_records:
+    for _, impacted in configured:
         old_collection = impacted.get("old", {})
         old_status = old_collection.get("status")
         new_collection = impacted["new"]
         new_status = new_collection.get("status")
 
-        # Skip if resource is not configured.
-        key = instance_uri(event.request, "collection",
-                           bucket_id=payload["bucket_id"],
-                           id=new_collection["id"])
-        if key not in resources:
-            continue
-
         if old_status == new_status:
             continue
 
@@ -140,7 +420,7 @@ def check_collection_status(event, resources, group_check_enabled,
             raise_invalid(message="Invalid status '%s'" % new_status)
 
 
-def check_collection_tracking(event, resources):
+def _check_collection_tracking(event, configured):
     """Make sure tracking fields are not changed manually/removed.
     """
     if event.request.prefixed_userid == _PLUGIN_USERID:
@@ -148,17 +428,10 @@ def check_collection_tracking(event, resources):
 
     tracking_fields = ("last_author", "last_editor", "last_reviewer")
 
-    for impacted in event.impacted_records:
+    for _, impacted in configured:
         old_collection = impacted.get("old", {})
         new_collection = impacted["new"]
 
-        # Skip if resource is not configured.
-        key = instance_uri(event.request, "collection",
-                           bucket_id=event.payload["bucket_id"],
-                           id=new_collection["id"])
-        if key not in resources:
-            continue
-
         for field in tracking_fields:
             old = old_collection.get(field)
             new = new_collection.get(field)
@@ -166,24 +439,138 @@ def check_collection_tracking(event, resources):
                 raise_invalid(message="Cannot change %r" % field)
 
 
-def set_work_in_progress_status(event, resources):
+def on_collection_changed(event, resources_index, status_options,
+                          signing_options):
+    """Look up the configured resources among the collections impacted by
+    the event, and run the status checks, the tracking checks and the
+    signature of the configured ones.
+
+    :param resources_index: the keys of ``resources``, by source
+        ``(bucket_id, collection_id)`` (see
+        :func:`kinto_signer.utils.index_resources`).
+    :param status_options: the options of :func:`_check_collection_status`.
+    :param signing_options: the options of :func:`_sign_collection_data`.
+    """
+    configured = _configured_collections(event, resources_index)
+    # Most collections are not configured.
+    if not configured:
+        return
+    _check_collection_status(event, configured, **status_options)
+    _check_collection_tracking(event, configured)
+    _sign_collection_data(event, configured, **signing_options)
+
+
+def _configured_collections(event, resources_index):
+    """Return the ``(key, impacted)`` tuples of the configured collections
+    among the ones impacted by the collection event.
+    """
+    # Events on the default bucket of Kinto < 3.3 have no ``bucket_id``.
+    bucket_id = event.payload.get("bucket_id")
+    configured = []
+    for impacted in event.impacted_records:
+        key = resources_index.get((bucket_id, impacted["new"]["id"]))
+        if key is not None:
+            configured.append((key, impacted))
+    return configured
+
+
+def set_work_in_progress_status(event, resources_index,
+                                auto_sign_delays=None):
     """Put the status in work-in-progress if was signed.
+
+    The status is set at most once per request and collection: the source
+    collection record is remembered within the transaction (see
+    :func:`kinto_signer.updater.collections_metadata`), and is not read if
+    modified by the request.
+
+    If an automatic signature delay is configured for the resource, schedule
+    a signature once the changes are committed (at most one per delay).
     """
     payload = event.payload
+    request = event.request
 
-    key = instance_uri(event.request, "collection",
-                       bucket_id=payload["bucket_id"],
-                       id=payload["collection_id"])
-    resource = resources.get(key)
+    key = resources_index.get((payload["bucket_id"],
+                               payload["collection_id"]))
 
     # Skip if resource is not configured.
-    if resource is None:
+    if key is None:
         return
 
-    registry = event.request.registry
-    updater = LocalUpdater(signer=registry.signers[key],
-                           storage=registry.storage,
-                           permission=registry.permission,
-                           source=resource['source'],
-                           destination=resource['destination'])
-    updater.update_source_status(STATUS.WORK_IN_PROGRESS, event.request)
+    cache = collections_metadata(request)
+    if key not in cache:
+        # Save a read of the source collection record.
+        latest = _latest_collection_record(request, payload["bucket_id"],
+                                           payload["collection_id"])
+        if latest is not None:
+            cache[key] = latest
+    current = cache.get(key) or {}
+    in_progress = (current.get("status") == STATUS.WORK_IN_PROGRESS and
+                   current.get("last_author") == request.prefixed_userid)
+
+    delay = (auto_sign_delays or {}).get(key)
+    scheduled = request.bound_data.setdefault(_SCHEDULED_SIGNATURES, set())
+    schedule = delay is not None and key not in scheduled
+
+    # Already set by a previous event of this request.
+    if in_progress and not schedule:
+        return
+
+    updater = request.registry.signer_updaters[key]
+    if not in_progress:
+        updater.update_source_status(STATUS.WORK_IN_PROGRESS, request)
+
+    if schedule:
+        scheduled.add(key)
+        _schedule_auto_signature(request, key, updater, delay)
+
+
+def _schedule_auto_signature(request, key, updater, delay):
+    def _schedule(success):
+        if success:
+            debouncer = request.registry.signer_debouncer
+            debouncer.schedule(key, delay, _auto_sign, request, key, updater)
+
+    current = transaction.get()
+    current.addAfterCommitHook(_schedule)
+
+
+def _auto_sign(request, key, updater):
+    """Sign the source collection outside of any request, on behalf of
+    the plugin.
+    """
+    fakerequest = build_request(request, {
+        'method': 'PATCH',
+        'path': updater.source_collection_uri
+    })
+    fakerequest.bound_data = {"resource_events": OrderedDict()}
+    fakerequest.selected_userid = "kinto-signer"
+    fakerequest.authn_type = "plugin"
+
+    with transaction.manager:
+        _locked_signature(key, updater, fakerequest)
+
+
+def reset_bootstrapped_destinations(event):
+    """Forget about the destinations created by the updaters when they
+    are deleted or modified by someone else than the plugin.
+    """
+    bootstrapped = event.request.registry.signer_bootstrapped
+
+    if event.request.prefixed_userid == _PLUGIN_USERID:
+        return
+
+    if isinstance(event, ServerFlushed):
+        bootstrapped.clear()
+        return
+
+    payload = event.payload
+    for impacted in event.impacted_records:
+        obj = impacted.get("old") or impacted["new"]
+        if payload["resource_name"] == "bucket":
+            prefix = "/buckets/%s/" % obj["id"]
+            for uri in list(bootstrapped):
+                if uri.startswith(prefix):
+                    bootstrapped.discard(uri)
+        else:
+            bootstrapped.discard("/buckets/%s/collections/%s" % (
+                payload["bucket_id"], obj["id"]))
@@ -0,0 +1,46 @@
+import argparse
+import sys
+
+import transaction
+from pyramid.paster import bootstrap
+
+
+def purge_tombstones(registry, max_age=None, max_count=None):
+    """Purge the tombstones of every configured destination, according to
+    the specified policy or the one from settings.
+
+    :returns: the number of tombstones purged, by source collection URI.
+    """
+    purged = {}
+    for key, updater in registry.signer_updaters.items():
+        with transaction.manager:
+            purged[key] = updater.purge_destination_tombstones(
+                max_age=max_age, max_count=max_count)
+    return purged
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Purge the tombstones of the destination collections')
+    parser.add_argument('ini_file', help='Kinto configuration file')
+    parser.add_argument('--max-age', type=int, default=None,
+                        help='Purge the tombstones older than this number '
+                             'of seconds')
+    parser.add_argument('--max-count', type=int, default=None,
+                        help='Number of most recent tombstones to keep')
+    args = parser.parse_args(args)
+
+    env = bootstrap(args.ini_file)
+    try:
+        purged = purge_tombstones(env['registry'],
+                                  max_age=args.max_age,
+                                  max_count=args.max_count)
+    finally:
+        env['closer']()
+
+    for key, count in sorted(purged.items()):
+        print('%s: %s tombstones purged' % (key, count))
+
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
@@ -1,13 +1,52 @@
-import copy
 import json
 import operator
 
 
+def _dumps(obj):
+    return json.dumps(obj, sort_keys=True, separators=(',', ':'))
+
+
 def canonical_json(records, last_modified):
-    records = copy.deepcopy(records)
-    records = filter(lambda r: r.get('deleted', False) is not True, records)
-    records = sorted(records, key=operator.itemgetter('id'))
+    """Serialize the specified records in canonical JSON.
+
+    `records` can be any iterable (e.g. a generator): records are serialized
+    one by one, which avoids keeping the whole list of objects in memory.
+    """
+    serialized = [(r['id'], _dumps(r)) for r in records
+                  if r.get('deleted', False) is not True]
+    serialized.sort(key=operator.itemgetter(0))
+
+    # Equivalent to the dump of ``{'data': [...], 'last_modified': '...'}``
+    # since keys are sorted alphabetically.
+    data = ','.join(s for _, s in serialized)
+    return '{"data":[%s],"last_modified":%s}' % (data,
+                                                 _dumps('%s' % last_modified))
+
+
+def iter_canonical_json(records, last_modified):
+    """Serialize the specified records in canonical JSON, by chunks.
+
+    Unlike :func:`canonical_json`, `records` must be sorted by id, so that
+    the records are serialized as they come, in constant memory. The chunks
+    concatenated are equal to :func:`canonical_json`.
 
-    payload = {'data': records, 'last_modified': '%s' % last_modified}
+    The ids are compared like in Python (by code points), which is the order
+    of :func:`canonical_json`. A storage backend may sort them differently
+    (e.g. PostgreSQL sorts text with the collation of the database): callers
+    must then sort the records themselves.
 
-    return json.dumps(payload, sort_keys=True, separators=(',', ':'))
+    :raises ValueError: if the records are not sorted by id.
+    """
+    yield '{"data":['
+    previous = None
+    separator = ''
+    for r in records:
+        if previous is not None and r['id'] <= previous:
+            raise ValueError("Records are not sorted by id ('%s' after '%s')"
+                             % (r['id'], previous))
+        previous = r['id']
+        if r.get('deleted', False) is True:
+            continue
+        yield separator + _dumps(r)
+        separator = ','
+    yield '],"last_modified":%s}' % _dumps('%s' % last_modified)
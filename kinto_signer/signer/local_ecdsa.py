@@ -66,14 +66,20 @@ class ECDSASigner(SignerBase):
         }
 
     def verify(self, payload, signature_bundle):
-        signature = signature_bundle['signature']
-        hash_algorithm = signature_bundle['hash_algorithm']
-        signature_encoding = signature_bundle['signature_encoding']
-
         if isinstance(payload, six.text_type):  # pragma: nocover
             payload = payload.encode('utf-8')
 
         payload = self.prefix + payload
+        digest = hashlib.sha384(payload).digest()
+        self.verify_digest(digest, signature_bundle)
+
+    def verify_digest(self, digest, signature_bundle):
+        """Verify the signature from the SHA-384 digest of the prefixed
+        payload, e.g. when the payload is hashed by chunks.
+        """
+        signature = signature_bundle['signature']
+        hash_algorithm = signature_bundle['hash_algorithm']
+        signature_encoding = signature_bundle['signature_encoding']
 
         if isinstance(signature, six.text_type):  # pragma: nocover
             signature = signature.encode('utf-8')
@@ -91,10 +97,9 @@ class ECDSASigner(SignerBase):
 
         public_key = self.load_public_key()
         try:
-            public_key.verify(signature_bytes,
-                              payload,
-                              hashfunc=hashlib.sha384,
-                              sigdecode=ecdsa.util.sigdecode_string)
+            public_key.verify_digest(signature_bytes,
+                                     digest,
+                                     sigdecode=ecdsa.util.sigdecode_string)
         except Exception as e:
             raise BadSignatureError(e)
 
@@ -0,0 +1,65 @@
+import errno
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+
+
+def snapshot_name(serialized, timestamp):
+    """Return the base name of the snapshot of the specified payload."""
+    digest = hashlib.sha384(serialized.encode('utf-8')).hexdigest()
+    return '%s-%s' % (timestamp, digest)
+
+
+def _write_atomically(path, content, gzipped=False):
+    directory = os.path.dirname(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.tmp-')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            if gzipped:
+                # No file name nor modification time, for identical bytes.
+                with gzip.GzipFile(filename='', mode='wb', fileobj=f,
+                                   mtime=0) as gz:
+                    gz.write(content)
+            else:
+                f.write(content)
+        os.rename(tmp_path, path)
+    except Exception:
+        os.remove(tmp_path)
+        raise
+
+
+def write_snapshot(directory, serialized, signature, timestamp,
+                   gzipped=False):
+    """Write the exact signed payload and its signature in the specified
+    directory.
+
+    Two files are written, named by the destination timestamp and the
+    payload digest: ``<name>.json`` (or ``<name>.json.gz``) with the
+    canonical JSON, and ``<name>.signature.json`` with the signature.
+    Existing snapshots are left untouched.
+
+    :returns: the path of the payload file.
+    """
+    try:
+        os.makedirs(directory)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+
+    name = snapshot_name(serialized, timestamp)
+    payload_path = os.path.join(directory, name + '.json')
+    if gzipped:
+        payload_path += '.gz'
+    signature_path = os.path.join(directory, name + '.signature.json')
+
+    # The signature is written last, since its presence tells that the
+    # snapshot is complete.
+    if not os.path.exists(payload_path):
+        _write_atomically(payload_path, serialized.encode('utf-8'), gzipped)
+    if not os.path.exists(signature_path):
+        content = json.dumps(signature, sort_keys=True).encode('utf-8')
+        _write_atomically(signature_path, content)
+
+    return payload_path
@@ -1,34 +1,145 @@
+import functools
+import hashlib
 import logging
+import os
+import time
 
 from collections import OrderedDict
+from contextlib import contextmanager
+from itertools import islice
 
+import transaction
 from kinto.core.events import ACTIONS
 from kinto.core.storage import Filter, Sort
 from kinto.core.storage.exceptions import UnicityError, RecordNotFoundError
 from kinto.core.utils import COMPARISON, build_request
 
 from kinto_signer.serializer import canonical_json
-from kinto_signer.utils import STATUS
+from kinto_signer.snapshots import write_snapshot
+from kinto_signer.utils import STATUS, SingleFlight, statsd_client
 
 logger = logging.getLogger(__name__)
 
+#: Number of records read from the storage at once.
+DEFAULT_PAGE_SIZE = 1000
+
+_COLLECTION_URI = '/buckets/{bucket}/collections/{collection}'
+
+_COLLECTIONS_METADATA = "signer.collections_metadata"
+
+#: Storage collection of the changesets, within the destination collections.
+CHANGESET_COLLECTION = 'signer-changeset'
+
+#: Storage collection of the last signed timestamps, by destination URI.
+TIMESTAMP_COLLECTION = 'signer-timestamp'
+
+
+def collections_metadata(request):
+    """Return the collection records read or written by the updaters within
+    the current transaction, by URI.
+
+    Since the resource events are notified once the request was processed,
+    only the plugin modifies the collections records when signing.
+    """
+    current = transaction.get()
+    entry = request.bound_data.get(_COLLECTIONS_METADATA)
+    if entry is None or entry[0] is not current:
+        entry = (current, {})
+        request.bound_data[_COLLECTIONS_METADATA] = entry
+    return entry[1]
+
 
 def notify_resource_event(request, request_options, matchdict,
                           resource_name, parent_id, record, action, old=None):
     """Private helper that triggers resource events when the updater modifies
     the source and destination objects.
     """
+    notify_resource_events(request, request_options, matchdict,
+                           resource_name, parent_id, [(record, old)], action)
+
+
+def notify_resource_events(request, request_options, matchdict,
+                           resource_name, parent_id, changes, action):
+    """Private helper that stacks the events of several objects modified with
+    the same action using a single fake request.
+
+    :param changes: list of ``(record, old)`` tuples.
+    """
     fakerequest = build_request(request, request_options)
     fakerequest.matchdict = matchdict
     fakerequest.bound_data = request.bound_data
     fakerequest.selected_userid = "kinto-signer"
     fakerequest.authn_type = "plugin"
     fakerequest.current_resource_name = resource_name
-    fakerequest.notify_resource_event(parent_id=parent_id,
-                                      timestamp=record['last_modified'],
-                                      data=record,
-                                      action=action,
-                                      old=old)
+    # Events are grouped by resource and action, hence every change is
+    # added to the ``impacted_records`` of the same ``ResourceChanged``.
+    for record, old in changes:
+        fakerequest.notify_resource_event(parent_id=parent_id,
+                                          timestamp=record['last_modified'],
+                                          data=record,
+                                          action=action,
+                                          old=old)
+
+
+@contextmanager
+def capture_resource_events(request, timer=None):
+    """Collect the resource events triggered by the updater, and re-trigger
+    them once done, in order to notify the event listeners.
+
+    :param timer: optional context manager that measures the notification of
+        the events (see :meth:`LocalUpdater.timer`).
+    """
+    before_events = request.bound_data["resource_events"]
+    request.bound_data["resource_events"] = OrderedDict()
+
+    yield
+
+    # Re-trigger events from event listener \o/
+    with timer or _no_timer():
+        for event in request.get_resource_events():
+            request.registry.notify(event)
+    request.bound_data["resource_events"] = before_events
+
+
+@contextmanager
+def _no_timer():
+    yield
+
+
+def _profiled(method):
+    """Decorator that profiles the updater method, if enabled
+    (see :class:`kinto_signer.utils.Profiler`).
+    """
+    @functools.wraps(method)
+    def wrapped(self, *args, **kwargs):
+        with self.profile():
+            return method(self, *args, **kwargs)
+    return wrapped
+
+
+def _timed(phase):
+    """Decorator that measures the execution time of the updater method
+    (see :meth:`LocalUpdater.timer`).
+    """
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapped(self, *args, **kwargs):
+            with self.timer(phase):
+                return method(self, *args, **kwargs)
+        return wrapped
+    return decorator
+
+
+class _Counter(object):
+    """Iterate the specified items, and count them."""
+    def __init__(self, items):
+        self.items = items
+        self.count = 0
+
+    def __iter__(self):
+        for item in self.items:
+            self.count += 1
+            yield item
 
 
 class LocalUpdater(object):
@@ -52,9 +163,51 @@ class LocalUpdater(object):
     :param storage:
         The instance of kinto.core.storage that will be used to retrieve
         records from the source and add new items to the destination.
+
+    :param page_size:
+        The maximum number of records fetched from the storage at once.
+
+    :param tombstones_max_age:
+        If set, the tombstones of the destination older than this number of
+        seconds are purged after each signature.
+
+    :param tombstones_max_count:
+        If set, only this number of tombstones are kept in the destination
+        after each signature.
+
+    :param changesets_enabled:
+        If true, the ids of the records changed by each signature are stored
+        (see :meth:`store_changeset`).
+
+    :param snapshots_dir:
+        If set, the signed payload and its signature are written in this
+        directory after each signature
+        (see :func:`kinto_signer.snapshots.write_snapshot`).
+
+    :param snapshots_gzip:
+        If true, the payload of the snapshots is gzip-compressed.
+
+    :param statsd:
+        If set, the duration of every phase of the signature, the number of
+        records and the size of the payload are sent to this
+        :class:`kinto.core.statsd.Client`, under the
+        ``plugins.signer.<bucket>.<collection>`` prefix of the source.
+
+    :param profiler:
+        If set, the signatures are profiled with this
+        :class:`kinto_signer.utils.Profiler`.
+
+    :param memory_tracker:
+        If set, the peak of memory allocated by the signatures is measured
+        with this :class:`kinto_signer.utils.MemoryTracker`, logged and sent
+        to statsd (``memory_peak``).
     """
 
-    def __init__(self, source, destination, signer, storage, permission):
+    def __init__(self, source, destination, signer, storage, permission,
+                 page_size=DEFAULT_PAGE_SIZE, tombstones_max_age=None,
+                 tombstones_max_count=None, changesets_enabled=False,
+                 snapshots_dir=None, snapshots_gzip=False, statsd=None,
+                 profiler=None, memory_tracker=None):
 
         def _ensure_resource(resource):
             if not set(resource.keys()).issuperset({'bucket', 'collection'}):
@@ -67,6 +220,18 @@ class LocalUpdater(object):
         self.signer = signer
         self.storage = storage
         self.permission = permission
+        self.page_size = page_size
+        self.tombstones_max_age = tombstones_max_age
+        self.tombstones_max_count = tombstones_max_count
+        self.changesets_enabled = changesets_enabled
+        self.snapshots_dir = snapshots_dir
+        self.snapshots_gzip = snapshots_gzip
+        self.statsd = statsd
+        self.profiler = profiler
+        self.memory_tracker = memory_tracker
+        self.flights = SingleFlight()
+        self.statsd_prefix = 'plugins.signer.{bucket}.{collection}'.format(
+            **self.source)
 
         # Define resource IDs.
 
@@ -81,6 +246,7 @@ class LocalUpdater(object):
             self.source['bucket'],
             self.source['collection'])
 
+    @_profiled
     def sign_and_update_destination(self, request):
         """Sign the specified collection.
 
@@ -90,26 +256,226 @@ class LocalUpdater(object):
         3. Compute a hash of these records
         4. Ask the signer for a signature
         5. Send the signature to the destination.
+        6. Store the changeset and purge the old tombstones of the
+           destination.
+        7. Write the snapshot of the signed payload once committed.
+
+        :returns: the signature obtained from the signer.
         """
-        before_events = request.bound_data["resource_events"]
-        request.bound_data["resource_events"] = OrderedDict()
+        with self.track_memory() as memory:
+            with capture_resource_events(request, self.timer('events')):
+                self.create_destination(request)
 
-        self.create_destination(request)
+                changeset = self.push_records_to_destination(request)
 
-        self.push_records_to_destination(request)
+                records, timestamp = self.get_destination_records()
+                records = memory['records'] = _Counter(records)
+                serialized_records = self.serialize_records(records,
+                                                            timestamp)
+                signature = self.sign_payload(serialized_records)
 
-        records, timestamp = self.get_destination_records()
-        serialized_records = canonical_json(records, timestamp)
+                self.store_signature(signature, request, timestamp)
+                self.write_snapshot_after_commit(serialized_records,
+                                                 signature, timestamp)
+
+            self.store_changeset(changeset, timestamp)
+            self.purge_destination_tombstones()
+
+        return signature
+
+    @contextmanager
+    def profile(self):
+        """Profile the block, if enabled (see
+        :class:`kinto_signer.utils.Profiler`).
+        """
+        if self.profiler is None:
+            yield
+            return
+        name = '{bucket}_{collection}'.format(**self.source)
+        with self.profiler.profile(name):
+            yield
+
+    @contextmanager
+    def track_memory(self):
+        """Measure the peak of memory allocated within the block, if enabled,
+        and report it along the number of records signed.
+        """
+        infos = {'records': _Counter([])}
+        if self.memory_tracker is None:
+            yield infos
+            return
+
+        with self.memory_tracker.track() as stats:
+            yield infos
+
+        top = ''.join('\n  %s' % stat for stat in stats['top'])
+        logger.info("Signature of %s: %s bytes peak for %s records."
+                    " Top allocations:%s" % (self.source_collection_uri,
+                                             stats['peak'],
+                                             infos['records'].count, top))
+        self.gauge('memory_peak', stats['peak'])
+
+    def serialize_records(self, records, timestamp):
+        """Return the canonical JSON of the specified records.
+
+        Since records are read lazily, this step must run in the current
+        request thread.
+        """
+        counted = _Counter(records)
+        with self.timer('serialize'):
+            serialized_records = canonical_json(counted, timestamp)
         logger.debug(self.source_collection_uri, serialized_records)
-        signature = self.signer.sign(serialized_records)
+        if self.memory_tracker is not None:
+            # Most of the memory is allocated at this point.
+            self.memory_tracker.checkpoint()
+        # The canonical JSON is ASCII only.
+        self.count('records_signed', counted.count)
+        self.count('payload_bytes', len(serialized_records))
+        return serialized_records
+
+    def sign_payload(self, serialized_records):
+        """Ask the signer for a signature of the serialized records.
+
+        This step does not access the storage, and can thus run outside the
+        current request thread.
+
+        Since the signature only depends on the payload, the callers that
+        sign the same payload concurrently share the call to the signer, and
+        store the signature in their own transaction.
+        """
+        # Concurrent signatures of the very same payload (e.g. a request and
+        # an automatic signature) share a single call to the signer.
+        digest = hashlib.sha256(serialized_records.encode('utf-8')).hexdigest()
+        with self.timer('sign'):
+            signature, shared = self.flights.do(digest, self.signer.sign,
+                                                serialized_records)
+        if shared:
+            self.count('coalesced', 1)
+        return signature
+
+    def write_snapshot_after_commit(self, serialized_records, signature,
+                                    timestamp):
+        """Write the snapshot of the signed payload once the current
+        transaction is committed, if enabled.
+
+        Since the signature is already stored, errors are logged but not
+        raised.
+        """
+        if self.snapshots_dir is None:
+            return
+        directory = os.path.join(self.snapshots_dir,
+                                 self.destination['bucket'],
+                                 self.destination['collection'])
 
-        self.set_destination_signature(signature, request)
-        self.update_source_status(STATUS.SIGNED, request)
+        def _write(success):
+            if not success:
+                return
+            try:
+                write_snapshot(directory, serialized_records, signature,
+                               timestamp, gzipped=self.snapshots_gzip)
+            except Exception:
+                logger.exception("Could not write the snapshot of %s" %
+                                 self.destination_collection_uri)
 
-        # Re-trigger events from event listener \o/
-        for event in request.get_resource_events():
-            request.registry.notify(event)
-        request.bound_data["resource_events"] = before_events
+        current = transaction.get()
+        current.addAfterCommitHook(_write)
+
+    def timer(self, phase):
+        """Return a context manager that measures the duration of the
+        specified signature phase, if statsd is configured.
+
+        Since records are read lazily, ``destination_read`` only covers the
+        first page, and the next ones are read during ``serialize``.
+        """
+        if self.statsd is None:
+            return _no_timer()
+        return self.statsd.timer('%s.%s' % (self.statsd_prefix, phase))
+
+    def count(self, name, value):
+        """Increment the specified counter, if statsd is configured."""
+        if self.statsd is None:
+            return
+        statsd_client(self.statsd).incr('%s.%s' % (self.statsd_prefix, name),
+                                        count=value)
+
+    def gauge(self, name, value):
+        """Set the specified gauge, if statsd is configured."""
+        if self.statsd is None:
+            return
+        statsd_client(self.statsd).gauge('%s.%s' % (self.statsd_prefix, name),
+                                         value)
+
+    def purge_destination_tombstones(self, max_age=None, max_count=None):
+        """Purge the tombstones of the destination that are older than
+        ``max_age`` seconds, or beyond the ``max_count`` most recent ones
+        (defaults to the policy of the updater).
+
+        The most recent tombstone is always kept, so that the destination
+        timestamp remains when every record was deleted. The changesets that
+        end before the oldest tombstone kept (or before ``max_age``) are
+        deleted too (see :meth:`purge_destination_changesets`).
+
+        :returns: the number of tombstones purged.
+        """
+        if max_age is None:
+            max_age = self.tombstones_max_age
+        if max_count is None:
+            max_count = self.tombstones_max_count
+        if max_age is None and max_count is None:
+            return 0
+
+        # Tombstones from the most recent, up to the oldest one kept.
+        tombstones, _ = self.storage.get_all(
+            parent_id=self.destination_collection_uri,
+            collection_id='record',
+            include_deleted=True,
+            filters=[Filter('deleted', True, COMPARISON.EQ)],
+            sorting=[Sort('last_modified', -1)],
+            limit=max(max_count or 0, 1))
+
+        # Tombstones strictly older than ``before`` are purged.
+        boundaries = []
+        if max_count is not None and tombstones and \
+           len(tombstones) >= max_count:
+            boundaries.append(tombstones[-1]['last_modified'])
+        if max_age is not None:
+            boundaries.append(int((time.time() - max_age) * 1000))
+        if not boundaries:
+            return 0
+        before = max(boundaries)
+        if tombstones:
+            before = min(before, tombstones[0]['last_modified'])
+
+        self.purge_destination_changesets(before)
+        if not tombstones:
+            return 0
+
+        purged = self.storage.purge_deleted(
+            parent_id=self.destination_collection_uri,
+            collection_id='record',
+            before=before)
+        if purged:
+            logger.info("Purged %s tombstones from %s", purged,
+                        self.destination_collection_uri)
+        return purged
+
+    def purge_destination_changesets(self, before):
+        """Delete the changesets of the destination that end strictly before
+        the ``before`` timestamp, if enabled.
+
+        Clients that synchronized before the purged tombstones fetch the
+        whole collection anyway.
+
+        :returns: the number of changesets deleted.
+        """
+        if not self.changesets_enabled:
+            return 0
+        deleted = self.storage.delete_all(
+            parent_id=self.destination_collection_uri,
+            collection_id=CHANGESET_COLLECTION,
+            filters=[Filter('until', before, COMPARISON.LT)],
+            with_deleted=False)
+        return len(deleted)
 
     def _ensure_resource_exists(self, resource_type, parent_id,
                                 record_id, request):
@@ -122,7 +488,14 @@ class LocalUpdater(object):
             created = None
         return created
 
+    @_timed('create_destination')
     def create_destination(self, request):
+        # Skip if the destination was already created by this process.
+        # (see :func:`kinto_signer.listeners.reset_bootstrapped_destinations`)
+        bootstrapped = request.registry.signer_bootstrapped
+        if self.destination_collection_uri in bootstrapped:
+            return
+
         # Create the destination bucket/collection if they don't already exist.
         bucket_name = self.destination['bucket']
         collection_name = self.destination['collection']
@@ -146,6 +519,8 @@ class LocalUpdater(object):
             collection_name,
             request)
         if created:
+            cache = collections_metadata(request)
+            cache[self.destination_collection_uri] = created
             notify_resource_event(request,
                                   {'method': 'PUT',
                                    'path': self.destination_collection_uri},
@@ -166,22 +541,31 @@ class LocalUpdater(object):
         self.permission.replace_object_permissions(
             self.destination_collection_uri, permissions)
 
+        # Remember that the destination is ready once committed.
+        def _bootstrapped(success):
+            if success:
+                bootstrapped.add(self.destination_collection_uri)
+
+        current = transaction.get()
+        current.addAfterCommitHook(_bootstrapped)
+
     def _get_records(self, rc, last_modified=None):
+        """Return an iterator on the records of the specified resource, and
+        the collection timestamp (``None`` if empty).
+
+        Records are fetched lazily from the storage, by pages of
+        ``page_size`` records, sorted by ascending ``last_modified``.
+        """
+        filters = []
         # If last_modified was specified, only retrieve items since then.
-        storage_kwargs = {}
         if last_modified is not None:
             gt_last_modified = Filter('last_modified', last_modified,
                                       COMPARISON.GT)
-            storage_kwargs['filters'] = [gt_last_modified, ]
+            filters.append(gt_last_modified)
 
-        storage_kwargs['sorting'] = [Sort('last_modified', 1)]
         parent_id = "/buckets/{bucket}/collections/{collection}".format(**rc)
 
-        records, count = self.storage.get_all(
-            parent_id=parent_id,
-            collection_id='record',
-            include_deleted=True,
-            **storage_kwargs)
+        records, count = self._get_records_page(parent_id, filters)
 
         if len(records) == count == 0:
             # When the collection empty (no records and no tombstones)
@@ -191,17 +575,100 @@ class LocalUpdater(object):
                 parent_id=parent_id,
                 collection_id='record')
 
-        return records, collection_timestamp
+        pages = self._iter_records_pages(parent_id, filters, records)
+        return (record for page in pages for record in page), \
+            collection_timestamp
 
+    def _get_records_page(self, parent_id, filters, pagination_rules=None):
+        return self.storage.get_all(
+            parent_id=parent_id,
+            collection_id='record',
+            include_deleted=True,
+            filters=filters,
+            sorting=[Sort('last_modified', 1), Sort('id', 1)],
+            pagination_rules=pagination_rules,
+            limit=self.page_size)
+
+    def _iter_records_pages(self, parent_id, filters, first_page):
+        page = first_page
+        yield page
+        while len(page) == self.page_size:
+            # Keyset pagination: continue after the last record obtained.
+            last = page[-1]
+            pagination_rules = [
+                [Filter('last_modified', last['last_modified'],
+                        COMPARISON.GT)],
+                [Filter('last_modified', last['last_modified'],
+                        COMPARISON.EQ),
+                 Filter('id', last['id'], COMPARISON.GT)],
+            ]
+            page, _ = self._get_records_page(parent_id, filters,
+                                             pagination_rules)
+            # When no record matches the pagination rules, the memory
+            # backend ignores them and returns the first page again.
+            if page and (page[0]['last_modified'], page[0]['id']) <= \
+               (last['last_modified'], last['id']):
+                return
+            yield page
+
+    @_timed('source_read')
     def get_source_records(self, last_modified):
         return self._get_records(self.source,
                                  last_modified)
 
+    @_timed('destination_read')
     def get_destination_records(self):
         return self._get_records(self.destination)
 
+    @_timed('destination_read')
+    def get_destination_timestamp(self):
+        """Return the destination collection timestamp (``None`` if empty),
+        without reading its records.
+        """
+        # The timestamp of an empty collection would be set to now.
+        _, count = self.storage.get_all(
+            parent_id=self.destination_collection_uri,
+            collection_id='record',
+            include_deleted=True,
+            limit=1)
+        if count == 0:
+            return None
+        return self.storage.collection_timestamp(
+            parent_id=self.destination_collection_uri,
+            collection_id='record')
+
+    def _with_destination_records(self, records):
+        """Pair each of the specified source records with the current version
+        of the destination record (``None`` if missing).
+
+        The destination records are read in a single storage query per page
+        of ``page_size`` source records.
+        """
+        records = iter(records)
+        while True:
+            page = list(islice(records, self.page_size))
+            if not page:
+                return
+            ids = [record['id'] for record in page]
+            existing, _ = self.storage.get_all(
+                parent_id=self.destination_collection_uri,
+                collection_id='record',
+                filters=[Filter('id', ids, COMPARISON.IN)],
+                limit=len(ids))
+            by_id = {record['id']: record for record in existing}
+            for record in page:
+                yield record, by_id.get(record['id'])
+
+    @_timed('push')
     def push_records_to_destination(self, request):
-        __, dest_timestamp = self.get_destination_records()
+        """Push the records changed in the source since the last signature
+        to the destination.
+
+        :returns: the changeset, with the previous destination timestamp
+            (``since``) and the ids of the ``changed`` and ``deleted``
+            records.
+        """
+        dest_timestamp = self.get_destination_timestamp()
         new_records, source_timestamp = self.get_source_records(last_modified=dest_timestamp)
 
         if source_timestamp and dest_timestamp and dest_timestamp > source_timestamp:
@@ -210,16 +677,13 @@ class LocalUpdater(object):
                              "storage backend timezone is UTC.")
 
         # Update the destination collection.
-        for record in new_records:
-            storage_kwargs = {
-                "parent_id": self.destination_collection_uri,
-                "collection_id": 'record',
-            }
-            try:
-                before = self.storage.get(object_id=record['id'],
-                                          **storage_kwargs)
-            except RecordNotFoundError:
-                before = None
+        changeset = {'since': dest_timestamp, 'changed': [], 'deleted': []}
+        changes_by_action = OrderedDict()
+        storage_kwargs = {
+            "parent_id": self.destination_collection_uri,
+            "collection_id": 'record',
+        }
+        for record, before in self._with_destination_records(new_records):
 
             deleted = record.get('deleted', False)
             if deleted:
@@ -247,65 +711,114 @@ class LocalUpdater(object):
                         **storage_kwargs)
                     action = ACTIONS.UPDATE
 
+            changes = changes_by_action.setdefault(action, [])
+            changes.append((pushed, before))
+            changeset['deleted' if deleted else 'changed'].append(record['id'])
+
+        # Notify one event per action, built from the first impacted record.
+        for action, changes in changes_by_action.items():
+            first_record, _ = changes[0]
             matchdict = {
                 'bucket_id': self.destination['bucket'],
                 'collection_id': self.destination['collection'],
-                'id': record['id']
+                'id': first_record['id']
             }
             record_uri = ('/buckets/{bucket_id}'
                           '/collections/{collection_id}'
                           '/records/{id}'.format(**matchdict))
-            notify_resource_event(
+            notify_resource_events(
                 request,
-                {'method': 'DELETE' if deleted else 'PUT',
+                {'method': 'DELETE' if action == ACTIONS.DELETE else 'PUT',
                  'path': record_uri},
                 matchdict=matchdict,
                 resource_name="record",
                 parent_id=self.destination_collection_uri,
-                record=pushed,
-                action=action,
-                old=before)
+                changes=changes,
+                action=action)
 
-    def set_destination_signature(self, signature, request):
-        # Push the new signature to the destination collection.
-        parent_id = '/buckets/%s' % self.destination['bucket']
-        collection_id = 'collection'
+        self.count('records_pushed',
+                   len(changeset['changed']) + len(changeset['deleted']))
+        return changeset
 
-        collection_record = self.storage.get(
-            parent_id=parent_id,
-            collection_id=collection_id,
-            object_id=self.destination['collection'])
+    def store_changeset(self, changeset, timestamp):
+        """Store the changeset obtained from
+        :meth:`push_records_to_destination`, until the specified destination
+        ``timestamp``, if enabled.
+
+        Changesets are stored in the destination collection, with
+        ``<since>-<until>`` as id. Nothing is stored on the first signature.
+        """
+        if not self.changesets_enabled:
+            return
+        since = changeset['since']
+        if since is None or since == timestamp:
+            return
+        record = {
+            'id': '%s-%s' % (since, timestamp),
+            'since': since,
+            'until': timestamp,
+            'changed': sorted(changeset['changed']),
+            'deleted': sorted(changeset['deleted']),
+        }
+        try:
+            self.storage.create(parent_id=self.destination_collection_uri,
+                                collection_id=CHANGESET_COLLECTION,
+                                record=record)
+        except UnicityError:
+            pass
+
+    def store_signature(self, signature, request, timestamp=None):
+        """Store the signature in the destination metadata, and mark the
+        source as signed.
+
+        Each collection record is read at most once within the transaction
+        (see :func:`collections_metadata`) and written once.
+        """
+        self.set_destination_signature(signature, request, timestamp)
+        self.update_source_status(STATUS.SIGNED, request)
+
+    @_timed('signature_write')
+    def set_destination_signature(self, signature, request, timestamp=None):
+        """Store the signature in the destination metadata.
+
+        If the signed destination ``timestamp`` is specified, it is also
+        stored among the last signed timestamps (see
+        :func:`kinto_signer.views.get_timestamps`).
+        """
+        if timestamp is not None:
+            self.storage.update(parent_id='',
+                                collection_id=TIMESTAMP_COLLECTION,
+                                object_id=self.destination_collection_uri,
+                                record={'bucket': self.destination['bucket'],
+                                        'collection':
+                                            self.destination['collection'],
+                                        'timestamp': timestamp})
+
+        # Push the new signature to the destination collection.
+        try:
+            collection_record = self._get_collection_record(request,
+                                                            self.destination)
+        except RecordNotFoundError:
+            # Deleted by another node since it was bootstrapped by this one.
+            bootstrapped = request.registry.signer_bootstrapped
+            bootstrapped.discard(self.destination_collection_uri)
+            self.create_destination(request)
+            collection_record = self._get_collection_record(request,
+                                                            self.destination)
 
         # Update the collection_record
         new_collection = dict(**collection_record)
         new_collection.pop('last_modified', None)
         new_collection['signature'] = signature
 
-        updated = self.storage.update(
-            parent_id=parent_id,
-            collection_id=collection_id,
-            object_id=self.destination['collection'],
-            record=new_collection)
-
-        matchdict = dict(bucket_id=self.destination['bucket'],
-                         id=self.destination['collection'])
-        notify_resource_event(
-            request,
-            {
-                'method': 'PUT',
-                'path': self.destination_collection_uri
-            },
-            matchdict=matchdict,
-            resource_name="collection",
-            parent_id=self.destination_bucket_uri,
-            record=updated,
-            action=ACTIONS.UPDATE,
-            old=collection_record)
+        self._update_collection_record(request, self.destination,
+                                       collection_record, new_collection)
 
     def update_source_editor(self, request):
         attrs = {'last_editor': request.prefixed_userid}
         return self._update_source_attributes(request, **attrs)
 
+    @_timed('status_update')
     def update_source_status(self, status, request):
         attrs = {'status': status.value}
         if status == STATUS.WORK_IN_PROGRESS:
@@ -315,13 +828,7 @@ class LocalUpdater(object):
         return self._update_source_attributes(request, **attrs)
 
     def _update_source_attributes(self, request, **kwargs):
-        parent_id = '/buckets/%s' % self.source['bucket']
-        collection_id = 'collection'
-
-        collection_record = self.storage.get(
-            parent_id=parent_id,
-            collection_id=collection_id,
-            object_id=self.source['collection'])
+        collection_record = self._get_collection_record(request, self.source)
 
         # Update the collection_record
         new_collection = dict(**collection_record)
@@ -335,23 +842,42 @@ class LocalUpdater(object):
         # Remove last_modified to be sure it's bumped.
         new_collection.pop('last_modified', None)
 
+        self._update_collection_record(request, self.source,
+                                       collection_record, new_collection)
+
+    def _get_collection_record(self, request, resource):
+        uri = _COLLECTION_URI.format(**resource)
+        cache = collections_metadata(request)
+        if uri not in cache:
+            cache[uri] = self.storage.get(
+                parent_id='/buckets/%s' % resource['bucket'],
+                collection_id='collection',
+                object_id=resource['collection'])
+        return cache[uri]
+
+    def _update_collection_record(self, request, resource, collection_record,
+                                  new_collection):
+        uri = _COLLECTION_URI.format(**resource)
+        bucket_uri = '/buckets/%s' % resource['bucket']
+
         updated = self.storage.update(
-            parent_id=parent_id,
-            collection_id=collection_id,
-            object_id=self.source['collection'],
+            parent_id=bucket_uri,
+            collection_id='collection',
+            object_id=resource['collection'],
             record=new_collection)
+        collections_metadata(request)[uri] = updated
 
-        matchdict = dict(bucket_id=self.source['bucket'],
-                         id=self.source['collection'])
+        matchdict = dict(bucket_id=resource['bucket'],
+                         id=resource['collection'])
         notify_resource_event(
             request,
             {
                 'method': 'PUT',
-                'path': self.source_collection_uri
+                'path': uri
             },
             matchdict=matchdict,
             resource_name="collection",
-            parent_id=self.source_bucket_uri,
+            parent_id=bucket_uri,
             record=updated,
             action=ACTIONS.UPDATE,
             old=collection_record)
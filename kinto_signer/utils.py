@@ -1,4 +1,13 @@
-from collections import OrderedDict
+import cProfile
+import functools
+import logging
+import os
+import random
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from contextlib import contextmanager
 
 from kinto.views import NameGenerator
 
@@ -6,6 +15,15 @@ from enum import Enum
 from pyramid.settings import aslist
 from pyramid.exceptions import ConfigurationError
 
+try:
+    import tracemalloc
+except ImportError:  # pragma: no cover
+    # Python 2
+    tracemalloc = None
+
+
+logger = logging.getLogger(__name__)
+
 
 class STATUS(Enum):
     WORK_IN_PROGRESS = 'work-in-progress'
@@ -61,3 +79,408 @@ def parse_resources(raw_resources):
             'destination': destination,
         }
     return resources
+
+
+def index_resources(resources):
+    """Return the keys of the specified resources (see
+    :func:`parse_resources`), by source ``(bucket_id, collection_id)``.
+    """
+    return {(r['source']['bucket'], r['source']['collection']): key
+            for key, r in resources.items()}
+
+
+class SingleFlight(object):
+    """Coalesce concurrent calls for the same key: while a call is in flight,
+    the other callers wait for it and share its result.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, func, *args, **kwargs):
+        """Run `func` unless a call for `key` is already in flight.
+
+        :returns: the result of the call, and whether it was shared with
+            a call made by another thread.
+        :rtype: tuple
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _FlightCall()
+            else:
+                call.followers += 1
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = func(*args, **kwargs)
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+
+class _FlightCall(object):
+    def __init__(self):
+        self.done = threading.Event()
+        self.followers = 0
+        self.result = None
+        self.error = None
+
+
+class SigningLockedError(Exception):
+    """Raised when the signing lock of a collection could not be acquired."""
+
+
+class CacheLock(object):
+    """A best-effort lock shared by the Kinto nodes through the configured
+    cache backend.
+
+    The lock is held with a lease of ``ttl`` seconds, renewed while held by a
+    single background thread: if the holder crashes, it is released
+    automatically once the lease expires.
+
+    .. note::
+
+        The cache API offers no atomic *set if not exists* nor *delete if
+        equals*: the lock is verified by reading back the value after setting
+        it, which does not exclude two nodes that read an empty value at the
+        same time. The lock reduces concurrent signatures among nodes, but
+        does not guarantee mutual exclusion.
+
+    :param cache: the instance of kinto.core.cache.
+    :param int ttl: the lease duration in seconds.
+    :param float wait_timeout: the number of seconds to wait for the lock
+        before giving up (``0`` to give up immediately).
+    :param statsd: optional statsd client to report lock waits.
+    """
+    def __init__(self, cache, ttl, wait_timeout=0, poll_interval=0.1,
+                 statsd=None):
+        self.cache = cache
+        self.ttl = ttl
+        self.wait_timeout = wait_timeout
+        self.poll_interval = poll_interval
+        self.statsd = statsd
+        self._lock = threading.Lock()
+        # Keys of the locks held by this process, by token.
+        self._held = {}
+        self._renewal = None
+
+    def _cache_key(self, key):
+        return "signer.lock.%s" % key
+
+    def acquire(self, key):
+        """Acquire the lock for `key`, and renew its lease until released.
+
+        :returns: the token to be used to release the lock.
+        :raises: :class:`SigningLockedError` if not acquired in time.
+        """
+        if self.statsd:
+            with self.statsd.timer("plugins.signer.lock_wait"):
+                token = self._acquire(key)
+        else:
+            token = self._acquire(key)
+
+        with self._lock:
+            self._held[token] = key
+            if self._renewal is None:
+                self._renewal = threading.Thread(target=self._renew)
+                self._renewal.daemon = True
+                self._renewal.start()
+        return token
+
+    def _acquire(self, key):
+        cache_key = self._cache_key(key)
+        token = uuid.uuid4().hex
+        deadline = time.time() + self.wait_timeout
+        while True:
+            if self.cache.get(cache_key) is None:
+                self.cache.set(cache_key, token, ttl=self.ttl)
+                if self.cache.get(cache_key) == token:
+                    return token
+            if time.time() >= deadline:
+                if self.statsd:
+                    self.statsd.count("plugins.signer.lock_rejected")
+                raise SigningLockedError("Signing of %r is locked." % key)
+            time.sleep(self.poll_interval)
+
+    def _renew(self):
+        """Renew the leases of the locks held, until none is held."""
+        while True:
+            time.sleep(self.ttl / 2.0)
+            with self._lock:
+                held = list(self._held.items())
+                if not held:
+                    self._renewal = None
+                    return
+            for token, key in held:
+                cache_key = self._cache_key(key)
+                if self.cache.get(cache_key) == token:
+                    self.cache.expire(cache_key, self.ttl)
+                    continue
+                with self._lock:
+                    lost = self._held.pop(token, None) is not None
+                if lost:
+                    logger.warning("Signing lock of %r was lost." % key)
+
+    def release(self, key, token):
+        """Release the lock for `key`, if still held with `token`.
+
+        Releasing the same token several times has no effect.
+        """
+        with self._lock:
+            self._held.pop(token, None)
+        cache_key = self._cache_key(key)
+        # Do not release a lock whose lease has expired and was taken.
+        if self.cache.get(cache_key) == token:
+            self.cache.delete(cache_key)
+
+    @contextmanager
+    def hold(self, key):
+        token = self.acquire(key)
+        try:
+            yield
+        finally:
+            self.release(key, token)
+
+
+class Debouncer(object):
+    """Run a function at most once per time window for each key.
+
+    The first call scheduled for a key starts a timer. Calls scheduled for
+    the same key until the timer fires are ignored.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._timers = {}
+
+    def schedule(self, key, delay, func, *args):
+        """Run `func` in `delay` seconds, unless already scheduled for `key`.
+
+        :returns: ``True`` if a new run was scheduled.
+        :rtype: bool
+        """
+        with self._lock:
+            if key in self._timers:
+                return False
+            timer = threading.Timer(delay, self._run, args=(key, func, args))
+            timer.daemon = True
+            self._timers[key] = timer
+        timer.start()
+        return True
+
+    def _run(self, key, func, args):
+        # Changes occuring while running will schedule a new run.
+        with self._lock:
+            del self._timers[key]
+        try:
+            func(*args)
+        except Exception:
+            logger.exception("Scheduled run of %r failed." % key)
+
+
+class Profiler(object):
+    """Profile the slow or sampled signatures, and dump the statistics in a
+    directory.
+
+    :param directory: where the profiles are written, as
+        ``<name>-<timestamp>.prof`` files (see :mod:`pstats`).
+    :param threshold: if set, every signature is profiled, and the profile is
+        kept if it lasted more than this number of seconds.
+    :param sample_rate: fraction of signatures that are profiled and kept,
+        regardless of their duration.
+    """
+    def __init__(self, directory, threshold=None, sample_rate=0.0):
+        self.directory = directory
+        self.threshold = threshold
+        self.sample_rate = sample_rate
+
+    @contextmanager
+    def profile(self, name):
+        sampled = random.random() < self.sample_rate
+        if not sampled and self.threshold is None:
+            yield
+            return
+
+        profiler = cProfile.Profile()
+        started = time.time()
+        profiler.enable()
+        try:
+            yield
+        finally:
+            profiler.disable()
+            duration = time.time() - started
+            if sampled or duration >= self.threshold:
+                filename = '%s-%s.prof' % (name, int(started * 1000))
+                path = os.path.join(self.directory, filename)
+                try:
+                    profiler.dump_stats(path)
+                    logger.info("Profile of %s (%.3fs) written to %s" %
+                                (name, duration, path))
+                except (IOError, OSError):
+                    logger.exception("Could not write profile %s" % path)
+
+
+class MemoryTracker(object):
+    """Measure the peak of memory allocated while signing, with
+    :mod:`tracemalloc`.
+
+    Memory is traced only while signatures are tracked. Since tracing and its
+    peak are process-wide, the measures are only exact for signatures tracked
+    one after the other: concurrent signatures (from several requests, or with
+    ``max_parallel_signatures``) reset the peak and include each other's
+    allocations.
+
+    :param top: number of allocation sites reported.
+    """
+    def __init__(self, top=5):
+        self.top = top
+        self._lock = threading.Lock()
+        self._active = 0
+        self._started = False
+        self._local = threading.local()
+
+    @contextmanager
+    def track(self):
+        """Track the memory allocated within the block.
+
+        Yields a dict, filled with the ``peak`` (in bytes) and the ``top``
+        allocation sites once the block is done.
+        """
+        with self._lock:
+            if self._active == 0 and not tracemalloc.is_tracing():
+                tracemalloc.start()
+                self._started = True
+            self._active += 1
+            if hasattr(tracemalloc, 'reset_peak'):  # Python 3.9+
+                tracemalloc.reset_peak()
+            baseline, _ = tracemalloc.get_traced_memory()
+
+        stats = {'top': None}
+        self._local.stats = stats
+        try:
+            yield stats
+        finally:
+            self._local.stats = None
+            _, peak = tracemalloc.get_traced_memory()
+            stats['peak'] = max(peak - baseline, 0)
+            if stats['top'] is None:
+                self.checkpoint(stats)
+            with self._lock:
+                self._active -= 1
+                if self._active == 0 and self._started:
+                    tracemalloc.stop()
+                    self._started = False
+
+    def checkpoint(self, stats=None):
+        """Snapshot the top allocation sites of the signature tracked in the
+        current thread, e.g. when most of its memory is allocated.
+        """
+        stats = stats or getattr(self._local, 'stats', None)
+        if stats is None or not tracemalloc.is_tracing():
+            return
+        snapshot = tracemalloc.take_snapshot()
+        stats['top'] = snapshot.statistics('lineno')[:self.top]
+
+
+def statsd_client(statsd):
+    """Return the underlying ``statsd.StatsClient`` of the specified
+    :class:`kinto.core.statsd.Client`.
+
+    Kinto's client only provides ``timer()`` and a ``count()`` that
+    increments by one: the counts of several units, the gauges and the
+    durations measured by hand are sent through the underlying client,
+    whose private attribute is only accessed here.
+    """
+    # Relies on ``kinto.core.statsd.Client._client`` (the ``StatsClient``) of
+    # kinto 4.1.0, pinned in requirements.txt: check it when upgrading kinto,
+    # since the public ``count()`` and ``timer()`` cannot send these metrics.
+    return statsd._client
+
+
+class InstrumentedBackend(object):
+    """Wrap a storage or permission backend, and measure the calls made to
+    its public methods: number of calls, rows returned and time spent, by
+    method name.
+
+    :param backend: the wrapped instance of kinto.core.storage or
+        kinto.core.permission.
+    :param name: the name of the backend (e.g. ``storage``), used as statsd
+        key.
+    :param statsd: optional statsd client, to which the duration of every
+        call and the number of rows are sent, under the
+        ``plugins.signer.<name>.<method>`` prefix.
+    """
+    def __init__(self, backend, name, statsd=None):
+        self.backend = backend
+        self.name = name
+        self.statsd = statsd
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Forget about the calls measured so far."""
+        with self._lock:
+            self.calls = Counter()
+            self.rows = Counter()
+            self.durations = Counter()
+
+    def stats(self):
+        """Return the measures of each method called, as a dict with the
+        number of ``calls``, ``rows`` and the ``time`` in seconds.
+        """
+        with self._lock:
+            return {method: {'calls': self.calls[method],
+                             'rows': self.rows[method],
+                             'time': self.durations[method]}
+                    for method in self.calls}
+
+    def __getattr__(self, attr):
+        if attr == 'backend':
+            raise AttributeError(attr)
+        value = getattr(self.backend, attr)
+        if attr.startswith('_') or not callable(value):
+            return value
+
+        @functools.wraps(value)
+        def wrapped(*args, **kwargs):
+            started = time.time()
+            try:
+                result = value(*args, **kwargs)
+            finally:
+                duration = time.time() - started
+                with self._lock:
+                    self.calls[attr] += 1
+                    self.durations[attr] += duration
+            rows = _count_rows(result)
+            with self._lock:
+                self.rows[attr] += rows
+            if self.statsd is not None:
+                key = 'plugins.signer.%s.%s' % (self.name, attr)
+                client = statsd_client(self.statsd)
+                client.timing(key, duration * 1000)
+                client.incr(key + '.rows', count=rows)
+            return result
+        return wrapped
+
+
+def _count_rows(result):
+    """Return the number of objects returned by a backend method."""
+    if isinstance(result, tuple) and result and isinstance(result[0], list):
+        # ``get_all()`` returns the records along their total count.
+        result = result[0]
+    if isinstance(result, (list, set)):
+        return len(result)
+    if isinstance(result, dict):
+        return 1
+    return 0
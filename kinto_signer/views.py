@@ -0,0 +1,130 @@
+import hashlib
+import json
+
+from cornice import Service
+from kinto.core import errors
+from kinto.core.errors import ERRORS
+from kinto.core.storage import Filter, Sort
+from kinto.core.utils import COMPARISON, instance_uri
+from pyramid import httpexceptions
+from pyramid.security import NO_PERMISSION_REQUIRED
+
+from kinto_signer.updater import CHANGESET_COLLECTION, TIMESTAMP_COLLECTION
+
+
+#: Maximum number of changesets merged in a response.
+MAX_MERGED_CHANGESETS = 1000
+
+
+changeset = Service(name='signer-changeset',
+                    description='Records changed by the signatures',
+                    path=('/buckets/{bucket_id}/collections/{collection_id}'
+                          '/changeset'))
+
+
+def merge_changesets(changesets, since):
+    """Merge the contiguous changesets from the ``since`` timestamp.
+
+    :returns: the merged changeset, or ``None`` if none starts from ``since``.
+    """
+    by_since = {c['since']: c for c in changesets}
+    latest = max(c['until'] for c in changesets)
+    if since not in by_since and since != latest:
+        return None
+
+    changed = set()
+    deleted = set()
+    until = since
+    while until in by_since:
+        current = by_since[until]
+        changed.difference_update(current['deleted'])
+        changed.update(current['changed'])
+        deleted.difference_update(current['changed'])
+        deleted.update(current['deleted'])
+        until = current['until']
+
+    return {
+        'since': since,
+        'until': until,
+        'changed': sorted(changed),
+        'deleted': sorted(deleted),
+    }
+
+
+@changeset.get(permission=NO_PERMISSION_REQUIRED)
+def get_changeset(request):
+    """Return the ids of the records changed in the destination collection
+    since the timestamp specified in the ``_since`` querystring parameter.
+
+    At most :data:`MAX_MERGED_CHANGESETS` changesets are merged: the
+    ``until`` timestamp of the response tells where to continue from.
+    """
+    matchdict = request.matchdict
+    destination = {'bucket': matchdict['bucket_id'],
+                   'collection': matchdict['collection_id']}
+    destinations = [r['destination']
+                    for r in request.registry.signer_resources.values()]
+    if destination not in destinations:
+        raise errors.http_error(httpexceptions.HTTPNotFound(),
+                                errno=ERRORS.MISSING_RESOURCE,
+                                message="Unknown destination collection")
+
+    try:
+        since = int(request.GET['_since'])
+    except (KeyError, ValueError):
+        raise errors.http_error(httpexceptions.HTTPBadRequest(),
+                                errno=ERRORS.INVALID_PARAMETERS,
+                                message="_since must be a timestamp")
+
+    parent_id = instance_uri(request, 'collection',
+                             bucket_id=destination['bucket'],
+                             id=destination['collection'])
+    # The changeset ending at ``_since`` tells that nothing changed since.
+    changesets, _ = request.registry.storage.get_all(
+        parent_id=parent_id,
+        collection_id=CHANGESET_COLLECTION,
+        filters=[Filter('until', since, COMPARISON.MIN)],
+        sorting=[Sort('until', 1)],
+        limit=MAX_MERGED_CHANGESETS)
+
+    merged = merge_changesets(changesets, since) if changesets else None
+    if merged is None:
+        raise errors.http_error(httpexceptions.HTTPNotFound(),
+                                errno=ERRORS.MISSING_RESOURCE,
+                                message="No changeset since this timestamp")
+    return {'data': merged}
+
+
+timestamps = Service(name='signer-timestamps',
+                     description='Last signed timestamps of destinations',
+                     path='/signer/timestamps')
+
+
+@timestamps.get(permission=NO_PERMISSION_REQUIRED)
+def get_timestamps(request):
+    """Return the last signed timestamp of every configured destination
+    (``None`` if never signed), in a single storage query.
+    """
+    stored, _ = request.registry.storage.get_all(
+        parent_id='',
+        collection_id=TIMESTAMP_COLLECTION)
+    by_uri = {r['id']: r['timestamp'] for r in stored}
+
+    data = []
+    for resource in request.registry.signer_resources.values():
+        destination = resource['destination']
+        uri = instance_uri(request, 'collection',
+                           bucket_id=destination['bucket'],
+                           id=destination['collection'])
+        data.append({'bucket': destination['bucket'],
+                     'collection': destination['collection'],
+                     'last_modified': by_uri.get(uri)})
+
+    # Let clients poll with ``If-None-Match``: the ETag changes whenever any
+    # of the listed timestamps changes.
+    content = json.dumps(data, sort_keys=True).encode('utf-8')
+    etag = '"%s"' % hashlib.sha256(content).hexdigest()
+    if request.headers.get('If-None-Match') == etag:
+        raise httpexceptions.HTTPNotModified(headers={'ETag': etag})
+    request.response.headers['ETag'] = etag
+    return {'data': data}
@@ -0,0 +1,285 @@
+"""Stand-in Autograph server, in order to exercise the Autograph signer
+offline.
+
+Implements the ``/sign/data`` and ``/sign/hash`` endpoints with Hawk
+authentication, signing with a local ECDSA (P-384) key, like Autograph's
+``content-signature`` signer. Latency, errors and a limit of concurrent
+requests can be injected::
+
+    $ python scripts/autograph_server.py --latency 0.05 --error-rate 0.01 \\
+        --max-concurrency 4
+
+And then in the Kinto settings::
+
+    kinto.signer.signer_backend = kinto_signer.signer.autograph
+    kinto.signer.autograph.server_url = http://localhost:8000
+    kinto.signer.autograph.hawk_id = alice
+    kinto.signer.autograph.hawk_secret = fs5wgcer9qj819kfptdlp8gm227ewxnzvsuj9ztycsx08hfhzu
+"""
+import argparse
+import base64
+import hashlib
+import json
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+import ecdsa
+from ecdsa import NIST384p, SigningKey
+from mohawk import Receiver
+from mohawk.exc import HawkFail
+from six.moves import socketserver
+from webob import Request, Response
+
+
+DEFAULT_PORT = 8000
+DEFAULT_HAWK_ID = 'alice'
+DEFAULT_HAWK_SECRET = 'fs5wgcer9qj819kfptdlp8gm227ewxnzvsuj9ztycsx08hfhzu'
+
+# Requests signed more than this number of seconds away are rejected.
+HAWK_TIMESTAMP_SKEW = 60
+
+# Autograph uses this prefix prior to signing.
+CONTENT_SIGNATURE_PREFIX = b'Content-Signature:\x00'
+
+
+class ConcurrencyLimit(object):
+    """Limit the number of requests processed at once. Requests beyond the
+    limit wait up to ``timeout`` seconds for a slot.
+    """
+    def __init__(self, limit=None, timeout=0):
+        self.limit = limit
+        self.timeout = timeout
+        self.active = 0
+        self.peak = 0
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        deadline = time.time() + self.timeout
+        with self._condition:
+            while self.limit is not None and self.active >= self.limit:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    return False
+                self._condition.wait(remaining)
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+            return True
+
+    def release(self):
+        with self._condition:
+            self.active -= 1
+            self._condition.notify()
+
+
+class AutographApp(object):
+    """WSGI application that mimics the signing endpoints of Autograph.
+
+    :param credentials: Hawk secrets, by Hawk id.
+    :param private_key: the ECDSA private key (:class:`ecdsa.SigningKey`).
+    :param latency: seconds added to every signing request.
+    :param jitter: maximum seconds randomly added to the latency.
+    :param error_rate: fraction of signing requests that fail with a ``503``.
+    :param limit: the :class:`ConcurrencyLimit` of signing requests. Requests
+        beyond the limit fail with a ``503``.
+    """
+    def __init__(self, credentials, private_key, latency=0, jitter=0,
+                 error_rate=0, limit=None):
+        self.credentials = credentials
+        self.private_key = private_key
+        public_key = private_key.get_verifying_key()
+        self.public_key = base64.b64encode(public_key.to_der()).decode('utf-8')
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.limit = limit or ConcurrencyLimit()
+        self.stats = {'signed': 0, 'unauthorized': 0, 'injected_errors': 0,
+                      'rejected': 0}
+        self._lock = threading.Lock()
+        # The nonces seen, and the order in which they expire.
+        self._nonces = set()
+        self._nonces_expiry = deque()
+
+    def __call__(self, environ, start_response):
+        request = Request(environ)
+        response = self.handle(request)
+        return response(environ, start_response)
+
+    def _count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+    def handle(self, request):
+        if request.path in ('/__heartbeat__', '/__lbheartbeat__'):
+            return _json_response({})
+
+        endpoints = {'/sign/data': self.sign_data,
+                     '/sign/hash': self.sign_hash}
+        if request.path not in endpoints:
+            return _json_response({'error': 'not found'}, status=404)
+        if request.method != 'POST':
+            return _json_response({'error': 'method not allowed'},
+                                  status=405)
+
+        try:
+            self.authenticate(request)
+        except HawkFail as e:
+            self._count('unauthorized')
+            return _json_response({'error': str(e)}, status=401)
+
+        if not self.limit.acquire():
+            self._count('rejected')
+            return _json_response({'error': 'too many requests'}, status=503)
+        try:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+            if random.random() < self.error_rate:
+                self._count('injected_errors')
+                return _json_response({'error': 'injected error'},
+                                      status=503)
+            try:
+                inputs = json.loads(request.body.decode('utf-8'))
+                signatures = [endpoints[request.path](i) for i in inputs]
+            except (ValueError, TypeError, KeyError) as e:
+                return _json_response({'error': str(e)}, status=400)
+            self._count('signed')
+            return _json_response(signatures)
+        finally:
+            self.limit.release()
+
+    def authenticate(self, request):
+        def lookup(hawk_id):
+            if hawk_id not in self.credentials:
+                raise LookupError(hawk_id)
+            return {'id': hawk_id,
+                    'key': self.credentials[hawk_id],
+                    'algorithm': 'sha256'}
+
+        def seen_nonce(hawk_id, nonce, timestamp):
+            key = (hawk_id, nonce, timestamp)
+            with self._lock:
+                self._evict_nonces()
+                seen = key in self._nonces
+                if not seen:
+                    self._nonces.add(key)
+                    # A timestamp accepted now is at most ``skew`` seconds
+                    # ahead, and is then accepted ``skew`` seconds longer.
+                    expiry = time.time() + 2 * HAWK_TIMESTAMP_SKEW
+                    self._nonces_expiry.append((expiry, key))
+            return seen
+
+        Receiver(lookup,
+                 request.headers.get('Authorization', ''),
+                 request.url,
+                 request.method,
+                 content=request.body,
+                 content_type=request.headers.get('Content-Type', ''),
+                 seen_nonce=seen_nonce,
+                 timestamp_skew_in_seconds=HAWK_TIMESTAMP_SKEW)
+
+    def _evict_nonces(self):
+        """Forget the nonces whose timestamps are out of the Hawk skew
+        window, since their requests are rejected anyway.
+        """
+        now = time.time()
+        while self._nonces_expiry and self._nonces_expiry[0][0] <= now:
+            _, key = self._nonces_expiry.popleft()
+            self._nonces.discard(key)
+
+    def sign_data(self, signing_input):
+        data = base64.b64decode(signing_input['input'])
+        digest = hashlib.sha384(CONTENT_SIGNATURE_PREFIX + data).digest()
+        return self._signature(digest)
+
+    def sign_hash(self, signing_input):
+        digest = base64.b64decode(signing_input['input'])
+        return self._signature(digest)
+
+    def _signature(self, digest):
+        signature = self.private_key.sign_digest(
+            digest, sigencode=ecdsa.util.sigencode_string)
+        encoded = base64.urlsafe_b64encode(signature).decode('utf-8')
+        return {
+            'ref': str(uuid.uuid4()),
+            'signature': encoded,
+            'signature_encoding': 'rs_base64url',
+            'hash_algorithm': 'sha384',
+            'x5u': '',
+            'content-signature': 'x5u=;p384ecdsa=%s' % encoded,
+            'public_key': self.public_key,
+        }
+
+
+def _json_response(body, status=200):
+    return Response(json.dumps(body), status=status,
+                    content_type='application/json', charset='utf-8')
+
+
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    daemon_threads = True
+    request_queue_size = 128
+
+
+class QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Stand-in Autograph server')
+    parser.add_argument('--host', type=str, default='localhost')
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--hawk-id', type=str, default=DEFAULT_HAWK_ID)
+    parser.add_argument('--hawk-secret', type=str,
+                        default=DEFAULT_HAWK_SECRET)
+    parser.add_argument('--private-key', type=str, default=None,
+                        help='ECDSA private key (PEM). A key is generated '
+                             'if not specified')
+    parser.add_argument('--latency', type=float, default=0,
+                        help='Seconds added to every signing request')
+    parser.add_argument('--jitter', type=float, default=0,
+                        help='Maximum seconds randomly added to the latency')
+    parser.add_argument('--error-rate', type=float, default=0,
+                        help='Fraction of signing requests that fail')
+    parser.add_argument('--max-concurrency', type=int, default=None,
+                        help='Number of signing requests processed at once')
+    parser.add_argument('--queue-timeout', type=float, default=0,
+                        help='Seconds a request waits for a slot before '
+                             'being rejected')
+    parser.add_argument('--verbose', action='store_true',
+                        help='Log every request')
+    args = parser.parse_args(args)
+
+    if args.private_key is None:
+        private_key = SigningKey.generate(curve=NIST384p)
+    else:
+        with open(args.private_key, 'rb') as f:
+            private_key = SigningKey.from_pem(f.read())
+
+    app = AutographApp(credentials={args.hawk_id: args.hawk_secret},
+                       private_key=private_key,
+                       latency=args.latency,
+                       jitter=args.jitter,
+                       error_rate=args.error_rate,
+                       limit=ConcurrencyLimit(args.max_concurrency,
+                                              args.queue_timeout))
+    handler = WSGIRequestHandler if args.verbose else QuietHandler
+    server = make_server(args.host, args.port, app,
+                         server_class=ThreadingWSGIServer,
+                         handler_class=handler)
+    print('Serving on http://%s:%s' % (args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        stats = dict(app.stats, peak_concurrency=app.limit.peak)
+        print(json.dumps(stats, indent=2, sort_keys=True))
+
+
+if __name__ == '__main__':
+    main()
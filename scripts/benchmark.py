@@ -0,0 +1,260 @@
+"""Offline benchmarks of the signing pipeline.
+
+Runs against the memory storage backend and the local ECDSA signer, and
+prints the results as JSON, in order to compare them between revisions::
+
+    $ python scripts/benchmark.py --sizes 1000 10000 --output before.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+import uuid
+from collections import OrderedDict
+from string import hexdigits
+
+import transaction
+from kinto import main as kinto_main, __version__ as kinto_version
+from pyramid.scripting import prepare
+
+from kinto_signer import __version__ as signer_version
+from kinto_signer.generate_keypair import generate_keypair
+from kinto_signer.hasher import compute_hash
+from kinto_signer.serializer import canonical_json
+from kinto_signer.signer.local_ecdsa import ECDSASigner
+
+
+DEFAULT_SIZES = (1000, 10000, 100000)
+DEFAULT_RATIOS = (0.0, 0.01, 0.1, 1.0)
+DEFAULT_REPEAT = 3
+
+SOURCE = {'bucket': 'bench', 'collection': 'source'}
+DESTINATION = {'bucket': 'bench', 'collection': 'destination'}
+
+
+def _rand(size=10):
+    return ''.join([random.choice(hexdigits) for _ in range(size)])
+
+
+def _fake_records(count):
+    return [{'id': str(uuid.UUID(int=random.getrandbits(128))),
+             'title': _rand(20),
+             'last_modified': i + 1}
+            for i in range(count)]
+
+
+class Environment(object):
+    """A Kinto application with the plugin, using memory backends."""
+
+    def __init__(self, private_key):
+        settings = {
+            'includes': 'kinto_signer',
+            'userid_hmac_secret': 'benchmark',
+            'multiauth.policies': 'basicauth',
+            'signer.resources': '/buckets/{bucket}/collections/{collection};'
+                                '/buckets/{dbucket}/collections/{dcollection}'
+                                .format(dbucket=DESTINATION['bucket'],
+                                        dcollection=DESTINATION['collection'],
+                                        **SOURCE),
+            'signer.signer_backend': 'kinto_signer.signer.local_ecdsa',
+            'signer.ecdsa.private_key': private_key,
+        }
+        kinto_main({}, **settings)
+        env = prepare()
+        self.closer = env['closer']
+        self.registry = env['registry']
+        self.request = env['request']
+        self.request.authn_type = 'basicauth'
+        self.request.selected_userid = 'benchmark'
+
+        self.storage = self.registry.storage
+        self.updater = self.registry.signer_updaters[
+            '/buckets/{bucket}/collections/{collection}'.format(**SOURCE)]
+
+    def populate(self, count):
+        """Create the source collection with `count` records."""
+        self.storage.create(collection_id='bucket', parent_id='',
+                            record={'id': SOURCE['bucket']})
+        self.storage.create(collection_id='collection',
+                            parent_id='/buckets/%s' % SOURCE['bucket'],
+                            record={'id': SOURCE['collection']})
+        parent_id = '/buckets/{bucket}/collections/{collection}'.format(
+            **SOURCE)
+        self.records = []
+        for i in range(count):
+            record = self.storage.create(collection_id='record',
+                                         parent_id=parent_id,
+                                         record={'title': _rand(20)})
+            self.records.append(record)
+
+    def change(self, ratio):
+        """Update half and delete the other half of `ratio` source records.
+        """
+        parent_id = '/buckets/{bucket}/collections/{collection}'.format(
+            **SOURCE)
+        changed = random.sample(self.records, int(len(self.records) * ratio))
+        for i, record in enumerate(changed):
+            if i % 2:
+                self.storage.delete(collection_id='record',
+                                    parent_id=parent_id,
+                                    object_id=record['id'])
+            else:
+                self.storage.update(collection_id='record',
+                                    parent_id=parent_id,
+                                    object_id=record['id'],
+                                    record={'title': _rand(20)})
+
+    def sign(self):
+        with transaction.manager:
+            self.request.bound_data.clear()
+            self.request.bound_data['resource_events'] = OrderedDict()
+            self.updater.sign_and_update_destination(self.request)
+
+    def push(self):
+        with transaction.manager:
+            self.request.bound_data.clear()
+            self.request.bound_data['resource_events'] = OrderedDict()
+            self.updater.push_records_to_destination(self.request)
+
+    def close(self):
+        self.storage.flush()
+        self.closer()
+
+
+def measure(func, repeat, setup=None, teardown=None):
+    """Run `func` `repeat` times, between `setup` and `teardown`, and return
+    the durations in seconds.
+    """
+    durations = []
+    for _ in range(repeat):
+        context = setup() if setup is not None else None
+        try:
+            started = timeit.default_timer()
+            func(context)
+            durations.append(timeit.default_timer() - started)
+        finally:
+            if teardown is not None:
+                teardown(context)
+    return durations
+
+
+def result(name, durations, records, change_ratio=None):
+    durations = sorted(durations)
+    return {
+        'name': name,
+        'records': records,
+        'change_ratio': change_ratio,
+        'runs': durations,
+        'min': durations[0],
+        'median': durations[len(durations) // 2],
+    }
+
+
+def bench_primitives(size, repeat, private_key):
+    signer = ECDSASigner(private_key=private_key)
+    records = _fake_records(size)
+    serialized = canonical_json(records, size)
+    signature = signer.sign(serialized)
+
+    return [
+        result('canonical_json',
+               measure(lambda _: canonical_json(records, size), repeat),
+               size),
+        result('compute_hash',
+               measure(lambda _: compute_hash(serialized), repeat),
+               size),
+        result('ecdsa_sign',
+               measure(lambda _: signer.sign(serialized), repeat),
+               size),
+        result('ecdsa_verify',
+               measure(lambda _: signer.verify(serialized, signature),
+                       repeat),
+               size),
+    ]
+
+
+def bench_updater(size, ratio, repeat, private_key):
+    def setup():
+        # Destination signed once, then `ratio` of source records changed.
+        env = Environment(private_key)
+        env.populate(size)
+        env.sign()
+        env.change(ratio)
+        return env
+
+    def teardown(env):
+        env.close()
+
+    push = measure(lambda env: env.push(), repeat, setup, teardown)
+    sign = measure(lambda env: env.sign(), repeat, setup, teardown)
+    return [
+        result('push_records_to_destination', push, size, ratio),
+        result('sign_and_update_destination', sign, size, ratio),
+    ]
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Benchmark the signing pipeline')
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=DEFAULT_SIZES,
+                        help='Numbers of records')
+    parser.add_argument('--ratios', type=float, nargs='+',
+                        default=DEFAULT_RATIOS,
+                        help='Ratios of source records changed between '
+                             'signatures')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT,
+                        help='Number of runs of each benchmark')
+    parser.add_argument('--seed', type=int, default=42,
+                        help='Random seed')
+    parser.add_argument('--output', type=str, default=None,
+                        help='Output file (default: stdout)')
+    args = parser.parse_args(args)
+
+    random.seed(args.seed)
+
+    keys_folder = tempfile.mkdtemp()
+    private_key = os.path.join(keys_folder, 'ecdsa.private.pem')
+    generate_keypair(private_key, os.path.join(keys_folder,
+                                               'ecdsa.public.pem'))
+
+    results = []
+    try:
+        for size in args.sizes:
+            results.extend(bench_primitives(size, args.repeat, private_key))
+            for ratio in args.ratios:
+                results.extend(bench_updater(size, ratio, args.repeat,
+                                             private_key))
+    finally:
+        shutil.rmtree(keys_folder)
+
+    report = {
+        'meta': {
+            'date': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'kinto': kinto_version,
+            'kinto_signer': signer_version,
+            'sizes': args.sizes,
+            'ratios': args.ratios,
+            'repeat': args.repeat,
+            'seed': args.seed,
+        },
+        'results': results,
+    }
+    output = json.dumps(report, indent=2, sort_keys=True)
+    if args.output is None:
+        print(output)
+    else:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,12 +1,35 @@
+"""End-to-end signing test, and load generator.
+
+Populates source collections, triggers signatures, and verifies the signatures
+of the destination collections. With several collections, each one has an
+editor and a reviewer client: up to ``--concurrency`` collections are edited
+at once, with up to ``--reviewers`` signature requests at once, and the
+latency of the requests is reported::
+
+    $ python scripts/e2e.py --collections 10 --concurrency 5 --reviewers 2 \\
+        --records 1000 --batch-size 100 --rounds 5
+
+With several collections, the source collections are suffixed with their
+number (e.g. ``source0;destination0``), and must be configured in the
+``kinto.signer.resources`` setting of the server.
+"""
+import argparse
+import json
+import math
 import random
+import threading
+import time
+import uuid
 from string import hexdigits
-import argparse
 from functools import partial
 
+from concurrent.futures import ThreadPoolExecutor
+from ecdsa import VerifyingKey
 from kinto_http import Client, exceptions as kinto_exceptions
 from kinto_signer.serializer import canonical_json
 from kinto_signer.hasher import compute_hash
-from kinto_signer.signer.local_ecdsa import ECDSASigner
+
+from validate_signature import PublicKeySigner
 
 
 DEFAULT_SERVER = 'http://localhost:8888/v1'
@@ -21,6 +44,16 @@ def _rand(size=10):
     return ''.join([random.choice(hexdigits) for _ in range(size)])
 
 
+def _auth(value):
+    # why do I have to do all of this just to set up auth...
+    def _prepare(req, user='', password=''):
+        req.prepare_auth((user, password))
+        return req
+
+    user, password = value.split(':', 1)
+    return partial(_prepare, user=user, password=password)
+
+
 def collection_timestamp(client):
     # XXXX Waiting https://github.com/Kinto/kinto-http.py/issues/77
     endpoint = client.get_endpoint('records')
@@ -28,21 +61,173 @@ def collection_timestamp(client):
     return headers.get('ETag', '').strip('"')
 
 
-def upload_records(client, num):
-    records = []
-    for i in range(num):
-        data = {'one': _rand(1000)}
-        record = client.create_record(data)
-        records.append(record['data'])
+def upload_records(client, num, size=1000, batch_size=1):
+    """Create `num` random records of about `size` bytes, by batches of
+    `batch_size` requests.
+    """
+    records = [{'id': str(uuid.uuid4()), 'one': _rand(size)}
+               for _ in range(num)]
+    for i in range(0, num, batch_size):
+        with client.batch() as batch:
+            for record in records[i:i + batch_size]:
+                batch.create_record(data=record)
     return records
 
 
+def percentiles(values, ranks=(50, 90, 99)):
+    values = sorted(values)
+    if not values:
+        return {}
+    result = {}
+    for rank in ranks:
+        # Nearest-rank method.
+        index = int(math.ceil(rank / 100.0 * len(values))) - 1
+        result['p%s' % rank] = values[max(index, 0)]
+    result['max'] = values[-1]
+    return result
+
+
+class Stats(object):
+    """Durations of the requests, by kind, shared among clients."""
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.durations = {}
+        self.records = 0
+
+    def add(self, kind, duration, records=0):
+        with self._lock:
+            self.durations.setdefault(kind, []).append(duration)
+            self.records += records
+
+    def report(self, elapsed):
+        report = {
+            'elapsed': elapsed,
+            'records_written': self.records,
+            'records_per_second': self.records / elapsed,
+        }
+        for kind, durations in sorted(self.durations.items()):
+            report[kind] = dict(count=len(durations),
+                                per_second=len(durations) / elapsed,
+                                **percentiles(durations))
+        return report
+
+
+class Scenario(object):
+    """The editor and reviewer of a source collection."""
+    def __init__(self, args, stats, suffix=''):
+        self.args = args
+        self.stats = stats
+        self.source = args.source_col + suffix
+        self.destination = args.dest_col + suffix
+        self.editor = Client(server_url=args.server,
+                             auth=_auth(args.auth),
+                             bucket=args.source_bucket,
+                             collection=self.source)
+        self.reviewer = Client(server_url=args.server,
+                               auth=_auth(args.reviewer_auth or args.auth),
+                               bucket=args.source_bucket,
+                               collection=self.source)
+        self.records = {}
+
+    def setup(self):
+        # initialize source bucket/collection (if necessary)
+        try:
+            self.editor.delete_collection()
+        except kinto_exceptions.KintoException:
+            pass
+        self.editor.create_bucket(if_not_exists=True)
+        self.editor.create_collection(if_not_exists=True)
+        self.upload(self.args.records)
+
+    def upload(self, count):
+        started = time.time()
+        records = upload_records(self.editor, count, self.args.record_size,
+                                 self.args.batch_size)
+        self.stats.add('upload', time.time() - started, count)
+        self.records.update((r['id'], r) for r in records)
+
+    def edit(self):
+        self.upload(self.args.creates)
+
+        existing = list(self.records.values())
+        changed = random.sample(existing, min(len(existing),
+                                              self.args.updates +
+                                              self.args.deletes))
+        deleted = changed[self.args.updates:]
+        started = time.time()
+        for i in range(0, len(changed), self.args.batch_size):
+            with self.editor.batch() as batch:
+                for record in changed[i:i + self.args.batch_size]:
+                    if record in deleted:
+                        batch.delete_record(id=record['id'])
+                    else:
+                        record['newkey'] = _rand(10)
+                        batch.patch_record(data=dict(record))
+        self.stats.add('edit', time.time() - started, len(changed))
+        for record in deleted:
+            del self.records[record['id']]
+
+    def sign(self, reviewers):
+        # ask for a signature by toggling "to-sign"
+        if self.args.review:
+            started = time.time()
+            self.editor.patch_collection(data={"status": "to-review"})
+            self.stats.add('to_review', time.time() - started)
+        with reviewers:
+            started = time.time()
+            self.reviewer.patch_collection(data={"status": "to-sign"})
+            self.stats.add('to_sign', time.time() - started)
+
+    def run(self, reviewers):
+        self.setup()
+        self.sign(reviewers)
+        for _ in range(self.args.rounds):
+            self.edit()
+            self.sign(reviewers)
+
+    def verify(self):
+        """Obtain the destination records, serialize them canonically and
+        verify that the signature matches.
+        """
+        dest_client = Client(server_url=self.args.server,
+                             bucket=self.args.dest_bucket,
+                             collection=self.destination)
+
+        records = dest_client.get_records()
+        expected = len(self.records)
+        assert len(records) == expected, "%s != %s records" % (len(records),
+                                                               expected)
+        timestamp = collection_timestamp(dest_client)
+        serialized = canonical_json(records, timestamp)
+        print('%s: hash is %r' % (self.destination,
+                                  compute_hash(serialized)))
+
+        # get back the signed hash
+        dest_col = dest_client.get_collection()
+        signature = dest_col['data']['signature']
+
+        # verify the signature matches the hash, without writing the key
+        verifying_key = VerifyingKey.from_pem(signature['public_key'])
+        signer = PublicKeySigner(verifying_key)
+        try:
+            signer.verify(serialized, signature)
+            print('%s: signature OK' % self.destination)
+        except Exception:
+            print('%s: signature KO' % self.destination)
+            raise
+
+
 def _get_args():
     parser = argparse.ArgumentParser(description='End-to-end signing test')
 
-    parser.add_argument('--auth', help='Basic Authentication',
+    parser.add_argument('--auth', help='Basic Authentication of editors',
                         type=str, default=DEFAULT_AUTH)
 
+    parser.add_argument('--reviewer-auth',
+                        help='Basic Authentication of reviewers '
+                             '(default: same as editors)',
+                        type=str, default=None)
+
     parser.add_argument('--server', help='Kinto Server',
                         type=str, default=DEFAULT_SERVER)
 
@@ -58,88 +243,84 @@ def _get_args():
     parser.add_argument('--dest-col', help='Destination collection',
                         type=str, default=DEST_COL)
 
+    parser.add_argument('--collections', help='Number of collections',
+                        type=int, default=1)
+
+    parser.add_argument('--concurrency',
+                        help='Number of collections edited concurrently, '
+                             'with one editor each',
+                        type=int, default=1)
+
+    parser.add_argument('--reviewers',
+                        help='Number of concurrent signature requests',
+                        type=int, default=1)
+
+    parser.add_argument('--review', help='Request a review before signing',
+                        action='store_true')
+
+    parser.add_argument('--records', help='Initial number of records',
+                        type=int, default=20)
+
+    parser.add_argument('--record-size', help='Size of records (bytes)',
+                        type=int, default=1000)
+
+    parser.add_argument('--batch-size',
+                        help='Number of requests by batch (at most the '
+                             'batch_max_requests setting of the server)',
+                        type=int, default=1)
+
+    parser.add_argument('--rounds', help='Number of changes and signatures '
+                                         'after the first signature',
+                        type=int, default=1)
+
+    parser.add_argument('--creates', help='Records created by round',
+                        type=int, default=20)
+
+    parser.add_argument('--updates', help='Records updated by round',
+                        type=int, default=5)
+
+    parser.add_argument('--deletes', help='Records deleted by round',
+                        type=int, default=5)
+
+    parser.add_argument('--no-verify', help='Skip the signatures check',
+                        action='store_true')
+
+    parser.add_argument('--output', help='Write the report in this file',
+                        type=str, default=None)
+
     return parser.parse_args()
 
 
 def main():
     args = _get_args()
 
-    # why do I have to do all of this just to set up auth...
-    def _auth(req, user='', password=''):
-        req.prepare_auth((user, password))
-        return req
-
-    if args.auth is not None:
-        user, password = args.auth.split(':')
-        args.auth = partial(_auth, user=user, password=password)
-
-    client = Client(server_url=args.server, auth=args.auth,
-                    bucket=args.source_bucket,
-                    collection=args.source_col)
-
-    # 0. initialize source bucket/collection (if necessary)
-    try:
-        client.delete_collection()
-    except kinto_exceptions.KintoException:
-        pass
-    client.create_bucket(if_not_exists=True)
-    client.create_collection(if_not_exists=True)
-
-    # 1. upload data
-    print('Uploading 20 random records')
-    records = upload_records(client, 20)
-
-    # 2. ask for a signature by toggling "to-sign"
-    print('Trigger signature')
-    data = {"status": "to-sign"}
-    client.patch_collection(data=data)
-
-    # 3. upload more data
-    print('Create 20 others records')
-    upload_records(client, 20)
-
-    print('Update 5 random records')
-    for toupdate in random.sample(records, 5):
-        client.patch_record(dict(newkey=_rand(10), **toupdate))
-
-    print('Delete 5 random records')
-    for todelete in random.sample(records, 5):
-        client.delete_record(todelete['id'])
-
-    # 4. ask again for a signature by toggling "to-sign"
-    print('Trigger signature')
-    data = {"status": "to-sign"}
-    client.patch_collection(data=data)
-
-    # 5. wait for the result
-
-    # 6. obtain the destination records and serialize canonically.
-
-    dest_client = Client(server_url=args.server, bucket=args.dest_bucket,
-                         collection=args.dest_col)
-
-    records = dest_client.get_records()
-    assert len(records) == 35, "%s != 35 records" % len(records)
-    timestamp = collection_timestamp(dest_client)
-    serialized = canonical_json(records, timestamp)
-    print('Hash is %r' % compute_hash(serialized))
-
-    # 7. get back the signed hash
-
-    dest_col = dest_client.get_collection()
-    signature = dest_col['data']['signature']
-
-    with open('pub', 'w') as f:
-        f.write(signature['public_key'])
-
-    # 8. verify the signature matches the hash
-    signer = ECDSASigner(public_key='pub')
-    try:
-        signer.verify(serialized, signature)
-        print('Signature OK')
-    except Exception:
-        print('Signature KO')
-        raise
+    stats = Stats()
+    if args.collections == 1:
+        scenarios = [Scenario(args, stats)]
+    else:
+        scenarios = [Scenario(args, stats, suffix=str(i))
+                     for i in range(args.collections)]
+
+    print('%s collections, %s concurrently, %s reviewers' % (
+        args.collections, args.concurrency, args.reviewers))
+    reviewers = threading.BoundedSemaphore(args.reviewers)
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        futures = [executor.submit(s.run, reviewers) for s in scenarios]
+    for future in futures:
+        future.result()
+    elapsed = time.time() - started
+
+    report = stats.report(elapsed)
+    output = json.dumps(report, indent=2, sort_keys=True)
+    print(output)
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            f.write(output)
+
+    if not args.no_verify:
+        for scenario in scenarios:
+            scenario.verify()
 
 
 if __name__ == '__main__':
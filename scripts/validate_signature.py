@@ -1,56 +1,269 @@
+"""Validate the signatures of destination collections.
+
+Every collection configured on the server (``signer`` capability) is
+validated, unless some are listed. Collections are validated concurrently,
+with a shared pool of connections::
+
+    $ python scripts/validate_signature.py -s https://kinto.stage.mozaws.net/v1
+    $ python scripts/validate_signature.py blocklists/certificates --workers 4
+
+With ``--stream``, the records are fetched, serialized and hashed page by
+page, in order to validate very large collections in constant memory.
+The records are sorted by id on the server, which follows the collation of
+its database (e.g. PostgreSQL) rather than the code points order of the
+serialization: if they come out of order, the collection is validated with
+all its records loaded instead.
+"""
+import argparse
+import base64
+import hashlib
+import json
+import sys
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from ecdsa import VerifyingKey
 from kinto_http import cli_utils
-from kinto_signer.serializer import canonical_json
+from six.moves.urllib.parse import urljoin
+
+from kinto_signer.serializer import canonical_json, iter_canonical_json
 from kinto_signer.hasher import compute_hash
+from kinto_signer.signer.exceptions import BadSignatureError
 from kinto_signer.signer.local_ecdsa import ECDSASigner
 
 
 DEFAULT_SERVER = "https://kinto.stage.mozaws.net/v1"
-DEST_BUCKET = 'blocklists'
-DEST_COLLECTION = 'certificates'
+DEFAULT_WORKERS = 8
+DEFAULT_PAGE_SIZE = 1000
 
 
-def main(args=None):
-    parser = cli_utils.add_parser_options(
-        description='Validate collection signature',
-        default_server=DEFAULT_SERVER,
-        default_bucket=DEST_BUCKET,
-        default_collection=DEST_COLLECTION)
+class PublicKeySigner(ECDSASigner):
+    """Verify signatures with a public key loaded in memory."""
+    def __init__(self, verifying_key):
+        super(PublicKeySigner, self).__init__(public_key=verifying_key)
 
-    args = parser.parse_args(args)
+    def load_public_key(self):
+        return self.public_key
 
-    client = cli_utils.create_client_from_args(args)
 
-    # 1. Grab collection information
-    dest_col = client.get_collection()
+class SignerCache(object):
+    """Signers by public key content, shared among threads, since most
+    collections are signed with the same keys.
+    """
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._signers = {}
 
-    # 2. Grab records
-    records = client.get_records(_sort='-last_modified')
-    timestamp = client.get_records_timestamp()
+    def get(self, public_key):
+        with self._lock:
+            signer = self._signers.get(public_key)
+            if signer is None:
+                # Autograph returns the DER key in base64, without PEM armor.
+                verifying_key = VerifyingKey.from_pem(public_key)
+                signer = self._signers[public_key] = PublicKeySigner(
+                    verifying_key)
+            return signer
 
-    # 3. Serialize
-    serialized = canonical_json(records, timestamp)
 
-    # 3. Compute the hash
-    computed_hash = compute_hash(serialized)
+class Server(object):
+    """Minimal Kinto client, sharing a pool of connections among threads."""
+    def __init__(self, server_url, auth=None, pool_size=DEFAULT_WORKERS,
+                 retry=0):
+        self.server_url = server_url.rstrip('/') + '/'
+        self.session = requests.Session()
+        self.session.auth = auth
+        adapter = HTTPAdapter(pool_connections=1,
+                              pool_maxsize=pool_size,
+                              max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def get(self, path_or_url, **params):
+        url = urljoin(self.server_url, path_or_url.lstrip('/'))
+        resp = self.session.get(url, params=params)
+        resp.raise_for_status()
+        return resp
+
+    def destinations(self):
+        """Return the destination collections configured on the server."""
+        capabilities = self.get('/').json().get('capabilities', {})
+        resources = capabilities.get('signer', {}).get('resources', [])
+        return [(r['destination']['bucket'], r['destination']['collection'])
+                for r in resources]
 
-    # 4. Grab the signature
-    signature = dest_col['data']['signature']
+    def collection(self, bucket, collection):
+        path = '/buckets/%s/collections/%s' % (bucket, collection)
+        return self.get(path).json()['data']
 
-    # 5. Grab the public key
-    with open('pub', 'w') as f:
-        f.write(signature['public_key'])
+    def records(self, bucket, collection):
+        """Return the records of the collection, and its timestamp."""
+        path = '/buckets/%s/collections/%s/records' % (bucket, collection)
+        resp = self.get(path, _sort='-last_modified')
+        timestamp = resp.headers['ETag'].strip('"')
+        records = resp.json()['data']
+        while resp.headers.get('Next-Page'):
+            resp = self.get(resp.headers['Next-Page'])
+            records.extend(resp.json()['data'])
+        return records, timestamp
 
-    # 6. Verify the signature matches the hash
-    signer = ECDSASigner(public_key='pub')
+    def iter_records(self, bucket, collection, page_size=DEFAULT_PAGE_SIZE):
+        """Return the timestamp of the collection, and an iterator on its
+        records sorted by id, fetched page by page.
+        """
+        path = '/buckets/%s/collections/%s/records' % (bucket, collection)
+        resp = self.get(path, _sort='id', _limit=page_size)
+        timestamp = resp.headers['ETag'].strip('"')
+
+        def _records(resp):
+            while True:
+                for record in resp.json()['data']:
+                    yield record
+                next_page = resp.headers.get('Next-Page')
+                if not next_page:
+                    return
+                resp = self.get(next_page)
+
+        return timestamp, _records(resp)
+
+
+def validate(server, signers, bucket, collection, stream=False,
+             page_size=DEFAULT_PAGE_SIZE):
+    """Validate the signature of the specified collection.
+
+    If ``stream`` is true, records are serialized and hashed as they are
+    fetched, page by page, instead of being loaded at once.
+
+    :returns: the outcome of the validation.
+    :rtype: dict
+    """
+    result = {'bucket': bucket, 'collection': collection}
+    started = time.time()
+    try:
+        # 1. Grab collection information
+        dest_col = server.collection(bucket, collection)
+
+        # 2. Grab the signature
+        signature = dest_col['signature']
+        signer = signers.get(signature['public_key'])
+
+        # 3. Grab records, serialize and verify the signature matches
+        if stream:
+            verified, records, computed_hash = _verify_stream(
+                server, signer, signature, bucket, collection, page_size)
+        else:
+            verified, records, computed_hash = _verify(
+                server, signer, signature, bucket, collection)
+
+        result['records'] = records
+        result['status'] = 'OK' if verified else 'KO'
+        if not verified:
+            result['hash'] = computed_hash
+
+        # XXX 4. Verify that the public key is correct wrt the x5u chain
+    except Exception as e:
+        result['status'] = 'ERROR'
+        result['error'] = repr(e)
+    result['duration'] = time.time() - started
+    return result
+
+
+def _verify(server, signer, signature, bucket, collection):
+    records, timestamp = server.records(bucket, collection)
+    serialized = canonical_json(records, timestamp)
     try:
         signer.verify(serialized, signature)
-        print('Signature OK')
-    except Exception:
-        print('Signature KO. Computed hash: %s' % computed_hash)
-        raise
+        return True, len(records), None
+    except BadSignatureError:
+        return False, len(records), compute_hash(serialized)
+
+
+def _verify_stream(server, signer, signature, bucket, collection, page_size):
+    timestamp, records = server.iter_records(bucket, collection, page_size)
+    # The signature covers the prefixed payload, the reported hash does not.
+    signed_hash = hashlib.sha384(signer.prefix)
+    payload_hash = hashlib.sha384()
+    chunks = 0
+    try:
+        for chunk in iter_canonical_json(records, timestamp):
+            chunk = chunk.encode('utf-8')
+            signed_hash.update(chunk)
+            payload_hash.update(chunk)
+            chunks += 1
+    except ValueError:
+        # The server collation does not sort ids like the serializer.
+        return _verify(server, signer, signature, bucket, collection)
+    # One chunk per record, between the header and the trailer.
+    count = chunks - 2
+    try:
+        signer.verify_digest(signed_hash.digest(), signature)
+        return True, count, None
+    except BadSignatureError:
+        computed_hash = base64.b64encode(payload_hash.digest())
+        return False, count, computed_hash.decode('utf-8')
+
+
+def main(args=None):
+    parser = argparse.ArgumentParser(
+        description='Validate collection signatures')
+    parser.add_argument('collections', nargs='*',
+                        help='Collections to validate, as <bucket>/<id> '
+                             '(default: every configured destination)')
+    parser.add_argument('--workers', type=int, default=DEFAULT_WORKERS,
+                        help='Number of collections validated concurrently')
+    parser.add_argument('--stream', action='store_true',
+                        help='Fetch, serialize and hash the records page by '
+                             'page, in constant memory')
+    parser.add_argument('--page-size', type=int, default=DEFAULT_PAGE_SIZE,
+                        help='Number of records by page, with --stream')
+    parser.add_argument('--output', type=str, default=None,
+                        help='Write the report as JSON in this file')
+    cli_utils.add_parser_options(parser,
+                                 default_server=DEFAULT_SERVER,
+                                 include_bucket=False,
+                                 include_collection=False)
+    args = parser.parse_args(args)
+
+    server = Server(args.server, auth=args.auth, pool_size=args.workers,
+                    retry=args.retry)
+    if args.collections:
+        collections = [tuple(c.strip('/').split('/', 1))
+                       for c in args.collections]
+    else:
+        collections = server.destinations()
+
+    signers = SignerCache()
+    started = time.time()
+    with ThreadPoolExecutor(max_workers=args.workers) as executor:
+        results = list(executor.map(
+            lambda c: validate(server, signers, *c, stream=args.stream,
+                               page_size=args.page_size),
+            collections))
+    elapsed = time.time() - started
+
+    for result in results:
+        line = '%(status)-5s %(bucket)s/%(collection)s (%(duration).2fs)'
+        if 'records' in result:
+            line += ' %(records)s records'
+        if 'hash' in result:
+            line += ' - computed hash: %(hash)s'
+        if 'error' in result:
+            line += ' - %(error)s'
+        print(line % result)
+
+    failed = [r for r in results if r['status'] != 'OK']
+    print('%s collections validated in %.2fs: %s OK, %s failed' % (
+        len(results), elapsed, len(results) - len(failed), len(failed)))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump({'elapsed': elapsed, 'results': results}, f,
+                      indent=2, sort_keys=True)
 
-    # XXX 7. Verify that the public key is correct wrt the x5u chain
+    return 1 if failed else 0
 
 
 if __name__ == '__main__':
-    main()
+    sys.exit(main())
@@ -11,6 +11,7 @@ REQUIREMENTS = [
     'kinto>=3.3.0',
     'ecdsa',
     'enum34',
+    'futures; python_version < "3.2"',
     'requests-hawk',
 ]
 
@@ -4,6 +4,7 @@ try:
 except ImportError:
     import configparser
 
+import mock
 from kinto import main as kinto_main
 
 try:
@@ -35,3 +36,30 @@ class BaseWebTest(CoreWebTest):
         settings['signer.group_check_enabled'] = False
         settings['signer.to_review_enabled'] = False
         return settings
+
+
+class LocalSignerMixin(object):
+    """Sign with the local ECDSA key of the tests instead of Autograph."""
+    def get_app_settings(self, extras=None):
+        settings = super(LocalSignerMixin, self).get_app_settings(extras)
+        settings['kinto.signer.signer_backend'] = ('kinto_signer.signer.'
+                                                   'local_ecdsa')
+        settings['signer.ecdsa.private_key'] = os.path.join(
+            here, 'config', 'ecdsa.private.pem')
+        return settings
+
+
+def patch_autograph(testcase, signature=""):
+    """Patch the calls to Autograph until the end of the test, and return
+    the mocked ``requests`` module.
+    """
+    patch = mock.patch('kinto_signer.signer.autograph.requests')
+    mocked = patch.start()
+    testcase.addCleanup(patch.stop)
+    mocked.post.return_value.json.return_value = [{
+        "signature": signature,
+        "hash_algorithm": "",
+        "signature_encoding": "",
+        "content-signature": "",
+        "x5u": ""}]
+    return mocked
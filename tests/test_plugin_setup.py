@@ -1,19 +1,25 @@
+import threading
+import time
 import unittest
 
 import mock
 import pytest
+import transaction
 from kinto import main as kinto_main
-from pyramid import testing
+from pyramid import httpexceptions, testing
 from pyramid.exceptions import ConfigurationError
 from requests import exceptions as requests_exceptions
 
 from kinto_signer import __version__ as signer_version
 from kinto_signer.signer.autograph import AutographSigner
-from kinto_signer import includeme
-from kinto_signer.listeners import sign_collection_data
-from kinto_signer import utils
+from kinto_signer import includeme, _resource_setting
+from kinto_signer.listeners import on_collection_changed
+from kinto_signer import listeners, utils
+from kinto_signer.serializer import canonical_json
+from kinto_signer.updater import LocalUpdater
 
-from .support import BaseWebTest, get_user_headers
+from .support import (BaseWebTest, LocalSignerMixin, get_user_headers,
+                      patch_autograph)
 
 
 class HelloViewTest(BaseWebTest, unittest.TestCase):
@@ -124,51 +130,289 @@ class IncludeMeTest(unittest.TestCase):
         assert signer1.public_key == "/path/to/key"
         assert signer2.server_url == "http://localhost"
 
+    def test_storage_is_not_instrumented_by_default(self):
+        settings = {
+            "signer.resources": (
+                "/buckets/sb1/collections/sc1;/buckets/db1/collections/dc1"
+            ),
+            "signer.ecdsa.public_key": "/path/to/key",
+        }
+        config = self.includeme(settings)
+        assert config.registry.signer_storage is config.registry.storage
+        assert (config.registry.signer_permission is
+                config.registry.permission)
+
+    def test_updaters_are_built_once_per_resource(self):
+        settings = {
+            "signer.resources": (
+                "/buckets/sb1/collections/sc1;/buckets/db1/collections/dc1"
+            ),
+            "signer.ecdsa.public_key": "/path/to/key",
+            "signer.page_size": "42",
+        }
+        config = self.includeme(settings)
+        updater = config.registry.signer_updaters["/buckets/sb1/collections/sc1"]
+        assert updater.source == {"bucket": "sb1", "collection": "sc1"}
+        assert updater.destination == {"bucket": "db1", "collection": "dc1"}
+        assert updater.page_size == 42
+        assert updater.storage is config.registry.signer_storage
+
+    def test_tombstones_max_age_is_passed_to_updaters(self):
+        settings = {
+            "signer.resources": (
+                "/buckets/sb1/collections/sc1;/buckets/db1/collections/dc1"
+            ),
+            "signer.ecdsa.public_key": "/path/to/key",
+            "signer.sb1.tombstones_max_age": "3600",
+        }
+        config = self.includeme(settings)
+        updater, = config.registry.signer_updaters.values()
+        assert updater.tombstones_max_age == 3600
+        assert updater.tombstones_max_count is None
+
+    def test_profiler_is_shared_by_updaters_if_enabled(self):
+        settings = {
+            "signer.resources": (
+                "/buckets/sb1/collections/sc1;/buckets/db1/collections/dc1\n"
+                "/buckets/sb1/collections/sc2;/buckets/db1/collections/dc2"
+            ),
+            "signer.ecdsa.public_key": "/path/to/key",
+            "signer.profiling_dir": "/tmp/profiles",
+            "signer.profiling_threshold": "0.5",
+        }
+        config = self.includeme(settings)
+        updater1, updater2 = config.registry.signer_updaters.values()
+        assert updater1.profiler is updater2.profiler
+        assert updater1.profiler.directory == "/tmp/profiles"
+        assert updater1.profiler.threshold == 0.5
+        assert updater1.profiler.sample_rate == 0
+
+    def test_profiler_is_disabled_by_default(self):
+        settings = {
+            "signer.resources": (
+                "/buckets/sb1/collections/sc1;/buckets/db1/collections/dc1"
+            ),
+            "signer.ecdsa.public_key": "/path/to/key",
+        }
+        config = self.includeme(settings)
+        updater, = config.registry.signer_updaters.values()
+        assert updater.profiler is None
+        assert updater.memory_tracker is None
+
+    @pytest.mark.skipif(utils.tracemalloc is None,
+                        reason="tracemalloc requires Python 3")
+    def test_memory_tracker_is_built_if_enabled(self):
+        settings = {
+            "signer.resources": (
+                "/buckets/sb1/collections/sc1;/buckets/db1/collections/dc1"
+            ),
+            "signer.ecdsa.public_key": "/path/to/key",
+            "signer.memory_tracking_enabled": "true",
+            "signer.memory_tracking_top": "3",
+        }
+        config = self.includeme(settings)
+        updater, = config.registry.signer_updaters.values()
+        assert updater.memory_tracker.top == 3
+
+    @pytest.mark.skipif(utils.tracemalloc is None,
+                        reason="tracemalloc requires Python 3")
+    def test_memory_tracking_warns_if_signatures_are_parallel(self):
+        settings = {
+            "signer.resources": (
+                "/buckets/sb1/collections/sc1;/buckets/db1/collections/dc1"
+            ),
+            "signer.ecdsa.public_key": "/path/to/key",
+            "signer.memory_tracking_enabled": "true",
+            "signer.max_parallel_signatures": "4",
+        }
+        with mock.patch('kinto_signer.warnings.warn') as warn:
+            config = self.includeme(settings)
+        assert 'serial' in warn.call_args[0][0]
+        updater, = config.registry.signer_updaters.values()
+        assert updater.memory_tracker is not None
+
+    def test_memory_tracking_warns_if_tracemalloc_is_missing(self):
+        settings = {
+            "signer.resources": (
+                "/buckets/sb1/collections/sc1;/buckets/db1/collections/dc1"
+            ),
+            "signer.ecdsa.public_key": "/path/to/key",
+            "signer.memory_tracking_enabled": "true",
+        }
+        with mock.patch('kinto_signer.utils.tracemalloc', None):
+            with mock.patch('kinto_signer.warnings.warn') as warn:
+                config = self.includeme(settings)
+        assert warn.called
+        updater, = config.registry.signer_updaters.values()
+        assert updater.memory_tracker is None
+
+
+class ResourceSettingTest(unittest.TestCase):
+    resource = {'source': {'bucket': 'sb1', 'collection': 'sc1'}}
+
+    def test_collection_wide_setting_is_used_first(self):
+        settings = {"signer.sb1_sc1.foo": "a",
+                    "signer.sb1.foo": "b",
+                    "signer.foo": "c"}
+        assert _resource_setting(settings, self.resource, "foo") == "a"
+
+    def test_bucket_wide_setting_is_used_if_no_collection_setting(self):
+        settings = {"signer.sb1.foo": "b",
+                    "signer.foo": "c"}
+        assert _resource_setting(settings, self.resource, "foo") == "b"
+
+    def test_global_setting_is_used_as_fallback(self):
+        settings = {"signer.foo": "c"}
+        assert _resource_setting(settings, self.resource, "foo") == "c"
+
+    def test_default_is_returned_if_not_set(self):
+        assert _resource_setting({}, self.resource, "foo", 42) == 42
+
+    def test_global_setting_can_be_ignored(self):
+        settings = {"signer.foo": "c"}
+        assert _resource_setting(settings, self.resource, "foo", 42,
+                                 include_global=False) == 42
+        settings["signer.sb1.foo"] = "b"
+        assert _resource_setting(settings, self.resource, "foo",
+                                 include_global=False) == "b"
+
 
 class OnCollectionChangedTest(unittest.TestCase):
 
     def setUp(self):
-        patch = mock.patch('kinto_signer.listeners.LocalUpdater')
-        self.updater_mocked = patch.start()
-        self.addCleanup(patch.stop)
+        self.updater_mocked = mock.MagicMock()
+
+    def event(self, **kwargs):
+        evt = mock.MagicMock(**kwargs)
+        # Only the signature is dispatched for the changes of the plugin.
+        evt.request.prefixed_userid = "plugin:kinto-signer"
+        evt.request.registry.signer_updaters = {
+            "/buckets/a/collections/b": self.updater_mocked
+        }
+        return evt
+
+    def on_collection_changed(self, evt, resources):
+        status_options = dict(to_review_enabled=False,
+                              group_check_enabled=False,
+                              editors_group="editors",
+                              reviewers_group="reviewers")
+        signing_options = dict(max_parallel_signatures=1,
+                               sign_after_commit=False)
+        on_collection_changed(evt, resources_index=utils.index_resources(
+                                  utils.parse_resources(resources)),
+                              status_options=status_options,
+                              signing_options=signing_options)
 
     def test_nothing_happens_when_resource_is_not_configured(self):
-        evt = mock.MagicMock(payload={"bucket_id": "a", "collection_id": "b"})
-        sign_collection_data(evt, resources=utils.parse_resources("c/d;e/f"))
-        assert not self.updater_mocked.called
+        evt = self.event(payload={"bucket_id": "a", "collection_id": "b"})
+        self.on_collection_changed(evt, "c/d;e/f")
+        assert not self.updater_mocked.mock_calls
 
     def test_nothing_happens_when_status_is_not_to_sign(self):
-        evt = mock.MagicMock(payload={"bucket_id": "a", "collection_id": "b"},
-                             impacted_records=[{
-                                 "new": {"id": "b", "status": "signed"}}])
-        sign_collection_data(evt, resources=utils.parse_resources("a/b;c/d"))
+        evt = self.event(payload={"bucket_id": "a", "collection_id": "b"},
+                         impacted_records=[{
+                             "new": {"id": "b", "status": "signed"}}])
+        self.on_collection_changed(evt, "a/b;c/d")
         assert not self.updater_mocked.sign_and_update_destination.called
 
     def test_updater_is_called_when_resource_and_status_matches(self):
-        evt = mock.MagicMock(payload={"bucket_id": "a", "collection_id": "b"},
-                             impacted_records=[{
-                                 "new": {"id": "b", "status": "to-sign"}}])
-        evt.request.registry.storage = mock.sentinel.storage
-        evt.request.registry.permission = mock.sentinel.permission
-        evt.request.registry.signers = {
-            "/buckets/a/collections/b": mock.sentinel.signer
-        }
+        evt = self.event(payload={"bucket_id": "a", "collection_id": "b"},
+                         impacted_records=[{
+                             "new": {"id": "b", "status": "to-sign"}}])
         evt.request.route_path.return_value = "/v1/buckets/a/collections/b"
-        sign_collection_data(evt, resources=utils.parse_resources("a/b;c/d"))
-        self.updater_mocked.assert_called_with(
-            signer=mock.sentinel.signer,
-            storage=mock.sentinel.storage,
-            permission=mock.sentinel.permission,
-            source={"bucket": "a", "collection": "b"},
-            destination={"bucket": "c", "collection": "d"})
-
-        mocked = self.updater_mocked.return_value
-        assert mocked.sign_and_update_destination.called
+        self.on_collection_changed(evt, "a/b;c/d")
+        self.updater_mocked.sign_and_update_destination.assert_called_with(
+            evt.request)
 
     def test_updater_does_not_fail_when_payload_is_inconsistent(self):
         # This happens with events on default bucket for kinto < 3.3
         evt = mock.MagicMock(payload={"subpath": "collections/boom"})
-        sign_collection_data(evt, resources=utils.parse_resources("a/b;c/d"))
+        self.on_collection_changed(evt, "a/b;c/d")
+
+
+class CollectionChangedDispatchTest(unittest.TestCase):
+
+    def setUp(self):
+        self.updater_mocked = mock.MagicMock()
+        self.resources = utils.parse_resources("a/b;c/d")
+        self.status_options = dict(to_review_enabled=True,
+                                   group_check_enabled=False,
+                                   editors_group="editors",
+                                   reviewers_group="reviewers")
+        self.signing_options = dict(max_parallel_signatures=1,
+                                    sign_after_commit=False)
+
+    def dispatch(self, evt):
+        evt.request.registry.signer_updaters = {
+            "/buckets/a/collections/b": self.updater_mocked
+        }
+        on_collection_changed(evt, resources_index=utils.index_resources(
+                                  self.resources),
+                              status_options=self.status_options,
+                              signing_options=self.signing_options)
+
+    def test_unconfigured_collections_are_skipped_without_routing(self):
+        evt = mock.MagicMock(payload={"bucket_id": "a"},
+                             impacted_records=[{
+                                 "new": {"id": "z", "status": "to-sign"}}])
+        self.dispatch(evt)
+        assert not evt.request.route_path.called
+        assert not self.updater_mocked.mock_calls
+
+    def test_status_checks_are_run_before_signing(self):
+        evt = mock.MagicMock(payload={"bucket_id": "a"},
+                             impacted_records=[{
+                                 "new": {"id": "b", "status": "to-sign"}}])
+        evt.request.prefixed_userid = "basicauth:bob"
+        with mock.patch('kinto_signer.listeners.transaction'):
+            with pytest.raises(httpexceptions.HTTPBadRequest):
+                self.dispatch(evt)
+        assert not self.updater_mocked.mock_calls
+
+    def test_configured_collections_are_signed(self):
+        evt = mock.MagicMock(payload={"bucket_id": "a"},
+                             impacted_records=[
+                                 {"new": {"id": "z", "status": "to-sign"}},
+                                 {"old": {"status": "to-review"},
+                                  "new": {"id": "b", "status": "to-sign"}}])
+        evt.request.prefixed_userid = "basicauth:bob"
+        self.dispatch(evt)
+        self.updater_mocked.sign_and_update_destination.assert_called_with(
+            evt.request)
+
+
+class LatestCollectionRecordTest(unittest.TestCase):
+    def setUp(self):
+        self.request = mock.MagicMock()
+        self.request.bound_data = {"resource_events": {}}
+
+    def add_event(self, action, *records):
+        payload = {"resource_name": "collection", "bucket_id": "a",
+                   "action": action}
+        impacted = [{"new": r} for r in records]
+        events = self.request.bound_data["resource_events"]
+        events[action] = (action, payload, impacted, self.request)
+
+    def test_latest_version_is_returned(self):
+        self.add_event("create", {"id": "b", "last_modified": 1})
+        self.add_event("update", {"id": "b", "last_modified": 2},
+                       {"id": "c", "last_modified": 3})
+        latest = listeners._latest_collection_record(self.request, "a", "b")
+        assert latest == {"id": "b", "last_modified": 2}
+
+    def test_none_is_returned_if_deleted_within_the_request(self):
+        # e.g. a batch request that signs and then deletes the collection.
+        self.add_event("update", {"id": "b", "last_modified": 1,
+                                  "status": "to-sign"})
+        self.add_event("delete", {"id": "b", "last_modified": 2,
+                                  "deleted": True})
+        assert listeners._latest_collection_record(self.request,
+                                                   "a", "b") is None
+
+    def test_none_is_returned_if_not_changed(self):
+        self.add_event("update", {"id": "c", "last_modified": 1})
+        assert listeners._latest_collection_record(self.request,
+                                                   "a", "b") is None
 
 
 class BatchTest(BaseWebTest, unittest.TestCase):
@@ -178,16 +422,7 @@ class BatchTest(BaseWebTest, unittest.TestCase):
         self.app.put_json("/buckets/alice", headers=self.headers)
         self.app.put_json("/buckets/bob", headers=self.headers)
 
-        # Patch calls to Autograph.
-        patch = mock.patch('kinto_signer.signer.autograph.requests')
-        self.mock = patch.start()
-        self.addCleanup(patch.stop)
-        self.mock.post.return_value.json.return_value = [{
-            "signature": "",
-            "hash_algorithm": "",
-            "signature_encoding": "",
-            "content-signature": "",
-            "x5u": ""}]
+        self.mock = patch_autograph(self)
 
     def test_various_collections_can_be_signed_using_batch(self):
         self.app.put_json("/buckets/alice/collections/source",
@@ -234,6 +469,188 @@ class BatchTest(BaseWebTest, unittest.TestCase):
         assert resp.json["data"]["status"] == "signed"
 
 
+class SlowSigner(object):
+    """Signer that measures the number of signatures running at once."""
+    def __init__(self, delay=0.2):
+        self.delay = delay
+        self.active = 0
+        self.peak = 0
+        self._lock = threading.Lock()
+
+    def sign(self, payload):
+        with self._lock:
+            self.active += 1
+            self.peak = max(self.peak, self.active)
+        time.sleep(self.delay)
+        with self._lock:
+            self.active -= 1
+        return {"signature": "", "x5u": ""}
+
+
+class ParallelBatchTest(BatchTest):
+    max_parallel_signatures = 4
+
+    def get_app_settings(self, extras=None):
+        settings = super(ParallelBatchTest, self).get_app_settings(extras)
+        settings['signer.max_parallel_signatures'] = str(
+            self.max_parallel_signatures)
+        return settings
+
+    def sign_all_with(self, signer):
+        updaters = self.app.app.registry.signer_updaters
+        patches = [mock.patch.object(updater, "signer", signer)
+                   for updater in updaters.values()]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        self.app.post_json("/batch", {
+            "defaults": {
+                "method": "POST",
+                "path": "/buckets/alice/collections"
+            },
+            "requests": [
+                {"body": {"data": {"id": "source", "status": "to-sign"}}},
+                {"body": {"data": {"id": "from", "status": "to-sign"}}},
+                {"path": "/buckets/bob/collections",
+                 "body": {"data": {"id": "source", "status": "to-sign"}}},
+            ]
+        }, headers=self.headers)
+
+    def test_signatures_run_concurrently(self):
+        signer = SlowSigner()
+        self.sign_all_with(signer)
+        assert signer.peak == 3
+
+        resp = self.app.get("/buckets/bob/collections/source",
+                            headers=self.headers)
+        assert resp.json["data"]["status"] == "signed"
+
+    def test_other_collections_are_signed_if_one_fails(self):
+        self.app.put_json("/buckets/alice/collections/source",
+                          headers=self.headers)
+        self.app.put_json("/buckets/bob/collections/source",
+                          headers=self.headers)
+        failing = mock.MagicMock()
+        failing.sign.side_effect = ValueError("Unreachable")
+        updaters = self.app.app.registry.signer_updaters
+        updater = updaters["/buckets/bob/collections/source"]
+
+        with mock.patch.object(updater, "signer", failing):
+            self.app.post_json("/batch", {
+                "defaults": {
+                    "method": "PATCH",
+                    "body": {"data": {"status": "to-sign"}}
+                },
+                "requests": [
+                    {"path": "/buckets/alice/collections/source"},
+                    {"path": "/buckets/bob/collections/source"},
+                ]
+            }, headers=self.headers)
+
+        resp = self.app.get("/buckets/alice/collections/source",
+                            headers=self.headers)
+        assert resp.json["data"]["status"] == "signed"
+        resp = self.app.get("/buckets/bob/collections/source",
+                            headers=self.headers)
+        assert resp.json["data"]["status"] == "work-in-progress"
+
+    def test_other_collections_are_signed_if_one_cannot_be_prepared(self):
+        self.app.put_json("/buckets/alice/collections/source",
+                          headers=self.headers)
+        self.app.put_json("/buckets/bob/collections/source",
+                          headers=self.headers)
+        updaters = self.app.app.registry.signer_updaters
+        updater = updaters["/buckets/bob/collections/source"]
+
+        with mock.patch.object(updater, "get_destination_records",
+                               side_effect=ValueError("Unreadable")):
+            resp = self.app.post_json("/batch", {
+                "defaults": {
+                    "method": "PATCH",
+                    "body": {"data": {"status": "to-sign"}}
+                },
+                "requests": [
+                    {"path": "/buckets/bob/collections/source"},
+                    {"path": "/buckets/alice/collections/source"},
+                ]
+            }, headers=self.headers)
+
+        resp = self.app.get("/buckets/alice/collections/source",
+                            headers=self.headers)
+        assert resp.json["data"]["status"] == "signed"
+        resp = self.app.get("/buckets/bob/collections/source",
+                            headers=self.headers)
+        assert resp.json["data"]["status"] == "work-in-progress"
+
+    def test_preparations_are_profiled_and_tracked_if_enabled(self):
+        self.app.put_json("/buckets/alice/collections/source",
+                          headers=self.headers)
+        self.app.put_json("/buckets/bob/collections/source",
+                          headers=self.headers)
+        profiler = mock.MagicMock()
+        memory_tracker = mock.MagicMock()
+        track = memory_tracker.track.return_value
+        track.__enter__.return_value = {'peak': 42, 'top': []}
+        for updater in self.app.app.registry.signer_updaters.values():
+            for name, value in [('profiler', profiler),
+                                ('memory_tracker', memory_tracker)]:
+                patch = mock.patch.object(updater, name, value)
+                patch.start()
+                self.addCleanup(patch.stop)
+
+        self.app.post_json("/batch", {
+            "defaults": {
+                "method": "PATCH",
+                "body": {"data": {"status": "to-sign"}}
+            },
+            "requests": [
+                {"path": "/buckets/alice/collections/source"},
+                {"path": "/buckets/bob/collections/source"},
+            ]
+        }, headers=self.headers)
+
+        profiled = [c[0][0] for c in profiler.profile.call_args_list]
+        assert profiled == ['alice_source', 'bob_source']
+        assert memory_tracker.track.call_count == 2
+
+
+class CappedParallelBatchTest(ParallelBatchTest):
+    max_parallel_signatures = 2
+
+    def test_signatures_run_concurrently(self):
+        signer = SlowSigner()
+        self.sign_all_with(signer)
+        assert signer.peak == 2
+
+        for path in ("/buckets/alice/collections/source",
+                     "/buckets/alice/collections/from",
+                     "/buckets/bob/collections/source"):
+            resp = self.app.get(path, headers=self.headers)
+            assert resp.json["data"]["status"] == "signed"
+
+
+class LockedParallelBatchTest(ParallelBatchTest):
+    def get_app_settings(self, extras=None):
+        settings = super(LockedParallelBatchTest,
+                         self).get_app_settings(extras)
+        settings['signer.lock_enabled'] = 'true'
+        return settings
+
+    def test_locks_are_released_if_signing_fails_unexpectedly(self):
+        self.app.put_json("/buckets/alice/collections/source",
+                          headers=self.headers)
+        with mock.patch('kinto_signer.listeners.ThreadPoolExecutor') as pool:
+            executor = pool.return_value.__enter__.return_value
+            executor.submit.side_effect = RuntimeError("boom")
+            self.app.patch_json("/buckets/alice/collections/source",
+                                {"data": {"status": "to-sign"}},
+                                headers=self.headers, status=500)
+        cache = self.app.app.registry.cache
+        assert cache.get("signer.lock./buckets/alice/collections/source") \
+            is None
+
+
 class SigningErrorTest(BaseWebTest, unittest.TestCase):
     def test_returns_503_if_autograph_cannot_be_reached(self):
         headers = get_user_headers('me')
@@ -251,3 +668,735 @@ class SigningErrorTest(BaseWebTest, unittest.TestCase):
                             {"data": {"status": "to-sign"}},
                             headers=headers,
                             status=503)
+
+
+class PaginatedSigningTest(LocalSignerMixin, BaseWebTest,
+                           unittest.TestCase):
+    def get_app_settings(self, extras=None):
+        settings = super(PaginatedSigningTest, self).get_app_settings(extras)
+        settings['signer.page_size'] = '2'
+        settings['kinto.signer.resources'] = (
+            '/buckets/alice/collections/source;'
+            '/buckets/alice/collections/destination')
+        return settings
+
+    def test_records_are_pushed_and_signed_when_last_page_is_full(self):
+        headers = get_user_headers('me')
+        self.app.put_json("/buckets/alice", headers=headers)
+        self.app.put_json("/buckets/alice/collections/source",
+                          headers=headers)
+        for i in range(4):
+            self.app.post_json("/buckets/alice/collections/source/records",
+                               {"data": {"title": "hello %s" % i}},
+                               headers=headers)
+
+        self.app.patch_json("/buckets/alice/collections/source",
+                            {"data": {"status": "to-sign"}},
+                            headers=headers)
+
+        resp = self.app.get("/buckets/alice/collections/destination/records",
+                            headers=headers)
+        assert len(resp.json["data"]) == 4
+
+    def test_records_are_pushed_and_signed_by_pages(self):
+        headers = get_user_headers('me')
+        self.app.put_json("/buckets/alice", headers=headers)
+        self.app.put_json("/buckets/alice/collections/source",
+                          headers=headers)
+        for i in range(5):
+            self.app.post_json("/buckets/alice/collections/source/records",
+                               {"data": {"title": "hello %s" % i}},
+                               headers=headers)
+
+        self.app.patch_json("/buckets/alice/collections/source",
+                            {"data": {"status": "to-sign"}},
+                            headers=headers)
+
+        resp = self.app.get("/buckets/alice/collections/destination/records",
+                            headers=headers)
+        records = resp.json["data"]
+        assert len(records) == 5
+        timestamp = resp.headers["ETag"].strip('"')
+        resp = self.app.get("/buckets/alice/collections/destination",
+                            headers=headers)
+        signature = resp.json["data"]["signature"]
+
+        signer = self.app.app.registry.signers[
+            "/buckets/alice/collections/source"]
+        signer.verify(canonical_json(records, timestamp), signature)
+
+
+class SigningLockTest(BaseWebTest, unittest.TestCase):
+    def get_app_settings(self, extras=None):
+        settings = super(SigningLockTest, self).get_app_settings(extras)
+        settings['signer.lock_enabled'] = 'true'
+        return settings
+
+    def setUp(self):
+        super(SigningLockTest, self).setUp()
+        self.mock = patch_autograph(self)
+        self.headers = get_user_headers('me')
+        self.app.put_json("/buckets/alice", headers=self.headers)
+        self.app.put_json("/buckets/alice/collections/source",
+                          headers=self.headers)
+
+    def test_lock_is_released_after_signature(self):
+        self.app.patch_json("/buckets/alice/collections/source",
+                            {"data": {"status": "to-sign"}},
+                            headers=self.headers)
+        cache = self.app.app.registry.cache
+        key = "signer.lock./buckets/alice/collections/source"
+        assert cache.get(key) is None
+
+    def test_returns_503_if_collection_is_being_signed_elsewhere(self):
+        lock = self.app.app.registry.signer_lock
+        lock.acquire("/buckets/alice/collections/source")
+
+        self.app.patch_json("/buckets/alice/collections/source",
+                            {"data": {"status": "to-sign"}},
+                            headers=self.headers,
+                            status=503)
+        assert not self.mock.post.called
+
+    def test_lock_is_released_once_committed(self):
+        synch = TransactionTracker()
+        transaction.manager.registerSynch(synch)
+        self.addCleanup(transaction.manager.unregisterSynch, synch)
+        lock = self.app.app.registry.signer_lock
+        release = lock.release
+        opened = []
+
+        def tracked_release(key, token):
+            opened.append(synch.opened)
+            release(key, token)
+
+        with mock.patch.object(lock, 'release', side_effect=tracked_release):
+            self.app.patch_json("/buckets/alice/collections/source",
+                                {"data": {"status": "to-sign"}},
+                                headers=self.headers)
+        assert opened == [False]
+
+
+class LockUntilCompletedTest(unittest.TestCase):
+    def setUp(self):
+        self.request = mock.MagicMock()
+        self.request.bound_data = {}
+        self.lock = self.request.registry.signer_lock
+        self.token = self.lock.acquire.return_value
+
+    def test_lock_is_released_once_committed(self):
+        with transaction.manager:
+            listeners._lock_until_completed(self.request, "key")
+            assert not self.lock.release.called
+        self.lock.release.assert_called_with("key", self.token)
+
+    def test_lock_is_released_if_aborted(self):
+        transaction.begin()
+        listeners._lock_until_completed(self.request, "key")
+        transaction.abort()
+        self.lock.release.assert_called_with("key", self.token)
+
+    def test_lock_is_acquired_once_per_transaction(self):
+        with transaction.manager:
+            listeners._lock_until_completed(self.request, "key")
+            release = listeners._lock_until_completed(self.request, "key")
+        assert release is None
+        assert self.lock.acquire.call_count == 1
+        with transaction.manager:
+            listeners._lock_until_completed(self.request, "key")
+        assert self.lock.acquire.call_count == 2
+
+    def test_lock_is_released_if_the_commit_fails(self):
+        failing = mock.MagicMock(spec=['abort', 'tpc_begin', 'commit',
+                                       'tpc_vote', 'tpc_finish', 'tpc_abort',
+                                       'sortKey'])
+        failing.sortKey.return_value = "failing"
+        failing.tpc_vote.side_effect = RuntimeError("boom")
+        transaction.begin()
+        transaction.get().join(failing)
+        listeners._lock_until_completed(self.request, "key")
+        with pytest.raises(RuntimeError):
+            transaction.commit()
+        transaction.abort()
+        self.lock.release.assert_called_with("key", self.token)
+
+    def test_nothing_is_acquired_if_disabled(self):
+        self.request.registry.signer_lock = None
+        assert listeners._lock_until_completed(self.request, "key") is None
+
+
+class StoreCommittedSignatureTest(unittest.TestCase):
+    def test_destination_changed_once_written_aborts(self):
+        # A concurrent signature committed while waiting for the write.
+        updater = mock.MagicMock()
+        updater.get_destination_timestamp.side_effect = [42, 43]
+        with pytest.raises(listeners._DestinationChanged):
+            listeners._store_committed_signature(mock.MagicMock(), updater,
+                                                 {}, "{}", mock.sentinel.sig,
+                                                 42)
+        assert updater.store_signature.called
+        assert not updater.store_changeset.called
+
+
+class SignCommittedTest(unittest.TestCase):
+    def test_nothing_is_signed_if_the_commit_fails(self):
+        updater = mock.MagicMock()
+        request = mock.MagicMock()
+        failing = mock.MagicMock(spec=['abort', 'tpc_begin', 'commit',
+                                       'tpc_vote', 'tpc_finish', 'tpc_abort',
+                                       'sortKey'])
+        failing.sortKey.return_value = "failing"
+        failing.tpc_vote.side_effect = RuntimeError("boom")
+
+        transaction.begin()
+        transaction.get().join(failing)
+        with mock.patch('kinto_signer.listeners.capture_resource_events'):
+            listeners._push_and_sign_after_commit(request, "key", updater)
+        with pytest.raises(RuntimeError):
+            transaction.commit()
+        transaction.abort()
+
+        assert updater.push_records_to_destination.called
+        assert not updater.get_destination_records.called
+        assert not updater.sign_payload.called
+        assert not updater.store_signature.called
+
+
+class TransactionTracker(object):
+    """Transaction synchronizer that tells whether one is in progress."""
+    opened = False
+
+    def newTransaction(self, txn):
+        self.opened = True
+
+    def beforeCompletion(self, txn):
+        pass
+
+    def afterCompletion(self, txn):
+        self.opened = False
+
+
+class SignAfterCommitTest(BaseWebTest, unittest.TestCase):
+    def get_app_settings(self, extras=None):
+        settings = super(SignAfterCommitTest, self).get_app_settings(extras)
+        settings['signer.sign_after_commit'] = 'true'
+        return settings
+
+    def setUp(self):
+        super(SignAfterCommitTest, self).setUp()
+        self.mock = patch_autograph(self, signature="abc")
+        self.headers = get_user_headers('me')
+        self.app.put_json("/buckets/alice", headers=self.headers)
+        self.app.put_json("/buckets/alice/collections/source",
+                          headers=self.headers)
+        self.app.post_json("/buckets/alice/collections/source/records",
+                           {"data": {"title": "hello"}},
+                           headers=self.headers)
+
+    def test_destination_is_signed_once_committed(self):
+        self.app.patch_json("/buckets/alice/collections/source",
+                            {"data": {"status": "to-sign"}},
+                            headers=self.headers)
+
+        resp = self.app.get("/buckets/alice/collections/source",
+                            headers=self.headers)
+        assert resp.json["data"]["status"] == "signed"
+        resp = self.app.get("/buckets/alice/collections/destination",
+                            headers=self.headers)
+        assert resp.json["data"]["signature"]["signature"] == "abc"
+
+    def test_signature_is_profiled_and_tracked_if_enabled(self):
+        updater = self.app.app.registry.signer_updaters[
+            "/buckets/alice/collections/source"]
+        profiler = mock.MagicMock()
+        memory_tracker = mock.MagicMock()
+        track = memory_tracker.track.return_value
+        track.__enter__.return_value = {'peak': 42, 'top': []}
+
+        with mock.patch.object(updater, 'profiler', profiler), \
+                mock.patch.object(updater, 'memory_tracker', memory_tracker), \
+                mock.patch('kinto_signer.updater.logger') as logger:
+            self.app.patch_json("/buckets/alice/collections/source",
+                                {"data": {"status": "to-sign"}},
+                                headers=self.headers)
+
+        profiler.profile.assert_called_with('alice_source')
+        messages = [c[0][0] for c in logger.info.call_args_list]
+        assert any('42 bytes peak for 1 records' in m for m in messages)
+
+    def test_source_is_back_to_work_in_progress_if_signature_fails(self):
+        self.mock.post.side_effect = ValueError("Unreachable")
+        self.app.patch_json("/buckets/alice/collections/source",
+                            {"data": {"status": "to-sign"}},
+                            headers=self.headers)
+
+        resp = self.app.get("/buckets/alice/collections/source",
+                            headers=self.headers)
+        assert resp.json["data"]["status"] == "work-in-progress"
+        resp = self.app.get("/buckets/alice/collections/destination/records",
+                            headers=self.headers)
+        assert len(resp.json["data"]) == 1
+
+    def patch_sign_payload(self, side_effect):
+        updater = self.app.app.registry.signer_updaters[
+            "/buckets/alice/collections/source"]
+        original = updater.sign_payload
+
+        def sign_payload(*args):
+            side_effect()
+            return original(*args)
+
+        patch = mock.patch.object(updater, "sign_payload",
+                                  side_effect=sign_payload)
+        self.addCleanup(patch.stop)
+        return patch.start()
+
+    def change_destination(self):
+        self.app.app.registry.storage.create(
+            parent_id="/buckets/alice/collections/destination",
+            collection_id="record",
+            record={"title": "concurrent"})
+
+    def test_signer_is_called_outside_transactions(self):
+        synch = TransactionTracker()
+        transaction.manager.registerSynch(synch)
+        self.addCleanup(transaction.manager.unregisterSynch, synch)
+        opened = []
+        self.patch_sign_payload(lambda: opened.append(synch.opened))
+        self.app.patch_json("/buckets/alice/collections/source",
+                            {"data": {"status": "to-sign"}},
+                            headers=self.headers)
+        assert opened == [False]
+
+    def test_signature_is_computed_again_if_destination_changed(self):
+        changes = [self.change_destination]
+        sign_payload = self.patch_sign_payload(
+            lambda: changes and changes.pop()())
+        self.app.patch_json("/buckets/alice/collections/source",
+                            {"data": {"status": "to-sign"}},
+                            headers=self.headers)
+        assert sign_payload.call_count == 2
+
+        resp = self.app.get("/buckets/alice/collections/source",
+                            headers=self.headers)
+        assert resp.json["data"]["status"] == "signed"
+        resp = self.app.get("/buckets/alice/collections/destination/records",
+                            headers=self.headers)
+        timestamp = int(resp.headers["ETag"].strip('"'))
+        resp = self.app.get("/signer/timestamps", headers=self.headers)
+        assert timestamp in [t["last_modified"] for t in resp.json["data"]]
+
+    def test_signature_fails_if_destination_keeps_changing(self):
+        sign_payload = self.patch_sign_payload(self.change_destination)
+        self.app.patch_json("/buckets/alice/collections/source",
+                            {"data": {"status": "to-sign"}},
+                            headers=self.headers)
+        assert sign_payload.call_count == 3
+
+        resp = self.app.get("/buckets/alice/collections/source",
+                            headers=self.headers)
+        assert resp.json["data"]["status"] == "work-in-progress"
+        resp = self.app.get("/buckets/alice/collections/destination",
+                            headers=self.headers)
+        assert "signature" not in resp.json["data"]
+
+
+class LockedSignAfterCommitTest(SignAfterCommitTest):
+    def get_app_settings(self, extras=None):
+        settings = super(LockedSignAfterCommitTest,
+                         self).get_app_settings(extras)
+        settings['signer.lock_enabled'] = 'true'
+        return settings
+
+    def test_lock_is_released_once_signed(self):
+        self.app.patch_json("/buckets/alice/collections/source",
+                            {"data": {"status": "to-sign"}},
+                            headers=self.headers)
+        cache = self.app.app.registry.cache
+        assert cache.get("signer.lock./buckets/alice/collections/source") \
+            is None
+
+    def test_source_is_back_to_work_in_progress_if_locked_elsewhere(self):
+        lock = self.app.app.registry.signer_lock
+        token = lock.acquire("/buckets/alice/collections/source")
+        self.addCleanup(lock.release, "/buckets/alice/collections/source",
+                        token)
+        self.app.patch_json("/buckets/alice/collections/source",
+                            {"data": {"status": "to-sign"}},
+                            headers=self.headers)
+        assert not self.mock.post.called
+        resp = self.app.get("/buckets/alice/collections/source",
+                            headers=self.headers)
+        assert resp.json["data"]["status"] == "work-in-progress"
+
+
+class AutoSignTest(BaseWebTest, unittest.TestCase):
+    def get_app_settings(self, extras=None):
+        settings = super(AutoSignTest, self).get_app_settings(extras)
+        settings['signer.alice_source.auto_sign_delay'] = '0.05'
+        # Ignored: automatic signatures are enabled per bucket or collection.
+        settings['signer.auto_sign_delay'] = '0.05'
+        return settings
+
+    def setUp(self):
+        super(AutoSignTest, self).setUp()
+        self.mock = patch_autograph(self, signature="abc")
+        self.headers = get_user_headers('me')
+        self.app.put_json("/buckets/alice", headers=self.headers)
+        self.app.put_json("/buckets/alice/collections/source",
+                          headers=self.headers)
+        self.app.put_json("/buckets/alice/collections/from",
+                          headers=self.headers)
+
+    def wait_for_status(self, uri, status):
+        deadline = time.time() + 2
+        while time.time() < deadline:
+            resp = self.app.get(uri, headers=self.headers)
+            if resp.json["data"].get("status") == status:
+                return
+            time.sleep(0.01)
+        self.fail("Status never became %r" % status)
+
+    def test_changes_are_signed_once_per_delay(self):
+        for i in range(3):
+            self.app.post_json("/buckets/alice/collections/source/records",
+                               {"data": {"title": "hello %s" % i}},
+                               headers=self.headers)
+        self.wait_for_status("/buckets/alice/collections/source", "signed")
+
+        assert self.mock.post.call_count == 1
+        resp = self.app.get("/buckets/alice/collections/destination/records",
+                            headers=self.headers)
+        assert len(resp.json["data"]) == 3
+        resp = self.app.get("/buckets/alice/collections/source",
+                            headers=self.headers)
+        assert resp.json["data"]["last_reviewer"] == "plugin:kinto-signer"
+
+    def test_other_collections_are_not_signed_automatically(self):
+        self.app.post_json("/buckets/alice/collections/from/records",
+                           {"data": {"title": "hello"}},
+                           headers=self.headers)
+        time.sleep(0.1)
+        resp = self.app.get("/buckets/alice/collections/from",
+                            headers=self.headers)
+        assert resp.json["data"]["status"] == "work-in-progress"
+
+
+class DestinationBootstrapTest(BaseWebTest, unittest.TestCase):
+    def setUp(self):
+        super(DestinationBootstrapTest, self).setUp()
+        self.mock = patch_autograph(self)
+        self.headers = get_user_headers('me')
+        self.app.put_json("/buckets/alice", headers=self.headers)
+        self.app.put_json("/buckets/alice/collections/source",
+                          headers=self.headers)
+        self.registry = self.app.app.registry
+        self.sign()
+
+    def sign(self):
+        self.app.patch_json("/buckets/alice/collections/source",
+                            {"data": {"status": "to-sign"}},
+                            headers=self.headers)
+
+    def test_destination_is_not_recreated_on_next_signatures(self):
+        assert self.registry.signer_bootstrapped == {
+            "/buckets/alice/collections/destination"}
+        with mock.patch.object(self.registry.permission,
+                               'replace_object_permissions') as mocked:
+            self.sign()
+        uris = [args[0] for args, _ in mocked.call_args_list]
+        assert "/buckets/alice/collections/destination" not in uris
+
+    def test_destination_is_recreated_once_deleted(self):
+        self.app.delete("/buckets/alice/collections/destination",
+                        headers=self.headers)
+        assert self.registry.signer_bootstrapped == set()
+        self.sign()
+        self.app.get("/buckets/alice/collections/destination",
+                     headers=self.headers)
+
+    def test_destination_is_recreated_once_deleted_by_another_node(self):
+        # No event is received by this node.
+        self.registry.storage.delete(parent_id="/buckets/alice",
+                                     collection_id="collection",
+                                     object_id="destination")
+        assert self.registry.signer_bootstrapped == {
+            "/buckets/alice/collections/destination"}
+        self.sign()
+        resp = self.app.get("/buckets/alice/collections/source",
+                            headers=self.headers)
+        assert resp.json["data"]["status"] == "signed"
+        resp = self.app.get("/buckets/alice/collections/destination",
+                            headers=self.headers)
+        assert "signature" in resp.json["data"]
+
+    def test_destination_is_reconfigured_once_modified_by_someone(self):
+        self.app.patch_json("/buckets/alice/collections/destination",
+                            {"permissions": {"write": ["system.Everyone"]}},
+                            headers=self.headers)
+        assert self.registry.signer_bootstrapped == set()
+
+    def test_destination_is_kept_if_a_sibling_collection_changes(self):
+        self.app.put_json("/buckets/alice/collections/dest",
+                          headers=self.headers)
+        self.app.delete("/buckets/alice/collections/dest",
+                        headers=self.headers)
+        assert self.registry.signer_bootstrapped == {
+            "/buckets/alice/collections/destination"}
+
+    def test_destinations_of_a_sibling_bucket_are_kept(self):
+        self.app.put_json("/buckets/ali", headers=self.headers)
+        self.app.delete("/buckets/ali", headers=self.headers)
+        assert self.registry.signer_bootstrapped == {
+            "/buckets/alice/collections/destination"}
+
+    def test_destinations_of_a_deleted_bucket_are_forgotten(self):
+        self.app.delete("/buckets/alice", headers=self.headers)
+        assert self.registry.signer_bootstrapped == set()
+
+    def test_destinations_are_forgotten_when_server_is_flushed(self):
+        self.app.post("/__flush__", headers=self.headers, status=202)
+        assert self.registry.signer_bootstrapped == set()
+
+
+class CollectionMetadataWritesTest(BaseWebTest, unittest.TestCase):
+    def setUp(self):
+        super(CollectionMetadataWritesTest, self).setUp()
+        self.mock = patch_autograph(self)
+        self.headers = get_user_headers('me')
+        self.app.put_json("/buckets/alice", headers=self.headers)
+        self.app.put_json("/buckets/alice/collections/source",
+                          headers=self.headers)
+        self.storage = self.app.app.registry.storage
+
+    def test_collection_records_are_read_and_written_once(self):
+        self.app.patch_json("/buckets/alice/collections/source",
+                            {"data": {"status": "to-sign"}},
+                            headers=self.headers)
+        with mock.patch.object(self.storage, 'get',
+                               wraps=self.storage.get) as get:
+            with mock.patch.object(self.storage, 'update',
+                                   wraps=self.storage.update) as update:
+                self.app.patch_json("/buckets/alice/collections/source",
+                                    {"data": {"status": "to-sign"}},
+                                    headers=self.headers)
+
+        def calls(mocked):
+            # (collection_id, parent_id, object_id) may be positional.
+            ids = [args + tuple(kw[k] for k in ('collection_id', 'parent_id',
+                                                'object_id') if k in kw)
+                   for args, kw in mocked.call_args_list]
+            return [i[2] for i in ids if i[0] == 'collection']
+
+        # The source record was read by the request itself.
+        assert calls(get) == ['source', 'destination']
+        assert sorted(calls(update)) == ['destination', 'source', 'source']
+
+    def test_collection_metadata_is_consistent_after_signature(self):
+        self.app.patch_json("/buckets/alice/collections/source",
+                            {"data": {"status": "to-sign"}},
+                            headers=self.headers)
+        source = self.app.get("/buckets/alice/collections/source",
+                              headers=self.headers).json["data"]
+        assert source["status"] == "signed"
+        assert source["last_reviewer"].startswith("basicauth:")
+        dest = self.app.get("/buckets/alice/collections/destination",
+                            headers=self.headers).json["data"]
+        assert "signature" in dest
+
+
+class WorkInProgressStatusTest(LocalSignerMixin, BaseWebTest,
+                               unittest.TestCase):
+    def get_app_settings(self, extras=None):
+        settings = super(WorkInProgressStatusTest, self).get_app_settings(
+            extras)
+        settings['signer.storage_instrumentation_enabled'] = 'true'
+        settings['kinto.signer.resources'] = (
+            '/buckets/alice/collections/source;'
+            '/buckets/alice/collections/destination')
+        return settings
+
+    def setUp(self):
+        super(WorkInProgressStatusTest, self).setUp()
+        self.headers = get_user_headers('me')
+        self.app.put_json("/buckets/alice", headers=self.headers)
+        self.app.put_json("/buckets/alice/collections/source",
+                          headers=self.headers)
+        self.app.put_json("/buckets/alice/collections/source/records/abc",
+                          {"data": {"title": "hello"}},
+                          headers=self.headers)
+        self.app.patch_json("/buckets/alice/collections/source",
+                            {"data": {"status": "to-sign"}},
+                            headers=self.headers)
+        self.storage = self.app.app.registry.signer_storage
+        self.storage.reset()
+
+    def test_status_is_set_once_for_several_record_events(self):
+        original = LocalUpdater.update_source_status
+        with mock.patch.object(LocalUpdater, 'update_source_status',
+                               autospec=True,
+                               side_effect=original) as mocked:
+            self.app.post_json("/batch", {
+                "defaults": {"path": "/buckets/alice/collections/source"
+                                     "/records/abc"},
+                "requests": [
+                    {"method": "PATCH", "body": {"data": {"title": "a"}}},
+                    {"method": "PUT", "path": "/buckets/alice/collections/"
+                                              "source/records/def"},
+                    {"method": "DELETE"},
+                ]
+            }, headers=self.headers)
+        assert mocked.call_count == 1
+        assert self.storage.stats()['get']['calls'] == 1
+
+        resp = self.app.get("/buckets/alice/collections/source",
+                            headers=self.headers)
+        assert resp.json["data"]["status"] == "work-in-progress"
+
+    def test_collection_is_not_read_if_modified_by_the_request(self):
+        self.app.post_json("/batch", {
+            "requests": [
+                {"method": "PATCH",
+                 "path": "/buckets/alice/collections/source",
+                 "body": {"data": {"title": "Source"}}},
+                {"method": "PUT",
+                 "path": "/buckets/alice/collections/source/records/def"},
+            ]
+        }, headers=self.headers)
+        assert 'get' not in self.storage.stats()
+
+        resp = self.app.get("/buckets/alice/collections/source",
+                            headers=self.headers)
+        assert resp.json["data"]["title"] == "Source"
+        assert resp.json["data"]["status"] == "work-in-progress"
+
+
+class StorageCallsTest(LocalSignerMixin, BaseWebTest,
+                       unittest.TestCase):
+    """Signing must not issue storage calls per record, except to write the
+    changed records.
+    """
+    def get_app_settings(self, extras=None):
+        settings = super(StorageCallsTest, self).get_app_settings(extras)
+        settings['signer.storage_instrumentation_enabled'] = 'true'
+        settings['signer.page_size'] = '10'
+        settings['kinto.signer.resources'] = (
+            '/buckets/alice/collections/small;'
+            '/buckets/alice/collections/small-signed\n'
+            '/buckets/alice/collections/large;'
+            '/buckets/alice/collections/large-signed')
+        return settings
+
+    def setUp(self):
+        super(StorageCallsTest, self).setUp()
+        self.headers = get_user_headers('me')
+        self.app.put_json("/buckets/alice", headers=self.headers)
+        for collection, count in (('small', 3), ('large', 30)):
+            self.app.put_json("/buckets/alice/collections/%s" % collection,
+                              headers=self.headers)
+            for i in range(count):
+                self.app.post_json(
+                    "/buckets/alice/collections/%s/records" % collection,
+                    {"data": {"title": "hello %s" % i}},
+                    headers=self.headers)
+        self.storage = self.app.app.registry.signer_storage
+
+    def sign(self, collection):
+        self.storage.reset()
+        self.app.patch_json("/buckets/alice/collections/%s" % collection,
+                            {"data": {"status": "to-sign"}},
+                            headers=self.headers)
+        return {method: stats['calls']
+                for method, stats in self.storage.stats().items()}
+
+    def test_storage_is_instrumented_if_enabled(self):
+        assert isinstance(self.storage, utils.InstrumentedBackend)
+        assert isinstance(self.app.app.registry.signer_permission,
+                          utils.InstrumentedBackend)
+
+    def test_first_signature_only_pushes_each_record(self):
+        small = self.sign('small')
+        large = self.sign('large')
+        # One write per record pushed.
+        assert large.pop('create') - small.pop('create') == 27
+        # One read per page of 10 records: the 30 source and destination
+        # records are read in 3 pages (and an empty last one), and the
+        # existing destination records in 3 pages, instead of 1 each.
+        assert large.pop('get_all') - small.pop('get_all') == 3 + 3 + 2
+        assert 'get' not in large
+        assert small == large
+
+    def test_signature_without_changes_is_independent_of_records(self):
+        self.sign('small')
+        self.sign('large')
+        small = self.sign('small')
+        large = self.sign('large')
+        # Only the destination records to sign are read, by pages.
+        assert large.pop('get_all') - small.pop('get_all') == 3
+        assert small == large
+
+
+class TombstonesPurgeTest(LocalSignerMixin, BaseWebTest,
+                          unittest.TestCase):
+    def get_app_settings(self, extras=None):
+        settings = super(TombstonesPurgeTest, self).get_app_settings(extras)
+        settings['kinto.signer.resources'] = (
+            '/buckets/alice/collections/source;'
+            '/buckets/alice/collections/destination')
+        settings['signer.alice_source.tombstones_max_count'] = '2'
+        return settings
+
+    def setUp(self):
+        super(TombstonesPurgeTest, self).setUp()
+        self.headers = get_user_headers('me')
+        self.app.put_json("/buckets/alice", headers=self.headers)
+        self.app.put_json("/buckets/alice/collections/source",
+                          headers=self.headers)
+        for i in range(5):
+            self.app.put_json("/buckets/alice/collections/source/records/r%s"
+                              % i, {"data": {"title": "hello"}},
+                              headers=self.headers)
+        self.sign()
+        for i in range(4):
+            self.app.delete("/buckets/alice/collections/source/records/r%s"
+                            % i, headers=self.headers)
+        self.sign()
+
+    def sign(self):
+        self.app.patch_json("/buckets/alice/collections/source",
+                            {"data": {"status": "to-sign"}},
+                            headers=self.headers)
+
+    def test_only_most_recent_tombstones_are_kept(self):
+        resp = self.app.get("/buckets/alice/collections/destination/records"
+                            "?_since=0", headers=self.headers)
+        ids = [r["id"] for r in resp.json["data"] if r.get("deleted")]
+        assert sorted(ids) == ["r2", "r3"]
+
+    def test_destination_remains_signed(self):
+        resp = self.app.get("/buckets/alice/collections/destination/records",
+                            headers=self.headers)
+        records = resp.json["data"]
+        timestamp = resp.headers["ETag"].strip('"')
+        resp = self.app.get("/buckets/alice/collections/destination",
+                            headers=self.headers)
+        signature = resp.json["data"]["signature"]
+        signer = self.app.app.registry.signers[
+            "/buckets/alice/collections/source"]
+        signer.verify(canonical_json(records, timestamp), signature)
+
+    def test_most_recent_tombstone_is_kept_when_all_are_deleted(self):
+        self.app.delete("/buckets/alice/collections/source/records/r4",
+                        headers=self.headers)
+        self.sign()
+        registry = self.app.app.registry
+        updater_purge = LocalUpdater(
+            source={'bucket': 'alice', 'collection': 'source'},
+            destination={'bucket': 'alice', 'collection': 'destination'},
+            signer=None,
+            storage=registry.storage,
+            permission=registry.permission).purge_destination_tombstones
+        updater_purge(max_count=0)
+        resp = self.app.get("/buckets/alice/collections/destination/records"
+                            "?_since=0", headers=self.headers)
+        assert [r["id"] for r in resp.json["data"]] == ["r4"]
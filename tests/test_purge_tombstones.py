@@ -0,0 +1,59 @@
+import unittest
+
+import mock
+
+from kinto_signer.purge_tombstones import main, purge_tombstones
+
+from .support import BaseWebTest, LocalSignerMixin, get_user_headers
+
+
+class PurgeTombstonesTest(LocalSignerMixin, BaseWebTest,
+                          unittest.TestCase):
+    def get_app_settings(self, extras=None):
+        settings = super(PurgeTombstonesTest, self).get_app_settings(extras)
+        settings['kinto.signer.resources'] = (
+            '/buckets/alice/collections/source;'
+            '/buckets/alice/collections/destination')
+        return settings
+
+    def setUp(self):
+        super(PurgeTombstonesTest, self).setUp()
+        headers = get_user_headers('me')
+        self.app.put_json("/buckets/alice", headers=headers)
+        self.app.put_json("/buckets/alice/collections/source",
+                          headers=headers)
+        for i in range(3):
+            self.app.put_json("/buckets/alice/collections/source/records/r%s"
+                              % i, {"data": {"title": "hello"}},
+                              headers=headers)
+        self.sign(headers)
+        for i in range(3):
+            self.app.delete("/buckets/alice/collections/source/records/r%s"
+                            % i, headers=headers)
+        self.sign(headers)
+        self.registry = self.app.app.registry
+
+    def sign(self, headers):
+        self.app.patch_json("/buckets/alice/collections/source",
+                            {"data": {"status": "to-sign"}},
+                            headers=headers)
+
+    def test_tombstones_are_kept_without_policy(self):
+        purged = purge_tombstones(self.registry)
+        assert purged == {"/buckets/alice/collections/source": 0}
+
+    def test_tombstones_are_purged_according_to_arguments(self):
+        purged = purge_tombstones(self.registry, max_count=1)
+        assert purged == {"/buckets/alice/collections/source": 2}
+
+    def test_command_line_bootstraps_the_application(self):
+        env = {'registry': self.registry, 'closer': mock.MagicMock()}
+        with mock.patch('kinto_signer.purge_tombstones.bootstrap',
+                        return_value=env) as bootstrap:
+            main(['kinto.ini', '--max-age', '0'])
+        bootstrap.assert_called_with('kinto.ini')
+        assert env['closer'].called
+        tombstones, _ = self.registry.storage.get_all(
+            parent_id='/buckets/alice/collections/destination',
+            collection_id='record', include_deleted=True)
+        assert len(tombstones) == 1
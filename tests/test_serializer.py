@@ -1,7 +1,9 @@
 # -*- coding: utf-8 -*-
 import json
 
-from kinto_signer.serializer import canonical_json
+import pytest
+
+from kinto_signer.serializer import canonical_json, iter_canonical_json
 
 #
 # Kinto specific
@@ -28,6 +30,49 @@ def test_orders_records_by_id():
     assert serialized['data'][1]['id'] == '2'
 
 
+def test_accepts_records_iterators():
+    records = [
+        {'bar': 'baz', 'last_modified': '45678', 'id': '2'},
+        {'foo': 'bar', 'last_modified': '12345', 'id': '1'},
+    ]
+    serialized = canonical_json(iter(records), '45678')
+    assert serialized == canonical_json(records, '45678')
+
+
+def test_is_equivalent_to_a_canonical_dump_of_the_payload():
+    records = [
+        {'bar': 'baz', 'last_modified': '45678', 'id': '2'},
+        {'foo': u'Ich ♥ Bücher', 'last_modified': '12345', 'id': '1'},
+    ]
+    payload = {'data': sorted(records, key=lambda r: r['id']),
+               'last_modified': '45678'}
+    expected = json.dumps(payload, sort_keys=True, separators=(',', ':'))
+    assert canonical_json(records, 45678) == expected
+
+
+def test_chunks_are_equal_to_the_canonical_json():
+    records = [
+        {'foo': u'Ich ♥ Bücher', 'last_modified': '12345', 'id': '1'},
+        {'deleted': True, 'last_modified': '12346', 'id': '2'},
+        {'bar': 'baz', 'last_modified': '45678', 'id': '3'},
+    ]
+    chunks = iter_canonical_json(iter(records), 45678)
+    assert ''.join(chunks) == canonical_json(records, 45678)
+
+
+def test_chunks_of_empty_collection_are_equal_to_the_canonical_json():
+    assert ''.join(iter_canonical_json([], 42)) == canonical_json([], 42)
+
+
+def test_chunks_require_records_sorted_by_id():
+    records = [
+        {'bar': 'baz', 'last_modified': '45678', 'id': '2'},
+        {'foo': 'bar', 'last_modified': '12345', 'id': '1'},
+    ]
+    with pytest.raises(ValueError):
+        ''.join(iter_canonical_json(records, 45678))
+
+
 def test_removes_deleted_items():
     record = {'bar': 'baz', 'last_modified': '45678', 'id': '2'}
     deleted_record = {'deleted': True, 'last_modified': '12345', 'id': '1'}
@@ -1,4 +1,5 @@
 from base64 import b64decode, urlsafe_b64encode
+import hashlib
 import tempfile
 import re
 import os
@@ -63,6 +64,19 @@ class ECDSASignerTest(unittest.TestCase):
         signature = self.signer.sign("this is some text")
         self.signer.verify("this is some text", signature)
 
+    def test_signature_can_be_verified_from_the_digest(self):
+        signature = self.signer.sign("this is some text")
+        hasher = hashlib.sha384(self.signer.prefix)
+        for chunk in (b"this is ", b"some text"):
+            hasher.update(chunk)
+        self.signer.verify_digest(hasher.digest(), signature)
+
+    def test_wrong_digest_raises_an_error(self):
+        signature = self.signer.sign("this is some text")
+        digest = hashlib.sha384(b"this is some text").digest()
+        with pytest.raises(exceptions.BadSignatureError):
+            self.signer.verify_digest(digest, signature)
+
     def test_base64url_encoding(self):
         signature_bundle = self.signer.sign("this is some text")
         b64signature = signature_bundle['signature']
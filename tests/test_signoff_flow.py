@@ -1,28 +1,12 @@
 import unittest
 
-import mock
-
-from .support import BaseWebTest, get_user_headers
-
-
-def _patch_autograph():
-    # Patch calls to Autograph.
-    patch = mock.patch('kinto_signer.signer.autograph.requests')
-    mocked = patch.start()
-    mocked.post.return_value.json.return_value = [{
-        "signature": "",
-        "hash_algorithm": "",
-        "signature_encoding": "",
-        "content-signature": "",
-        "x5u": ""}]
-    return patch
+from .support import BaseWebTest, get_user_headers, patch_autograph
 
 
 class PostgresWebTest(BaseWebTest):
     def setUp(self):
         super(PostgresWebTest, self).setUp()
-        patch = _patch_autograph()
-        self.addCleanup(patch.stop)
+        patch_autograph(self)
 
         self.headers = get_user_headers('tarte:en-pion')
         resp = self.app.get("/", headers=self.headers)
@@ -0,0 +1,123 @@
+import gzip
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+import mock
+
+from kinto_signer.serializer import canonical_json
+from kinto_signer.snapshots import snapshot_name, write_snapshot
+
+from .support import BaseWebTest, LocalSignerMixin, get_user_headers
+
+
+class WriteSnapshotTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+        self.serialized = canonical_json([{'id': 'a', 'last_modified': 1}],
+                                         42)
+        self.signature = {'signature': 'abc', 'x5u': ''}
+
+    def test_payload_and_signature_are_written(self):
+        path = write_snapshot(self.directory, self.serialized,
+                              self.signature, 42)
+        name = snapshot_name(self.serialized, 42)
+        assert os.path.basename(path) == name + '.json'
+        assert name.startswith('42-')
+        with open(path, 'rb') as f:
+            assert f.read().decode('utf-8') == self.serialized
+        with open(os.path.join(self.directory,
+                               name + '.signature.json')) as f:
+            assert json.load(f) == self.signature
+
+    def test_payload_can_be_gzipped(self):
+        path = write_snapshot(self.directory, self.serialized,
+                              self.signature, 42, gzipped=True)
+        assert path.endswith('.json.gz')
+        with gzip.open(path, 'rb') as f:
+            assert f.read().decode('utf-8') == self.serialized
+
+    def test_existing_snapshots_are_left_untouched(self):
+        path = write_snapshot(self.directory, self.serialized,
+                              self.signature, 42)
+        mtime = os.path.getmtime(path)
+        os.utime(path, (mtime - 10, mtime - 10))
+        write_snapshot(self.directory, self.serialized, self.signature, 42)
+        assert os.path.getmtime(path) == mtime - 10
+        assert not [f for f in os.listdir(self.directory)
+                    if f.startswith('.tmp-')]
+
+    def test_temporary_file_is_removed_if_write_fails(self):
+        with mock.patch('kinto_signer.snapshots.os.rename',
+                        side_effect=OSError("Disk full")):
+            with self.assertRaises(OSError):
+                write_snapshot(self.directory, '{}', {'a': 1}, 42)
+        assert os.listdir(self.directory) == []
+
+    def test_directory_errors_are_raised(self):
+        path = os.path.join(self.directory, 'file')
+        open(path, 'w').close()
+        with self.assertRaises(OSError):
+            write_snapshot(os.path.join(path, 'sub'), '{}', {'a': 1}, 42)
+
+
+class SignatureSnapshotTest(LocalSignerMixin, BaseWebTest,
+                            unittest.TestCase):
+    def setUp(self):
+        super(SignatureSnapshotTest, self).setUp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def get_app_settings(self, extras=None):
+        self.directory = tempfile.mkdtemp()
+        settings = super(SignatureSnapshotTest, self).get_app_settings(extras)
+        settings['kinto.signer.resources'] = (
+            '/buckets/alice/collections/source;'
+            '/buckets/alice/collections/destination')
+        settings['signer.snapshots_dir'] = self.directory
+        return settings
+
+    def test_signed_payload_is_written_after_signature(self):
+        headers = get_user_headers('me')
+        self.app.put_json("/buckets/alice", headers=headers)
+        self.app.put_json("/buckets/alice/collections/source",
+                          headers=headers)
+        self.app.post_json("/buckets/alice/collections/source/records",
+                           {"data": {"title": "hello"}}, headers=headers)
+        self.app.patch_json("/buckets/alice/collections/source",
+                            {"data": {"status": "to-sign"}},
+                            headers=headers)
+
+        resp = self.app.get("/buckets/alice/collections/destination",
+                            headers=headers)
+        signature = resp.json["data"]["signature"]
+        resp = self.app.get("/buckets/alice/collections/destination/records",
+                            headers=headers)
+        timestamp = resp.headers["ETag"].strip('"')
+        serialized = canonical_json(resp.json["data"], timestamp)
+
+        directory = os.path.join(self.directory, 'alice', 'destination')
+        name = snapshot_name(serialized, timestamp)
+        with open(os.path.join(directory, name + '.json'), 'rb') as f:
+            payload = f.read().decode('utf-8')
+        assert payload == serialized
+        signer = self.app.app.registry.signers[
+            "/buckets/alice/collections/source"]
+        signer.verify(payload, signature)
+
+    def test_signature_succeeds_if_snapshot_cannot_be_written(self):
+        headers = get_user_headers('me')
+        self.app.put_json("/buckets/alice", headers=headers)
+        self.app.put_json("/buckets/alice/collections/source",
+                          headers=headers)
+        with mock.patch('kinto_signer.updater.write_snapshot',
+                        side_effect=OSError("Disk full")):
+            self.app.patch_json("/buckets/alice/collections/source",
+                                {"data": {"status": "to-sign"}},
+                                headers=headers)
+
+        resp = self.app.get("/buckets/alice/collections/source",
+                            headers=headers)
+        assert resp.json["data"]["status"] == "signed"
@@ -1,5 +1,7 @@
 import mock
 import pytest
+import threading
+import time
 import unittest
 
 from kinto.core.storage import Filter, Sort
@@ -34,6 +36,11 @@ class LocalUpdaterTest(unittest.TestCase):
         self.addCleanup(patcher.stop)
         patcher.start()
 
+    def destination_has_records(self):
+        # Every record read by id from the destination exists.
+        self.storage.get_all.side_effect = lambda filters, **kw: (
+            [{'id': id_, 'last_modified': 1} for id_ in filters[0].value], 0)
+
     def patch(self, obj, *args, **kwargs):
         patcher = mock.patch.object(obj, *args, **kwargs)
         self.addCleanup(patcher.stop)
@@ -60,7 +67,10 @@ class LocalUpdaterTest(unittest.TestCase):
             collection_id='record',
             parent_id='/buckets/sourcebucket/collections/sourcecollection',
             include_deleted=True,
-            sorting=[Sort('last_modified', 1)])
+            filters=[],
+            sorting=[Sort('last_modified', 1), Sort('id', 1)],
+            pagination_rules=None,
+            limit=1000)
 
     def test_get_source_records_asks_storage_for_last_modified_records(self):
         records = []
@@ -73,7 +83,9 @@ class LocalUpdaterTest(unittest.TestCase):
             parent_id='/buckets/sourcebucket/collections/sourcecollection',
             include_deleted=True,
             filters=[Filter('last_modified', 1234, COMPARISON.GT)],
-            sorting=[Sort('last_modified', 1)])
+            sorting=[Sort('last_modified', 1), Sort('id', 1)],
+            pagination_rules=None,
+            limit=1000)
 
     def test_get_destination_records(self):
         # We want to test get_destination_records with some records.
@@ -88,33 +100,132 @@ class LocalUpdaterTest(unittest.TestCase):
             collection_id='record',
             parent_id='/buckets/destbucket/collections/destcollection',
             include_deleted=True,
-            sorting=[Sort('last_modified', 1)])
+            filters=[],
+            sorting=[Sort('last_modified', 1), Sort('id', 1)],
+            pagination_rules=None,
+            limit=1000)
+
+    def test_get_destination_timestamp_does_not_read_records(self):
+        self.storage.get_all.return_value = ([{'id': 'a'}], 3)
+        self.storage.collection_timestamp.return_value = 42
+        assert self.updater.get_destination_timestamp() == 42
+        self.storage.get_all.assert_called_with(
+            collection_id='record',
+            parent_id='/buckets/destbucket/collections/destcollection',
+            include_deleted=True,
+            limit=1)
+
+    def test_get_destination_timestamp_is_none_if_empty(self):
+        self.storage.get_all.return_value = ([], 0)
+        assert self.updater.get_destination_timestamp() is None
+        assert not self.storage.collection_timestamp.called
+
+    def test_get_records_are_read_by_pages(self):
+        self.updater.page_size = 2
+        records = [{'id': str(idx), 'last_modified': idx}
+                   for idx in range(1, 6)]
+        pages = [(records[:2], 5), (records[2:4], 5), (records[4:], 5)]
+        self.storage.get_all.side_effect = pages
+
+        iterator, _ = self.updater.get_destination_records()
+        assert self.storage.get_all.call_count == 1
+
+        assert list(iterator) == records
+        assert self.storage.get_all.call_count == 3
+        _, kwargs = self.storage.get_all.call_args
+        assert kwargs['limit'] == 2
+        assert kwargs['pagination_rules'] == [
+            [Filter('last_modified', 4, COMPARISON.GT)],
+            [Filter('last_modified', 4, COMPARISON.EQ),
+             Filter('id', '4', COMPARISON.GT)]]
+
+    def test_get_records_stops_when_last_page_is_full(self):
+        self.updater.page_size = 2
+        records = [{'id': str(idx), 'last_modified': idx}
+                   for idx in range(1, 3)]
+        self.storage.get_all.side_effect = [(records, 2), ([], 2)]
+
+        iterator, _ = self.updater.get_destination_records()
+        assert list(iterator) == records
+        assert self.storage.get_all.call_count == 2
+
+    def test_get_records_stops_if_first_page_is_returned_again(self):
+        self.updater.page_size = 2
+        records = [{'id': str(idx), 'last_modified': idx}
+                   for idx in range(1, 3)]
+        self.storage.get_all.side_effect = [(records, 2), (records, 2)]
+
+        iterator, _ = self.updater.get_destination_records()
+        assert list(iterator) == records
+        assert self.storage.get_all.call_count == 2
 
     def test_push_records_to_destination(self):
-        self.patch(self.updater, 'get_destination_records',
-                   return_value=([], 1324))
+        self.patch(self.updater, 'get_destination_timestamp',
+                   return_value=1324)
         records = [{'id': idx, 'foo': 'bar %s' % idx} for idx in range(1, 4)]
         self.patch(self.updater, 'get_source_records',
                    return_value=(records, 1325))
+        self.destination_has_records()
         self.updater.push_records_to_destination(DummyRequest())
         assert self.storage.update.call_count == 3
 
+    def test_push_records_builds_one_fake_request_per_action(self):
+        self.patch(self.updater, 'get_destination_timestamp',
+                   return_value=1324)
+        records = [{'id': idx, 'foo': 'bar %s' % idx, 'last_modified': idx}
+                   for idx in range(0, 5)]
+        records.extend([{'id': idx, 'deleted': True, 'last_modified': 42}
+                        for idx in range(5, 8)])
+        self.patch(self.updater, 'get_source_records',
+                   return_value=(records, 1325))
+        self.destination_has_records()
+        self.storage.update.side_effect = lambda record, **kw: record
+        self.storage.delete.side_effect = lambda **kw: {
+            'id': kw['object_id'], 'deleted': True, 'last_modified': 42}
+
+        with mock.patch('kinto_signer.updater.build_request') as build:
+            self.updater.push_records_to_destination(DummyRequest())
+
+        assert build.call_count == 2
+        fakerequest = build.return_value
+        assert fakerequest.notify_resource_event.call_count == 8
+
+    def test_push_records_reads_destination_records_once_per_page(self):
+        self.updater.page_size = 2
+        self.patch(self.updater, 'get_destination_timestamp',
+                   return_value=None)
+        records = [{'id': idx, 'last_modified': idx} for idx in range(5)]
+        self.patch(self.updater, 'get_source_records',
+                   return_value=(iter(records), 1325))
+        self.storage.get_all.return_value = ([{'id': 1, 'last_modified': 1}],
+                                             1)
+        self.updater.push_records_to_destination(DummyRequest())
+
+        assert not self.storage.get.called
+        assert self.storage.get_all.call_count == 3
+        _, kwargs = self.storage.get_all.call_args_list[0]
+        assert kwargs['filters'] == [Filter('id', [0, 1], COMPARISON.IN)]
+        assert kwargs['limit'] == 2
+        assert self.storage.update.call_count == 1
+        assert self.storage.create.call_count == 4
+
     def test_push_records_to_destination_raises_if_storage_is_misconfigured(self):
-        self.patch(self.updater, 'get_destination_records',
-                   return_value=([], 1324))
+        self.patch(self.updater, 'get_destination_timestamp',
+                   return_value=1324)
         self.patch(self.updater, 'get_source_records',
                    return_value=([], 1234))
         with pytest.raises(ValueError):
             self.updater.push_records_to_destination(DummyRequest())
 
     def test_push_records_removes_deleted_records(self):
-        self.patch(self.updater, 'get_destination_records',
-                   return_value=([], 1324))
+        self.patch(self.updater, 'get_destination_timestamp',
+                   return_value=1324)
         records = [{'id': idx, 'foo': 'bar %s' % idx} for idx in range(0, 2)]
         records.extend([{'id': idx, 'deleted': True, 'last_modified': 42}
                         for idx in range(3, 5)])
         self.patch(self.updater, 'get_source_records',
                    return_value=(records, 1325))
+        self.destination_has_records()
         self.updater.push_records_to_destination(DummyRequest())
         self.updater.get_source_records.assert_called_with(last_modified=1324)
         assert self.storage.update.call_count == 2
@@ -124,22 +235,24 @@ class LocalUpdaterTest(unittest.TestCase):
         # In case the record doesn't exists in the destination
         # a RecordNotFoundError is raised.
         self.storage.delete.side_effect = RecordNotFoundError()
-        self.patch(self.updater, 'get_destination_records',
-                   return_value=([], 1324))
+        self.patch(self.updater, 'get_destination_timestamp',
+                   return_value=1324)
         records = [{'id': idx, 'foo': 'bar %s' % idx} for idx in range(0, 2)]
         records.extend([{'id': idx, 'deleted': True, 'last_modified': 42}
                        for idx in range(3, 5)])
         self.patch(self.updater, 'get_source_records',
                    return_value=(records, 1325))
+        self.destination_has_records()
         # Calling the updater should not raise the RecordNotFoundError.
         self.updater.push_records_to_destination(DummyRequest())
 
     def test_push_records_to_destination_with_no_destination_changes(self):
-        self.patch(self.updater, 'get_destination_records',
-                   return_value=([], None))
+        self.patch(self.updater, 'get_destination_timestamp',
+                   return_value=None)
         records = [{'id': idx, 'foo': 'bar %s' % idx} for idx in range(1, 4)]
         self.patch(self.updater, 'get_source_records',
                    return_value=(records, 1325))
+        self.destination_has_records()
         self.updater.push_records_to_destination(DummyRequest())
         self.updater.get_source_records.assert_called_with(last_modified=None)
         assert self.storage.update.call_count == 3
@@ -158,6 +271,40 @@ class LocalUpdaterTest(unittest.TestCase):
                 'signature': mock.sentinel.signature
             })
 
+    def test_set_destination_signature_bootstraps_deleted_destination(self):
+        # The destination was deleted by another node.
+        request = DummyRequest()
+        request.bound_data = {}
+        request.registry.signer_bootstrapped = {
+            '/buckets/destbucket/collections/destcollection'}
+        created = {'id': 'destcollection', 'last_modified': 1234}
+        self.storage.get.side_effect = RecordNotFoundError()
+        self.storage.create.return_value = created
+        with mock.patch('kinto_signer.updater.transaction'):
+            self.updater.set_destination_signature(mock.sentinel.signature,
+                                                   request)
+
+        assert request.registry.signer_bootstrapped == set()
+        self.storage.create.assert_called_with(
+            collection_id='collection',
+            parent_id='/buckets/destbucket',
+            record={'id': 'destcollection'})
+        _, kwargs = self.storage.update.call_args
+        assert kwargs['record']['signature'] == mock.sentinel.signature
+
+    def test_set_destination_signature_stores_the_signed_timestamp(self):
+        self.storage.get.return_value = {'id': 1234, 'last_modified': 1234}
+        self.updater.set_destination_signature(mock.sentinel.signature,
+                                               DummyRequest(), 1325)
+
+        self.storage.update.assert_any_call(
+            parent_id='',
+            collection_id='signer-timestamp',
+            object_id='/buckets/destbucket/collections/destcollection',
+            record={'bucket': 'destbucket',
+                    'collection': 'destcollection',
+                    'timestamp': 1325})
+
     def test_update_source_status_modifies_the_source_collection(self):
         self.storage.get.return_value = {'id': 1234, 'last_modified': 1234,
                                          'status': 'to-sign'}
@@ -173,6 +320,288 @@ class LocalUpdaterTest(unittest.TestCase):
                 'status': "signed"
             })
 
+    def test_push_records_returns_the_changeset(self):
+        records = [{'id': 'a', 'last_modified': 1},
+                   {'id': 'b', 'deleted': True, 'last_modified': 2}]
+        self.patch(self.updater, 'get_destination_timestamp',
+                   return_value=42)
+        self.patch(self.updater, 'get_source_records',
+                   return_value=(iter(records), 1325))
+        self.destination_has_records()
+        changeset = self.updater.push_records_to_destination(DummyRequest())
+        assert changeset == {'since': 42, 'changed': ['a'], 'deleted': ['b']}
+
+    def test_changeset_is_stored_if_enabled(self):
+        self.updater.changesets_enabled = True
+        self.updater.store_changeset(
+            {'since': 42, 'changed': ['b', 'a'], 'deleted': []}, 1325)
+        self.storage.create.assert_called_with(
+            parent_id='/buckets/destbucket/collections/destcollection',
+            collection_id='signer-changeset',
+            record={'id': '42-1325', 'since': 42, 'until': 1325,
+                    'changed': ['a', 'b'], 'deleted': []})
+
+    def test_existing_changeset_is_kept(self):
+        self.updater.changesets_enabled = True
+        self.storage.create.side_effect = UnicityError('id', {'id': '42-1325'})
+        self.updater.store_changeset(
+            {'since': 42, 'changed': ['a'], 'deleted': []}, 1325)
+        assert self.storage.create.called
+
+    def test_changeset_is_not_stored_on_first_signature(self):
+        self.updater.changesets_enabled = True
+        self.updater.store_changeset(
+            {'since': None, 'changed': ['a'], 'deleted': []}, 1325)
+        assert not self.storage.create.called
+
+    def test_changeset_is_not_stored_if_disabled(self):
+        self.updater.store_changeset(
+            {'since': 42, 'changed': ['a'], 'deleted': []}, 1325)
+        assert not self.storage.create.called
+
+    def test_snapshot_is_written_once_committed(self):
+        self.updater.snapshots_dir = '/snapshots'
+        with mock.patch('kinto_signer.updater.transaction') as mocked:
+            self.updater.write_snapshot_after_commit('{}', {'a': 1}, 42)
+            hook, = mocked.get.return_value.addAfterCommitHook.call_args[0]
+        with mock.patch('kinto_signer.updater.write_snapshot') as write:
+            hook(False)
+            assert not write.called
+            hook(True)
+            write.assert_called_with('/snapshots/destbucket/destcollection',
+                                     '{}', {'a': 1}, 42, gzipped=False)
+
+    def test_snapshot_errors_are_logged(self):
+        self.updater.snapshots_dir = '/snapshots'
+        with mock.patch('kinto_signer.updater.transaction') as mocked:
+            self.updater.write_snapshot_after_commit('{}', {'a': 1}, 42)
+            hook, = mocked.get.return_value.addAfterCommitHook.call_args[0]
+        with mock.patch('kinto_signer.updater.write_snapshot',
+                        side_effect=OSError("Disk full")):
+            with mock.patch('kinto_signer.updater.logger') as logger:
+                hook(True)
+        assert logger.exception.called
+
+    def test_snapshot_is_not_scheduled_if_disabled(self):
+        with mock.patch('kinto_signer.updater.transaction') as mocked:
+            self.updater.write_snapshot_after_commit('{}', {'a': 1}, 42)
+        assert not mocked.get.called
+
+    def test_phases_are_timed_if_statsd_is_configured(self):
+        self.updater.statsd = mock.MagicMock()
+        self.storage.get_all.return_value = ([], 0)
+        self.patch(self.updater, 'store_signature')
+        self.updater.sign_and_update_destination(DummyRequest())
+
+        keys = [args[0] for args, _ in
+                self.updater.statsd.timer.call_args_list]
+        prefix = 'plugins.signer.sourcebucket.sourcecollection.'
+        for phase in ('create_destination', 'destination_read', 'push',
+                      'source_read', 'serialize', 'sign', 'events'):
+            assert prefix + phase in keys
+
+    def test_records_and_payload_size_are_counted(self):
+        self.updater.statsd = mock.MagicMock()
+        records = [{'id': 'a', 'last_modified': 1}]
+        serialized = self.updater.serialize_records(iter(records), 1)
+        signature = self.updater.sign_payload(serialized)
+        assert signature == self.signer_instance.sign.return_value
+
+        incr = self.updater.statsd._client.incr
+        prefix = 'plugins.signer.sourcebucket.sourcecollection.'
+        incr.assert_any_call(prefix + 'records_signed', count=1)
+        payload = self.signer_instance.sign.call_args[0][0]
+        incr.assert_any_call(prefix + 'payload_bytes', count=len(payload))
+
+    def test_concurrent_signatures_of_same_payload_share_the_signer(self):
+        self.updater.statsd = mock.MagicMock()
+        release = threading.Event()
+
+        def sign(payload):
+            release.wait()
+            return {'signature': payload}
+
+        self.signer_instance.sign.side_effect = sign
+        results = []
+        threads = [threading.Thread(target=lambda: results.append(
+            self.updater.sign_payload('{"data":[]}'))) for _ in range(2)]
+        threads[0].start()
+        while not self.updater.flights._calls:
+            time.sleep(0.001)
+        threads[1].start()
+        flight, = self.updater.flights._calls.values()
+        while flight.followers == 0:
+            time.sleep(0.001)
+        release.set()
+        for thread in threads:
+            thread.join()
+
+        assert self.signer_instance.sign.call_count == 1
+        assert results == [{'signature': '{"data":[]}'}] * 2
+        self.updater.statsd._client.incr.assert_any_call(
+            'plugins.signer.sourcebucket.sourcecollection.coalesced',
+            count=1)
+
+    def test_different_payloads_are_signed_separately(self):
+        self.updater.sign_payload('{"data":[]}')
+        self.updater.sign_payload('{"data":[1]}')
+        assert self.signer_instance.sign.call_count == 2
+
+    def test_signature_is_profiled_if_enabled(self):
+        self.updater.profiler = mock.MagicMock()
+        self.patch(self.updater, 'create_destination')
+        self.patch(self.updater, 'push_records_to_destination')
+        self.patch(self.updater, 'get_destination_records',
+                   return_value=([], 1324))
+        self.patch(self.updater, 'store_signature')
+        self.updater.sign_and_update_destination(DummyRequest())
+        self.updater.profiler.profile.assert_called_with(
+            'sourcebucket_sourcecollection')
+
+    def test_memory_peak_is_reported_if_enabled(self):
+        self.updater.statsd = mock.MagicMock()
+        self.updater.memory_tracker = mock.MagicMock()
+        stats = {'peak': 42, 'top': ['a.py:1: size=42 B']}
+        track = self.updater.memory_tracker.track.return_value
+        track.__enter__.return_value = stats
+        self.patch(self.updater, 'create_destination')
+        self.patch(self.updater, 'push_records_to_destination')
+        self.patch(self.updater, 'get_destination_records',
+                   return_value=([{'id': 'a', 'last_modified': 1}], 1324))
+        self.patch(self.updater, 'store_signature')
+
+        with mock.patch('kinto_signer.updater.logger') as logger:
+            self.updater.sign_and_update_destination(DummyRequest())
+
+        message = logger.info.call_args[0][0]
+        assert '42 bytes peak for 1 records' in message
+        assert 'a.py:1: size=42 B' in message
+        self.updater.statsd._client.gauge.assert_called_with(
+            'plugins.signer.sourcebucket.sourcecollection.memory_peak', 42)
+        assert self.updater.memory_tracker.checkpoint.called
+
+    def test_memory_peak_is_logged_without_statsd(self):
+        self.updater.memory_tracker = mock.MagicMock()
+        track = self.updater.memory_tracker.track.return_value
+        track.__enter__.return_value = {'peak': 42, 'top': []}
+        self.patch(self.updater, 'create_destination')
+        self.patch(self.updater, 'push_records_to_destination')
+        self.patch(self.updater, 'get_destination_records',
+                   return_value=([], 1324))
+        self.patch(self.updater, 'store_signature')
+
+        with mock.patch('kinto_signer.updater.logger') as logger:
+            self.updater.sign_and_update_destination(DummyRequest())
+
+        assert '42 bytes peak' in logger.info.call_args[0][0]
+
+    def test_gauge_is_ignored_without_statsd(self):
+        assert self.updater.statsd is None
+        self.updater.gauge('memory_peak', 42)
+
+    def test_gauge_is_sent_if_statsd_is_configured(self):
+        self.updater.statsd = mock.MagicMock()
+        self.updater.gauge('memory_peak', 42)
+        self.updater.statsd._client.gauge.assert_called_with(
+            'plugins.signer.sourcebucket.sourcecollection.memory_peak', 42)
+
+    def test_tombstones_are_not_purged_without_policy(self):
+        assert self.updater.purge_destination_tombstones() == 0
+        assert not self.storage.purge_deleted.called
+
+    def test_tombstones_are_purged_by_count(self):
+        self.storage.get_all.return_value = ([
+            {'id': 'a', 'deleted': True, 'last_modified': 30},
+            {'id': 'b', 'deleted': True, 'last_modified': 20}], 5)
+        self.updater.purge_destination_tombstones(max_count=2)
+        self.storage.get_all.assert_called_with(
+            parent_id='/buckets/destbucket/collections/destcollection',
+            collection_id='record',
+            include_deleted=True,
+            filters=[Filter('deleted', True, COMPARISON.EQ)],
+            sorting=[Sort('last_modified', -1)],
+            limit=2)
+        self.storage.purge_deleted.assert_called_with(
+            parent_id='/buckets/destbucket/collections/destcollection',
+            collection_id='record',
+            before=20)
+
+    def test_tombstones_are_purged_by_age(self):
+        self.updater.tombstones_max_age = 60
+        self.storage.get_all.return_value = ([
+            {'id': 'a', 'deleted': True, 'last_modified': 3600000}], 5)
+        with mock.patch('kinto_signer.updater.time.time', return_value=600):
+            self.updater.purge_destination_tombstones()
+        self.storage.purge_deleted.assert_called_with(
+            parent_id='/buckets/destbucket/collections/destcollection',
+            collection_id='record',
+            before=540000)
+
+    def test_most_recent_tombstone_is_never_purged(self):
+        self.storage.get_all.return_value = ([
+            {'id': 'a', 'deleted': True, 'last_modified': 42}], 1)
+        self.updater.purge_destination_tombstones(max_age=0)
+        assert self.storage.purge_deleted.call_args[1]['before'] == 42
+
+    def test_tombstones_are_not_purged_if_less_than_count(self):
+        self.storage.get_all.return_value = ([
+            {'id': 'a', 'deleted': True, 'last_modified': 42}], 1)
+        assert self.updater.purge_destination_tombstones(max_count=2) == 0
+        assert not self.storage.purge_deleted.called
+
+    def test_changesets_are_purged_with_tombstones(self):
+        self.updater.changesets_enabled = True
+        self.storage.get_all.return_value = ([
+            {'id': 'a', 'deleted': True, 'last_modified': 30},
+            {'id': 'b', 'deleted': True, 'last_modified': 20}], 5)
+        self.updater.purge_destination_tombstones(max_count=2)
+        self.storage.delete_all.assert_called_with(
+            parent_id='/buckets/destbucket/collections/destcollection',
+            collection_id='signer-changeset',
+            filters=[Filter('until', 20, COMPARISON.LT)],
+            with_deleted=False)
+
+    def test_changesets_are_purged_by_age_without_tombstones(self):
+        self.updater.changesets_enabled = True
+        self.storage.get_all.return_value = ([], 0)
+        self.storage.delete_all.return_value = [{'id': '1-2'}]
+        with mock.patch('kinto_signer.updater.time.time', return_value=600):
+            assert self.updater.purge_destination_tombstones(max_age=60) == 0
+        assert not self.storage.purge_deleted.called
+        assert self.storage.delete_all.call_args[1]['filters'] == [
+            Filter('until', 540000, COMPARISON.LT)]
+
+    def test_changesets_are_not_purged_if_disabled(self):
+        assert self.updater.purge_destination_changesets(42) == 0
+        assert not self.storage.delete_all.called
+
+    def test_collection_records_are_read_once_per_transaction(self):
+        self.storage.get.return_value = {'id': 1234, 'last_modified': 1234}
+        self.storage.update.side_effect = lambda record, **kw: dict(
+            last_modified=1235, **record)
+        request = DummyRequest()
+        request.bound_data = {}
+
+        self.updater.update_source_editor(request)
+        self.updater.store_signature(mock.sentinel.signature, request)
+        # One read per collection, the source record comes from the cache.
+        assert self.storage.get.call_count == 2
+        last_update = self.storage.update.call_args[1]['record']
+        assert last_update['last_editor'] == 'basicauth:bob'
+        assert last_update['status'] == 'signed'
+
+    def test_collection_records_are_read_again_in_other_transaction(self):
+        self.storage.get.return_value = {'id': 1234, 'last_modified': 1234}
+        request = DummyRequest()
+        request.bound_data = {}
+
+        with mock.patch('kinto_signer.updater.transaction') as txn:
+            txn.get.return_value = mock.sentinel.first
+            self.updater.update_source_editor(request)
+            txn.get.return_value = mock.sentinel.second
+            self.updater.update_source_editor(request)
+        assert self.storage.get.call_count == 2
+
     def test_create_destination_updates_collection_permissions(self):
         collection_id = '/buckets/destbucket/collections/destcollection'
         self.updater.create_destination(DummyRequest())
@@ -195,6 +624,27 @@ class LocalUpdaterTest(unittest.TestCase):
             parent_id=bucket_id,
             record={"id": 'destcollection'})
 
+    def test_create_destination_is_skipped_if_already_bootstrapped(self):
+        request = DummyRequest()
+        request.registry.signer_bootstrapped = {
+            '/buckets/destbucket/collections/destcollection'}
+        self.updater.create_destination(request)
+        assert not self.storage.create.called
+        assert not self.permission.replace_object_permissions.called
+
+    def test_create_destination_is_remembered_once_committed(self):
+        request = DummyRequest()
+        request.registry.signer_bootstrapped = set()
+        with mock.patch('kinto_signer.updater.transaction') as mocked:
+            self.updater.create_destination(request)
+            hook, = mocked.get.return_value.addAfterCommitHook.call_args[0]
+        assert request.registry.signer_bootstrapped == set()
+        hook(False)
+        assert request.registry.signer_bootstrapped == set()
+        hook(True)
+        assert request.registry.signer_bootstrapped == {
+            '/buckets/destbucket/collections/destcollection'}
+
     def test_ensure_resource_exists_handles_uniticy_errors(self):
         self.storage.create.side_effect = UnicityError('id', 'record')
         self.updater._ensure_resource_exists('bucket', '', 'abcd',
@@ -1,6 +1,16 @@
+import copy
+import itertools
+import os
+import pstats
+import shutil
+import tempfile
+import threading
+import time
 import unittest
 
+import mock
 import pytest
+from kinto.core.cache import memory as memory_cache
 from pyramid.exceptions import ConfigurationError
 
 from kinto_signer import utils
@@ -95,3 +105,368 @@ class ParseResourcesTest(unittest.TestCase):
         )
         with self.assertRaises(ConfigurationError):
             utils.parse_resources(raw_resources)
+
+
+class IndexResourcesTest(unittest.TestCase):
+    def test_keys_are_indexed_by_source_bucket_and_collection(self):
+        resources = utils.parse_resources("""
+        /buckets/sbid/collections/scid;/buckets/dbid/collections/dcid
+        /buckets/sbid/collections/other;/buckets/dbid/collections/dother
+        """)
+        assert utils.index_resources(resources) == {
+            ('sbid', 'scid'): '/buckets/sbid/collections/scid',
+            ('sbid', 'other'): '/buckets/sbid/collections/other',
+        }
+
+
+class SingleFlightTest(unittest.TestCase):
+    def setUp(self):
+        self.flights = utils.SingleFlight()
+        self.started = threading.Event()
+        self.release = threading.Event()
+
+    def follow(self, func, results):
+        def _follow():
+            try:
+                results.append(self.flights.do("key", func))
+            except ValueError as e:
+                results.append(e)
+
+        follower = threading.Thread(target=_follow)
+        follower.start()
+        while self.flights._calls["key"].followers == 0:
+            time.sleep(0.001)
+        return follower
+
+    def test_returns_result_of_the_call(self):
+        result = self.flights.do("key", lambda x: x * 2, 21)
+        assert result == (42, False)
+
+    def test_concurrent_calls_share_the_result_of_the_first_one(self):
+        calls = []
+
+        def slow():
+            calls.append(1)
+            self.started.set()
+            self.release.wait()
+            return "result"
+
+        results = []
+        leader = threading.Thread(
+            target=lambda: results.append(self.flights.do("key", slow)))
+        leader.start()
+        self.started.wait()
+        follower = self.follow(slow, results)
+        self.release.set()
+        leader.join()
+        follower.join()
+
+        assert len(calls) == 1
+        assert sorted(results) == [("result", False), ("result", True)]
+        assert self.flights._calls == {}
+
+    def test_calls_are_not_shared_once_finished(self):
+        self.flights.do("key", lambda: 1)
+        assert self.flights.do("key", lambda: 2) == (2, False)
+
+    def test_errors_are_raised_to_every_caller(self):
+        def fail():
+            self.started.set()
+            self.release.wait()
+            raise ValueError("boom")
+
+        leader = threading.Thread(
+            target=lambda: pytest.raises(ValueError, self.flights.do,
+                                         "key", fail))
+        leader.start()
+        self.started.wait()
+        errors = []
+        follower = self.follow(fail, errors)
+        self.release.set()
+        leader.join()
+        follower.join()
+        assert isinstance(errors[0], ValueError)
+
+
+class CacheLockTest(unittest.TestCase):
+    def setUp(self):
+        self.cache = memory_cache.Cache(cache_prefix="")
+        self.lock = utils.CacheLock(self.cache, ttl=10)
+
+    def test_lock_is_stored_in_cache_with_ttl(self):
+        token = self.lock.acquire("key")
+        assert self.cache.get("signer.lock.key") == token
+        assert 0 < self.cache.ttl("signer.lock.key") <= 10
+
+    def test_lock_is_rejected_if_already_held(self):
+        self.lock.acquire("key")
+        with pytest.raises(utils.SigningLockedError):
+            self.lock.acquire("key")
+
+    def test_other_keys_are_not_locked(self):
+        self.lock.acquire("key")
+        self.lock.acquire("other")
+
+    def test_lock_can_be_acquired_once_released(self):
+        with self.lock.hold("key"):
+            pass
+        assert self.cache.get("signer.lock.key") is None
+        self.lock.acquire("key")
+
+    def test_release_does_not_remove_lock_taken_by_someone_else(self):
+        self.cache.set("signer.lock.key", "other-token")
+        self.lock.release("key", "token")
+        assert self.cache.get("signer.lock.key") == "other-token"
+
+    def test_waits_for_the_lock_to_be_released(self):
+        self.lock.wait_timeout = 1
+        self.lock.poll_interval = 0.01
+        token = self.lock.acquire("key")
+        releaser = threading.Timer(0.05, self.lock.release,
+                                   args=("key", token))
+        releaser.start()
+        self.lock.acquire("key")
+        releaser.join()
+
+    def test_rejections_and_waits_are_reported_to_statsd(self):
+        self.lock.statsd = mock.MagicMock()
+        self.lock.acquire("key")
+        with pytest.raises(utils.SigningLockedError):
+            with self.lock.hold("key"):
+                pass
+        self.lock.statsd.timer.assert_called_with("plugins.signer.lock_wait")
+        self.lock.statsd.count.assert_called_with(
+            "plugins.signer.lock_rejected")
+
+    def test_acquire_is_timed_without_hold(self):
+        self.lock.statsd = mock.MagicMock()
+        self.lock.acquire("key")
+        self.lock.statsd.timer.assert_called_with("plugins.signer.lock_wait")
+
+    def test_lease_is_renewed_while_held(self):
+        self.lock.ttl = 0.2
+        token = self.lock.acquire("key")
+        time.sleep(0.5)
+        assert self.cache.get("signer.lock.key") == token
+        self.lock.release("key", token)
+        assert self.cache.get("signer.lock.key") is None
+        assert self.lock._held == {}
+
+    def test_one_thread_renews_every_lock(self):
+        self.lock.ttl = 0.2
+        first = self.lock.acquire("key")
+        renewal = self.lock._renewal
+        second = self.lock.acquire("other")
+        assert self.lock._renewal is renewal
+        time.sleep(0.5)
+        assert self.cache.get("signer.lock.key") == first
+        assert self.cache.get("signer.lock.other") == second
+        self.lock.release("key", first)
+        self.lock.release("other", second)
+
+    def test_renewal_thread_stops_once_every_lock_is_released(self):
+        self.lock.ttl = 0.1
+        with self.lock.hold("key"):
+            renewal = self.lock._renewal
+        renewal.join(1)
+        assert not renewal.is_alive()
+        assert self.lock._renewal is None
+
+    def test_release_can_be_called_several_times(self):
+        token = self.lock.acquire("key")
+        self.lock.release("key", token)
+        self.lock.release("key", token)
+        assert self.cache.get("signer.lock.key") is None
+
+    def test_renewal_stops_if_the_lock_was_lost(self):
+        self.lock.ttl = 0.1
+        with mock.patch('kinto_signer.utils.logger') as mocked:
+            self.lock.acquire("key")
+            self.cache.set("signer.lock.key", "other-token")
+            deadline = time.time() + 1
+            while not mocked.warning.called and time.time() < deadline:
+                time.sleep(0.01)
+        assert mocked.warning.called
+        assert self.cache.get("signer.lock.key") == "other-token"
+
+
+class DebouncerTest(unittest.TestCase):
+    def setUp(self):
+        self.debouncer = utils.Debouncer()
+        self.done = threading.Event()
+        self.calls = []
+
+    def run_once(self, *args):
+        self.calls.append(args)
+        self.done.set()
+
+    def test_runs_function_after_delay(self):
+        assert self.debouncer.schedule("key", 0.01, self.run_once, 42)
+        assert self.done.wait(1)
+        assert self.calls == [(42,)]
+
+    def test_calls_within_the_window_are_ignored(self):
+        assert self.debouncer.schedule("key", 0.05, self.run_once, 1)
+        assert not self.debouncer.schedule("key", 0.05, self.run_once, 2)
+        assert self.done.wait(1)
+        assert self.calls == [(1,)]
+
+    def test_a_new_run_can_be_scheduled_once_run(self):
+        self.debouncer.schedule("key", 0.01, self.run_once, 1)
+        assert self.done.wait(1)
+        while self.debouncer.schedule("key", 0.01, self.run_once, 2) is False:
+            pass  # Wait for the first timer to be released.
+
+    def test_errors_are_logged(self):
+        def fail():
+            self.done.set()
+            raise ValueError()
+
+        with mock.patch('kinto_signer.utils.logger') as mocked:
+            self.debouncer.schedule("key", 0.01, fail)
+            assert self.done.wait(1)
+            while not mocked.exception.called:
+                pass
+
+
+class ProfilerTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def profile(self, profiler, duration=0):
+        with mock.patch('kinto_signer.utils.time.time',
+                        side_effect=itertools.chain(
+                            [1.0], itertools.repeat(1.0 + duration))):
+            with profiler.profile('a_b'):
+                sum(range(10))
+
+    def test_slow_signatures_are_dumped(self):
+        profiler = utils.Profiler(self.directory, threshold=2)
+        self.profile(profiler, duration=3)
+        assert os.listdir(self.directory) == ['a_b-1000.prof']
+        pstats.Stats(os.path.join(self.directory, 'a_b-1000.prof'))
+
+    def test_fast_signatures_are_not_dumped(self):
+        profiler = utils.Profiler(self.directory, threshold=2)
+        self.profile(profiler, duration=1)
+        assert os.listdir(self.directory) == []
+
+    def test_sampled_signatures_are_dumped(self):
+        profiler = utils.Profiler(self.directory, sample_rate=0.5)
+        with mock.patch('kinto_signer.utils.random.random',
+                        return_value=0.1):
+            self.profile(profiler)
+        assert len(os.listdir(self.directory)) == 1
+
+    def test_signatures_are_not_profiled_unless_sampled(self):
+        profiler = utils.Profiler(self.directory, sample_rate=0.5)
+        with mock.patch('kinto_signer.utils.random.random',
+                        return_value=0.9):
+            with mock.patch('kinto_signer.utils.cProfile') as cprofile:
+                with profiler.profile('a_b'):
+                    pass
+        assert not cprofile.Profile.called
+
+    def test_write_errors_are_logged(self):
+        profiler = utils.Profiler('/unknown/folder', threshold=0)
+        with mock.patch('kinto_signer.utils.logger') as logger:
+            self.profile(profiler)
+        assert logger.exception.called
+
+
+@pytest.mark.skipif(utils.tracemalloc is None, reason="Requires tracemalloc")
+class MemoryTrackerTest(unittest.TestCase):
+    def setUp(self):
+        self.tracker = utils.MemoryTracker(top=3)
+
+    def test_peak_of_allocated_memory_is_measured(self):
+        with self.tracker.track() as stats:
+            data = bytearray(1024 * 1024)
+            del data
+        assert stats['peak'] >= 1024 * 1024
+        assert len(stats['top']) <= 3
+
+    def test_tracing_is_stopped_once_done(self):
+        with self.tracker.track():
+            with self.tracker.track():
+                assert utils.tracemalloc.is_tracing()
+            assert utils.tracemalloc.is_tracing()
+        assert not utils.tracemalloc.is_tracing()
+
+    def test_checkpoint_snapshots_the_allocation_sites(self):
+        with self.tracker.track() as stats:
+            data = bytearray(1024 * 1024)  # NOQA
+            self.tracker.checkpoint()
+            top = stats['top']
+            del data
+        assert stats['top'] is top
+        assert top[0].size >= 1024 * 1024
+
+    def test_checkpoint_is_ignored_if_not_tracked(self):
+        self.tracker.checkpoint()
+
+
+class StatsdClientTest(unittest.TestCase):
+    def test_underlying_client_is_returned(self):
+        statsd = mock.MagicMock()
+        assert utils.statsd_client(statsd) is statsd._client
+
+
+class InstrumentedBackendTest(unittest.TestCase):
+    def setUp(self):
+        self.backend = mock.MagicMock()
+        self.backend.get_all.return_value = ([{'id': 'a'}, {'id': 'b'}], 2)
+        self.backend.get.return_value = {'id': 'a'}
+        self.backend.collection_timestamp.return_value = 42
+        self.instrumented = utils.InstrumentedBackend(self.backend,
+                                                      name='storage')
+
+    def test_calls_are_forwarded_to_the_backend(self):
+        result = self.instrumented.get(object_id='a')
+        assert result == {'id': 'a'}
+        self.backend.get.assert_called_with(object_id='a')
+
+    def test_calls_and_rows_are_counted_by_method(self):
+        self.instrumented.get_all(parent_id='/buckets/a')
+        self.instrumented.get_all(parent_id='/buckets/b')
+        self.instrumented.get(object_id='a')
+        self.instrumented.collection_timestamp(parent_id='/buckets/a')
+        stats = self.instrumented.stats()
+        assert stats['get_all']['calls'] == 2
+        assert stats['get_all']['rows'] == 4
+        assert stats['get']['rows'] == 1
+        assert stats['collection_timestamp']['rows'] == 0
+        assert stats['get']['time'] >= 0
+
+    def test_failing_calls_are_counted(self):
+        self.backend.get.side_effect = ValueError
+        with pytest.raises(ValueError):
+            self.instrumented.get(object_id='a')
+        assert self.instrumented.stats()['get']['calls'] == 1
+
+    def test_stats_can_be_reset(self):
+        self.instrumented.get(object_id='a')
+        self.instrumented.reset()
+        assert self.instrumented.stats() == {}
+
+    def test_attributes_and_private_methods_are_not_instrumented(self):
+        self.backend.settings = {'a': 1}
+        assert self.instrumented.settings == {'a': 1}
+        self.instrumented._private()
+        assert self.instrumented.stats() == {}
+
+    def test_instrumented_backend_can_be_copied(self):
+        copied = copy.copy(self.instrumented)
+        assert copied.backend is self.backend
+
+    def test_calls_are_sent_to_statsd(self):
+        statsd = mock.MagicMock()
+        instrumented = utils.InstrumentedBackend(self.backend,
+                                                 name='storage',
+                                                 statsd=statsd)
+        instrumented.get_all(parent_id='/buckets/a')
+        timing_key = statsd._client.timing.call_args[0][0]
+        assert timing_key == 'plugins.signer.storage.get_all'
+        statsd._client.incr.assert_called_with(
+            'plugins.signer.storage.get_all.rows', count=2)
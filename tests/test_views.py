@@ -0,0 +1,200 @@
+import unittest
+
+import mock
+import transaction
+from kinto.core.storage import Filter
+from kinto.core.utils import COMPARISON
+
+from kinto_signer.views import merge_changesets
+
+from .support import BaseWebTest, LocalSignerMixin, get_user_headers
+
+
+class MergeChangesetsTest(unittest.TestCase):
+    changesets = [
+        {'since': 10, 'until': 20, 'changed': ['a', 'b'], 'deleted': []},
+        {'since': 20, 'until': 30, 'changed': ['c'], 'deleted': ['a']},
+        {'since': 30, 'until': 40, 'changed': ['a'], 'deleted': ['c']},
+    ]
+
+    def test_changesets_are_merged_from_timestamp(self):
+        merged = merge_changesets(self.changesets, 20)
+        assert merged == {'since': 20, 'until': 40,
+                          'changed': ['a'], 'deleted': ['c']}
+
+    def test_merged_changeset_is_empty_since_latest(self):
+        merged = merge_changesets(self.changesets, 40)
+        assert merged == {'since': 40, 'until': 40,
+                          'changed': [], 'deleted': []}
+
+    def test_unknown_timestamp_returns_none(self):
+        assert merge_changesets(self.changesets, 15) is None
+
+
+class ChangesetViewTest(LocalSignerMixin, BaseWebTest,
+                        unittest.TestCase):
+    def get_app_settings(self, extras=None):
+        settings = super(ChangesetViewTest, self).get_app_settings(extras)
+        settings['kinto.signer.resources'] = (
+            '/buckets/alice/collections/source;'
+            '/buckets/alice/collections/destination')
+        settings['signer.changesets_enabled'] = 'true'
+        return settings
+
+    def setUp(self):
+        super(ChangesetViewTest, self).setUp()
+        self.headers = get_user_headers('me')
+        self.app.put_json("/buckets/alice", headers=self.headers)
+        self.app.put_json("/buckets/alice/collections/source",
+                          headers=self.headers)
+        for i in range(3):
+            self.app.put_json("/buckets/alice/collections/source/records/r%s"
+                              % i, {"data": {"title": "hello"}},
+                              headers=self.headers)
+        self.first = self.sign()
+        self.app.put_json("/buckets/alice/collections/source/records/r0",
+                          {"data": {"title": "bonjour"}},
+                          headers=self.headers)
+        self.app.delete("/buckets/alice/collections/source/records/r1",
+                        headers=self.headers)
+        self.second = self.sign()
+        self.app.put_json("/buckets/alice/collections/source/records/r3",
+                          {"data": {"title": "hola"}},
+                          headers=self.headers)
+        self.third = self.sign()
+
+    def sign(self):
+        self.app.patch_json("/buckets/alice/collections/source",
+                            {"data": {"status": "to-sign"}},
+                            headers=self.headers)
+        resp = self.app.get("/buckets/alice/collections/destination/records",
+                            headers=self.headers)
+        return int(resp.headers["ETag"].strip('"'))
+
+    def get_changeset(self, since, **kwargs):
+        url = "/buckets/alice/collections/destination/changeset?_since=%s"
+        return self.app.get(url % since, **kwargs)
+
+    def test_changes_since_previous_signature_are_returned(self):
+        resp = self.get_changeset(self.second)
+        assert resp.json["data"] == {"since": self.second,
+                                     "until": self.third,
+                                     "changed": ["r3"],
+                                     "deleted": []}
+
+    def test_changes_of_several_signatures_are_merged(self):
+        resp = self.get_changeset(self.first)
+        assert resp.json["data"] == {"since": self.first,
+                                     "until": self.third,
+                                     "changed": ["r0", "r3"],
+                                     "deleted": ["r1"]}
+
+    def test_changeset_is_readable_by_anonymous(self):
+        resp = self.get_changeset(self.third)
+        assert resp.json["data"]["changed"] == []
+
+    def test_unknown_timestamp_returns_404(self):
+        self.get_changeset(self.first + 1, status=404)
+
+    def test_only_changesets_from_timestamp_are_read(self):
+        storage = self.app.app.registry.storage
+        with mock.patch.object(storage, 'get_all',
+                               wraps=storage.get_all) as get_all:
+            self.get_changeset(self.second)
+        _, kwargs = get_all.call_args
+        assert kwargs['filters'] == [Filter('until', self.second,
+                                            COMPARISON.MIN)]
+
+    def test_number_of_merged_changesets_is_limited(self):
+        with mock.patch('kinto_signer.views.MAX_MERGED_CHANGESETS', 1):
+            resp = self.get_changeset(self.first)
+        assert resp.json["data"] == {"since": self.first,
+                                     "until": self.second,
+                                     "changed": ["r0"],
+                                     "deleted": ["r1"]}
+
+    def test_changesets_are_purged_with_tombstones(self):
+        updater, = self.app.app.registry.signer_updaters.values()
+        storage = self.app.app.registry.storage
+        parent_id = '/buckets/alice/collections/destination'
+        with transaction.manager:
+            updater.purge_destination_tombstones(max_count=1)
+        changesets, _ = storage.get_all(parent_id=parent_id,
+                                        collection_id='signer-changeset')
+        untils = sorted(c['until'] for c in changesets)
+        assert untils == [self.second, self.third]
+        resp = self.get_changeset(self.first)
+        assert resp.json["data"]["until"] == self.third
+
+    def test_since_is_required(self):
+        self.app.get("/buckets/alice/collections/destination/changeset",
+                     status=400)
+
+    def test_unknown_destination_returns_404(self):
+        self.app.get("/buckets/alice/collections/source/changeset?_since=1",
+                     status=404)
+
+
+class TimestampsViewTest(LocalSignerMixin, BaseWebTest,
+                         unittest.TestCase):
+    def get_app_settings(self, extras=None):
+        settings = super(TimestampsViewTest, self).get_app_settings(extras)
+        return settings
+
+    def setUp(self):
+        super(TimestampsViewTest, self).setUp()
+        self.headers = get_user_headers('me')
+        self.app.put_json("/buckets/alice", headers=self.headers)
+        self.app.put_json("/buckets/alice/collections/source",
+                          headers=self.headers)
+        self.app.post_json("/buckets/alice/collections/source/records",
+                           {"data": {"title": "hello"}},
+                           headers=self.headers)
+        self.app.patch_json("/buckets/alice/collections/source",
+                            {"data": {"status": "to-sign"}},
+                            headers=self.headers)
+        resp = self.app.get("/buckets/alice/collections/destination/records",
+                            headers=self.headers)
+        self.timestamp = int(resp.headers["ETag"].strip('"'))
+
+    def test_last_signed_timestamps_are_listed(self):
+        resp = self.app.get("/signer/timestamps")
+        data = sorted(resp.json["data"],
+                      key=lambda r: (r["bucket"], r["collection"]))
+        assert data == [
+            {"bucket": "alice", "collection": "destination",
+             "last_modified": self.timestamp},
+            {"bucket": "alice", "collection": "to",
+             "last_modified": None},
+            {"bucket": "bob", "collection": "destination",
+             "last_modified": None},
+        ]
+
+    def test_collections_are_not_queried(self):
+        storage = self.app.app.registry.storage
+        with mock.patch.object(storage, 'collection_timestamp') as ts:
+            with mock.patch.object(storage, 'get_all',
+                                   wraps=storage.get_all) as get_all:
+                self.app.get("/signer/timestamps")
+        assert not ts.called
+        assert get_all.call_count == 1
+
+    def test_timestamps_can_be_polled_with_etag(self):
+        resp = self.app.get("/signer/timestamps")
+        etag = resp.headers["ETag"]
+        resp = self.app.get("/signer/timestamps",
+                            headers={"If-None-Match": etag}, status=304)
+        assert resp.headers["ETag"] == etag
+
+    def test_etag_changes_if_an_older_timestamp_changes(self):
+        resp = self.app.get("/signer/timestamps")
+        etag = resp.headers["ETag"]
+        # Another destination is signed, with a timestamp below the others.
+        storage = self.app.app.registry.storage
+        storage.update(parent_id='', collection_id='signer-timestamp',
+                       object_id='/buckets/bob/collections/destination',
+                       record={'bucket': 'bob', 'collection': 'destination',
+                               'timestamp': self.timestamp - 10})
+        resp = self.app.get("/signer/timestamps",
+                            headers={"If-None-Match": etag}, status=200)
+        assert resp.headers["ETag"] != etag